@@ -22,17 +22,46 @@ Please refer to LICENSE in the project repository for details.
 """
 from flask import Flask
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_bootstrap import Bootstrap
 from flask_mail import Mail
+from flask_security import Security
+from app.routing import RoutingSQLAlchemy
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-Bootstrap(app)
-mail = Mail(app)
-# turn off mail debugging logs
-app.extensions['mail'].debug = 0
-from app import routes
\ No newline at end of file
+db = RoutingSQLAlchemy()
+migrate = Migrate()
+mail = Mail()
+security = Security()
+
+def create_app(config=Config):
+    """
+    create_app builds the Flask app. Nothing here talks to the datastore, so it is cheap enough 
+    to call from the cli, from tests and benchmarks, and from worker processes. 
+    Getting an app ready to serve (creating the tables, the roles and the admin user, and filling 
+    the caches the first request would otherwise pay for) is app.startup's job. 
+
+    Args:
+        config - object to load the settings from, defaults to Config
+    Returns:
+        Flask app
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.init_app(app)
+    migrate.init_app(app, db, render_as_batch=True)
+    Bootstrap(app)
+    mail.init_app(app)
+    # turn off mail debugging logs
+    app.extensions['mail'].debug = 0
+
+    from app.models import user_datastore
+    from app.mailer import Mailer
+    from app import metrics, routes, commands, rollup
+    state = security.init_app(app, user_datastore)
+    # every send_mail call (including flask-security's own emails) is queued in the outbox 
+    # and delivered by the `flask outbox work` process, see app.mailer
+    state.send_mail_task(Mailer.enqueue)
+    app.register_blueprint(routes.bp)
+    metrics.init_app(app)
+    commands.init_app(app)
+    return app
\ No newline at end of file
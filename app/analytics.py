@@ -0,0 +1,168 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Users, DailySummary, Attendance
+from app.rollup import Rollup
+from app.utilities import Utilities
+from config import Config
+import numpy as np
+
+class Analytics:
+    """
+    Analytics answers the operations team's "how did we do" questions for a range of days, 
+    working from the pre-aggregated daily_summary and attendance tables (see app.rollup), plus 
+    the readings of the day or so that hasn't been settled into daily_summary yet. 
+    Rows are pulled once into NumPy arrays and everything else, rates, averages, 
+    unpacking attendance bits into a users x days matrix, is done as whole-array math 
+    rather than row by row in python. 
+    """
+    @staticmethod
+    def days(start=None, end=None):
+        """
+        days builds the array of dates covered by a report. 
+        end defaults to today and start to Config.ANALYTICS_DAYS days before end. 
+
+        Args:
+            start - YYYY-mm-dd string or None
+            end - YYYY-mm-dd string or None
+        Returns:
+            numpy datetime64[D] array of every date from start to end inclusive
+        Raises:
+            ValueError for unparseable dates, a start after end, or a range longer than 
+            Config.ANALYTICS_MAX_DAYS
+        """
+        last = np.datetime64(end or Utilities.get_date(), 'D')
+        first = np.datetime64(start, 'D') if start else last - (Config.ANALYTICS_DAYS - 1)
+        if first > last:
+            raise ValueError('start must not be after end')
+        if last - first >= Config.ANALYTICS_MAX_DAYS:
+            raise ValueError(f'ranges are limited to {Config.ANALYTICS_MAX_DAYS} days')
+        return np.arange(first, last + 1, dtype='datetime64[D]')
+
+    @staticmethod
+    def ratio(numerator, denominator):
+        """
+        Element-wise numerator / denominator, NaN where the denominator is zero. 
+        """
+        out = np.full(np.shape(numerator), np.nan)
+        return np.divide(numerator, denominator, out=out, where=denominator > 0)
+
+    @staticmethod
+    def clean(values):
+        """
+        clean turns a float array into a JSON friendly list, rounding to one place and NaN to None. 
+        """
+        return [None if np.isnan(value) else round(float(value), 1) for value in values]
+
+    @staticmethod
+    def summary(days):
+        """
+        summary gives per-day and whole-range totals for reporting rate, fever, low oximeter, 
+        and working versus not working. 
+        Days with no readings at all have no summary row (or an empty one): their counts are zero 
+        and their reporting rate is unknown (None), since we don't know how many users were active. 
+        Any days that have closed since the last report are settled first, see Rollup.settle(). 
+
+        Args:
+            days - array from Analytics.days()
+        Returns:
+            dict with 'start', 'end', 'days' (list of per-day dicts) and 'totals'
+        """
+        labels = np.datetime_as_string(days)
+        Rollup.settle()
+        rows = db.session.query(DailySummary.day, DailySummary.active_users, *[getattr(DailySummary, name) for name in Rollup.COUNTS]) \
+            .filter(DailySummary.day >= labels[0], DailySummary.day <= min(labels[-1], Rollup.closed())) \
+            .all()
+        rows += Rollup.open_totals(str(labels[0]), str(labels[-1]))
+
+        table = np.zeros((len(days), len(Rollup.COUNTS) + 1))
+        if rows:
+            index = (np.array([row[0] for row in rows], dtype='datetime64[D]') - days[0]).astype(int)
+            table[index] = np.array([row[1:] for row in rows], dtype=float)
+        active = table[:, 0]
+        counts = dict(zip(Rollup.COUNTS, table[:, 1:].T))
+        readings = counts['readings']
+
+        rate = Analytics.clean(Analytics.ratio(readings * 100, active))
+        avg_temp = Analytics.clean(Analytics.ratio(counts['temp_total'], readings))
+        avg_oximeter = Analytics.clean(Analytics.ratio(counts['oximeter_total'], readings))
+        keys = ('readings', 'working', 'not_working', 'symptoms', 'fever', 'low_oximeter')
+        per_day = []
+        for i, label in enumerate(labels):
+            day = {key: int(counts[key][i]) for key in keys}
+            day.update(day=str(label), active_users=int(active[i]), reported_pct=rate[i], avg_temp=avg_temp[i], avg_oximeter=avg_oximeter[i])
+            per_day.append(day)
+
+        reported = active > 0
+        totals = {key: int(counts[key].sum()) for key in keys}
+        totals.update(
+            reported_pct=Analytics.clean(Analytics.ratio(readings[reported].sum(keepdims=True) * 100, active[reported].sum(keepdims=True)))[0],
+            avg_temp=Analytics.clean(Analytics.ratio(counts['temp_total'].sum(keepdims=True), readings.sum(keepdims=True)))[0],
+            avg_oximeter=Analytics.clean(Analytics.ratio(counts['oximeter_total'].sum(keepdims=True), readings.sum(keepdims=True)))[0],
+        )
+        return {'start': str(labels[0]), 'end': str(labels[-1]), 'days': per_day, 'totals': totals}
+
+    @staticmethod
+    def matrix(days):
+        """
+        matrix builds the attendance grid of active users x days, 1 where the user recorded a reading. 
+        Each user has one attendance row per month, so the grid is made by picking the right month's 
+        bitmask for every column and shifting the day's bit down, all in one broadcast operation. 
+
+        Args:
+            days - array from Analytics.days()
+        Returns:
+            dict with 'start', 'end', 'days' (list of dates), 'users' (list of dicts with id, username, 
+            reported count and reported_pct), 'reported' (per-day count of users) and 'matrix' 
+            (list of rows of 0/1, one per user, in the same order as 'users')
+        """
+        labels = np.datetime_as_string(days)
+        months = days.astype('datetime64[M]')
+        month_labels = np.datetime_as_string(np.unique(months))
+        users = db.session.query(Users.id, Users.username).filter(Users.active == True).order_by(Users.username).all()
+        position = {user.id: i for i, user in enumerate(users)}
+        rows = db.session.query(Attendance.user_id, Attendance.month, Attendance.days) \
+            .join(Users, Users.id == Attendance.user_id) \
+            .filter(Users.active == True, Attendance.month.in_(month_labels.tolist())) \
+            .all()
+
+        masks = np.zeros((len(users), len(month_labels)), dtype=np.int64)
+        if rows:
+            masks[
+                [position[row[0]] for row in rows],
+                np.searchsorted(month_labels, [row[1] for row in rows]),
+            ] = [row[2] for row in rows]
+        column_month = (months - months[0]).astype(int)
+        column_day = (days - months).astype(int)
+        grid = (masks[:, column_month] >> column_day) & 1
+
+        reported = grid.sum(axis=1)
+        rate = Analytics.clean(reported * 100 / len(days))
+        return {
+            'start': str(labels[0]),
+            'end': str(labels[-1]),
+            'days': [str(label) for label in labels],
+            'users': [{'id': user.id, 'username': user.username, 'reported': int(reported[i]), 'reported_pct': rate[i]} for i, user in enumerate(users)],
+            'reported': grid.sum(axis=0).tolist(),
+            'matrix': grid.tolist(),
+        }
\ No newline at end of file
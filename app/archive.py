@@ -0,0 +1,221 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Readings, readings_archive
+from app.exports import ReadingsExport
+from app.cache import FragmentCache
+from app.utilities import Utilities
+from config import Config
+from sqlalchemy import select, func, distinct
+import os
+
+class ReadingsArchive:
+    """
+    Readings are never deleted, so instead of letting one table and its indexes grow forever they 
+    are stored by month, and months older than Config.READINGS_RETENTION_MONTHS are moved out of 
+    the way into readings_archive: 
+
+    - On PostgreSQL, readings and readings_archive are both partitioned by month of reading_date 
+      (readings_2020_11 holds November 2020). Archiving a month detaches its partition from 
+      readings and attaches it to readings_archive; no rows are copied. New months' partitions 
+      are created ahead of time by ensure_partitions, with a default partition as a safety net. 
+    - SQLite has no partitioning, so archiving a month copies its rows into readings_archive and 
+      deletes them from readings, one transaction per month. PostgreSQL does the same for a month 
+      whose readings ended up in the default partition. 
+
+    Either way the dashboards, the roster and the JSON api keep working from readings alone, 
+    while the csv/NDJSON exports and the rollup backfill read both (see Readings.archived). 
+    Archived months can also be dumped to gzipped NDJSON files on the way out. 
+    """
+
+    @staticmethod
+    def partitioned(connection):
+        return connection.dialect.name == 'postgresql'
+
+    @staticmethod
+    def shift(month, months):
+        """
+        shift moves a 'YYYY-mm' month string by a number of months, forwards or backwards. 
+        """
+        index = int(month[:4]) * 12 + int(month[5:7]) - 1 + months
+        return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+    @staticmethod
+    def partition(month, table='readings'):
+        return f'{table}_{month.replace("-", "_")}'
+
+    @staticmethod
+    def cutoff(months=None):
+        """
+        cutoff is the oldest month kept in readings: the current month and the 
+        months - 1 before it stay, anything older is archived. 
+
+        Args:
+            months - retention in months, defaults to Config.READINGS_RETENTION_MONTHS
+        Returns:
+            'YYYY-mm' str
+        """
+        months = Config.READINGS_RETENTION_MONTHS if months is None else months
+        return ReadingsArchive.shift(Utilities.get_date()[:7], 1 - months)
+
+    @staticmethod
+    def partitions(connection):
+        """
+        partitions lists the names of the existing partitions of readings and readings_archive. 
+        """
+        return {name for (name,) in connection.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname IN ('readings', 'readings_archive')")}
+
+    @staticmethod
+    def ensure_partitions(connection, start=None, ahead=None):
+        """
+        ensure_partitions creates the monthly partitions of readings (and the default partition) 
+        that don't exist yet, from start's month to Config.READINGS_PARTITIONS_AHEAD months past 
+        this one. Bootstrap runs it, and so should a monthly cron (`flask readings partitions`), so 
+        that new readings never end up in the default partition: a month can't be given its own 
+        partition once the default partition holds readings for it. 
+        Does nothing on datastores without partitioning. 
+
+        Args:
+            connection - connection to run the DDL on
+            start - first reading date (YYYY-mm-dd) that needs a partition, defaults to today
+            ahead - months past the current one, defaults to Config.READINGS_PARTITIONS_AHEAD
+        Returns:
+            list of the partitions created
+        """
+        if not ReadingsArchive.partitioned(connection):
+            return []
+        ahead = Config.READINGS_PARTITIONS_AHEAD if ahead is None else ahead
+        current = Utilities.get_date()[:7]
+        month = (start or current)[:7]
+        last = ReadingsArchive.shift(current, ahead)
+        existing = ReadingsArchive.partitions(connection)
+        created = []
+        if 'readings_default' not in existing:
+            connection.execute('CREATE TABLE readings_default PARTITION OF readings DEFAULT')
+            created.append('readings_default')
+        while month <= last:
+            name = ReadingsArchive.partition(month)
+            if name not in existing and ReadingsArchive.partition(month, 'readings_archive') not in existing:
+                connection.execute(
+                    f"CREATE TABLE {name} PARTITION OF readings "
+                    f"FOR VALUES FROM ('{month}-01') TO ('{ReadingsArchive.shift(month, 1)}-01')")
+                created.append(name)
+            month = ReadingsArchive.shift(month, 1)
+        return created
+
+    @staticmethod
+    def months(before):
+        """
+        months lists the months which still have readings in readings and are older than before. 
+        """
+        month = func.substr(Readings.reading_date, 1, 7)
+        return [month for (month,) in db.session.query(distinct(month))
+            .filter(Readings.reading_date < f'{before}-01').order_by(month)]
+
+    @staticmethod
+    def dump(month, directory):
+        """
+        dump writes one month of readings, every column, to a gzipped NDJSON file in directory. 
+
+        Returns:
+            path of the file written
+        """
+        header = tuple(column.key for column in Readings.__table__.columns)
+        export = ReadingsExport(header, Readings.reading_date >= f'{month}-01', Readings.reading_date < f'{ReadingsArchive.shift(month, 1)}-01')
+        path = os.path.join(directory, f'readings-{month}.ndjson.gz')
+        with open(path, 'wb') as f:
+            for chunk in Utilities.gzip_stream(Utilities.stream_generate_readings(header, export.rows(), 'ndjson')):
+                f.write(chunk)
+        return path
+
+    @staticmethod
+    def copy(connection, start, end):
+        """
+        copy moves the readings dated from start up to (not including) end to readings_archive 
+        row by row: an insert from a select, then a delete. 
+        """
+        table = Readings.__table__
+        columns = [column.key for column in table.columns]
+        in_range = (table.c.reading_date >= start, table.c.reading_date < end)
+        connection.execute(readings_archive.insert().from_select(columns,
+            select([table.c[column] for column in columns]).where(in_range[0]).where(in_range[1])))
+        connection.execute(table.delete().where(in_range[0]).where(in_range[1]))
+
+    @staticmethod
+    def archive_month(month):
+        """
+        archive_month moves one month of readings to readings_archive, in one transaction. 
+        On PostgreSQL a month with a partition of its own has it detached and attached to 
+        readings_archive. A month without one has its readings in readings_default, and they're 
+        copied across into a new readings_archive partition for the month (or an existing one, 
+        for stragglers inserted after the month was archived). 
+        The cached pages of everyone with readings that month are invalidated, since their 
+        recent readings may have included some of them. 
+
+        Returns:
+            number of readings moved
+        """
+        start, end = f'{month}-01', f'{ReadingsArchive.shift(month, 1)}-01'
+        in_month = (Readings.reading_date >= start, Readings.reading_date < end)
+        connection = db.session.connection()
+        count = db.session.query(func.count(Readings.id)).filter(*in_month).scalar()
+        users = {f'user:{user_id}' for (user_id,) in db.session.query(distinct(Readings.user_id)).filter(*in_month)}
+        if ReadingsArchive.partitioned(connection):
+            name = ReadingsArchive.partition(month)
+            archived = ReadingsArchive.partition(month, 'readings_archive')
+            partitions = ReadingsArchive.partitions(connection)
+            if name in partitions:
+                connection.execute(f'ALTER TABLE readings DETACH PARTITION {name}')
+                connection.execute(f'ALTER TABLE {name} RENAME TO {archived}')
+                connection.execute(f"ALTER TABLE readings_archive ATTACH PARTITION {archived} FOR VALUES FROM ('{start}') TO ('{end}')")
+            else:
+                if archived not in partitions:
+                    connection.execute(f"CREATE TABLE {archived} PARTITION OF readings_archive FOR VALUES FROM ('{start}') TO ('{end}')")
+                ReadingsArchive.copy(connection, start, end)
+        else:
+            ReadingsArchive.copy(connection, start, end)
+        FragmentCache.bump(connection, users | {'readings'})
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def archive(months=None, directory=None):
+        """
+        archive moves every month older than the retention window to readings_archive, oldest first. 
+
+        Args:
+            months - retention in months, defaults to Config.READINGS_RETENTION_MONTHS
+            directory - if given, each month is also dumped there (see dump) before it is moved
+        Returns:
+            list of (month, readings moved) tuples
+        """
+        archived = []
+        for month in ReadingsArchive.months(ReadingsArchive.cutoff(months)):
+            if directory:
+                ReadingsArchive.dump(month, directory)
+            archived.append((month, ReadingsArchive.archive_month(month)))
+        return archived
\ No newline at end of file
@@ -0,0 +1,229 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Users, Readings, CacheGeneration
+from app.utilities import Utilities
+from config import Config
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+from markupsafe import Markup
+from sqlalchemy import event
+import threading
+import time
+try:
+    import redis
+except ImportError:
+    redis = None
+
+class MemoryCache:
+    """
+    An in-process LRU cache with a TTL. 
+    Holds at most max_entries values, dropping the least recently used when full, and 
+    treats anything older than its TTL as missing. Safe to share between threads. 
+    Each worker process has its own copy, which is fine for fragments since they are invalidated 
+    through the database rather than by talking to the cache (see FragmentCache). 
+    """
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or Config.CACHE_MAX_ENTRIES
+        self.ttl = ttl or Config.CACHE_TTL
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class RedisCache:
+    """
+    The same interface as MemoryCache, backed by a shared redis server so every worker 
+    (and every host) reuses the same rendered fragments. Needs the optional redis package. 
+    Eviction is left to redis' own maxmemory policy. 
+    """
+    def __init__(self, url, ttl=None, prefix='health-tracker:'):
+        if redis is None:
+            raise RuntimeError('CACHE_URL points at redis but the redis package is not installed (pip install redis).')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl or Config.CACHE_TTL
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=int(ttl or self.ttl))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+class FragmentCache:
+    """
+    FragmentCache caches rendered bits of the admin pages (the dashboard roster, the users table, 
+    a user's vitals and readings) so a refresh doesn't have to re-run their queries and templates. 
+
+    Each fragment names the scopes its data comes from. The current generation of those scopes 
+    (one small primary key lookup on cache_generation) is part of the cache key, and every 
+    commit that writes Readings or Users bumps the matching generations right after it. 
+    So nothing is ever explicitly evicted: as soon as the bump commits, requests start building keys 
+    the old entries can't match, and those age out through the LRU/TTL. 
+    The bump is its own short transaction rather than part of the write's, so a busy scope like 
+    'readings' is only locked for the length of one UPDATE, not for the rest of every request that 
+    records a reading. A fragment rendered between the write and the bump may be stored under 
+    the old generation, but it's rendered from the new data, so a hit is still always at least as 
+    new as the last write whose bump has committed. 
+
+    The backend is picked from CACHE_URL: unset or 'memory' for MemoryCache, a redis:// url 
+    for RedisCache. Anything with get/set/delete/clear can be handed in instead, e.g. a MemoryCache 
+    standing in for redis. 
+    """
+    def __init__(self, backend=None):
+        self._backend = backend
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            url = Config.CACHE_URL
+            if url and url != 'memory':
+                self._backend = RedisCache(url)
+            else:
+                self._backend = MemoryCache()
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    def fragment(self, name, scopes, render, *key):
+        """
+        fragment returns the cached rendering of a fragment, calling render() to build it on a miss. 
+
+        Args:
+            name - fragment name, e.g. 'roster'
+            scopes - iterable of scope names the fragment depends on, e.g. ('readings', 'users')
+            render - zero argument callable returning the rendered str
+            key - any other values the rendering depends on, e.g. a user id or today's date
+        Returns:
+            Markup, safe to drop straight into a template
+        """
+        if not Config.CACHE_ENABLED:
+            return Markup(render())
+        generations, _ = self.generations(scopes)
+        cache_key = Utilities.etag(name, key, generations)
+        value = self.backend.get(cache_key)
+        if value is None:
+            value = str(render())
+            self.backend.set(cache_key, value)
+        return Markup(value)
+
+    @staticmethod
+    def generations(scopes):
+        """
+        generations looks up the current generations of the given scopes. They only ever move 
+        forward, once per committed write to the scope, so they're also what the JSON api's 
+        ETags are built from. 
+
+        Args:
+            scopes - iterable of scope names
+        Returns:
+            (sorted list of (name, generation) tuples, naive UTC datetime of the latest bump or None)
+        """
+        rows = CacheGeneration.query \
+            .with_entities(CacheGeneration.name, CacheGeneration.generation, CacheGeneration.updated) \
+            .filter(CacheGeneration.name.in_(list(scopes))) \
+            .all()
+        return sorted((name, generation) for name, generation, _ in rows), max([row[2] for row in rows if row[2]], default=None)
+
+    @staticmethod
+    def scopes(instance):
+        """
+        scopes lists the cache scopes a write to instance invalidates. 
+        """
+        if isinstance(instance, Readings):
+            return {'readings', f'user:{instance.user_id}'}
+        if isinstance(instance, Users):
+            return {'users', f'user:{instance.id}'}
+        return set()
+
+    @staticmethod
+    def bump(connection, scopes):
+        """
+        bump moves the given scopes on to their next generation, in the transaction of the 
+        given connection. ORM writes are bumped for after they commit, see the listeners below; 
+        writes that bypass the ORM, like the bulk user import, have to call this themselves. 
+        """
+        table = CacheGeneration.__table__
+        now = datetime.utcnow()
+        for scope in sorted(scopes):
+            Utilities.upsert(connection, table, dict(name=scope, generation=1, updated=now), dict(generation=table.c.generation + 1, updated=now))
+
+cache = FragmentCache()
+
+@event.listens_for(db.session, 'after_flush')
+def collect_cache_scopes(session, flush_context):
+    scopes = session.info.setdefault('cache_scopes', set())
+    for instance in chain(session.new, session.dirty, session.deleted):
+        scopes |= FragmentCache.scopes(instance)
+
+@event.listens_for(db.session, 'after_commit')
+def bump_cache_generations(session):
+    # releasing a savepoint fires this too, but nothing is visible to anyone else until the real commit
+    if session.transaction.nested:
+        return
+    scopes = session.info.pop('cache_scopes', None)
+    if scopes:
+        with db.engine.begin() as connection:
+            FragmentCache.bump(connection, scopes)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_cache_scopes(session):
+    # a savepoint rolling back leaves the writes flushed before it in place
+    if not session.transaction.nested:
+        session.info.pop('cache_scopes', None)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.archive import ReadingsArchive
+from app.imports import UserImport
+from app.mailer import Mailer, OutboxWorker
+from app.rollup import Rollup
+from app.seed import Seeder
+from app.startup import bootstrap as bootstrap_datastore
+from config import Config
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+import click
+import json
+import time
+
+users_cli = AppGroup('users', help='Manage users.')
+
+@users_cli.command('import')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+def import_users(csv_file):
+    """
+    Bulk import users from CSV_FILE (email, username and role columns) and send their invitations. 
+    Invitation links are built against APP_BASE_URL. 
+    """
+    with current_app.test_request_context(base_url=Config.APP_BASE_URL):
+        result = UserImport(csv_file).run()
+        click.echo(f'{len(result.created)} users created, {len(result.skipped)} rows skipped.')
+        for row in result.skipped:
+            click.echo(f'  line {row["line"]}: {row["email"]} - {row["reason"]}')
+        click.echo('Invitations are queued and will be sent by the outbox worker.')
+
+outbox_cli = AppGroup('outbox', help='Deliver queued email.')
+
+@outbox_cli.command('work')
+@click.option('--once', is_flag=True, help='Send one batch of due messages and exit.')
+def outbox_work(once):
+    """
+    Deliver queued email. Runs until stopped unless --once is given. 
+    """
+    worker = OutboxWorker()
+    try:
+        if once:
+            sent, failed = worker.run_once()
+            click.echo(f'{sent} sent, {failed} failed.')
+        else:
+            worker.run()
+    finally:
+        worker.disconnect()
+
+@outbox_cli.command('stats')
+def outbox_stats():
+    """
+    Print queue depth and delivery latency as JSON. 
+    """
+    click.echo(json.dumps(Mailer.stats()))
+
+rollup_cli = AppGroup('rollup', help='Maintain the analytics rollup tables.')
+
+@rollup_cli.command('backfill')
+@click.option('--start', help='First reading date (YYYY-mm-dd) to rebuild, defaults to the beginning.')
+@click.option('--end', help='Last reading date (YYYY-mm-dd) to rebuild, defaults to the end.')
+def rollup_backfill(start, end):
+    """
+    Rebuild the daily summary and attendance tables from readings, archived months included. 
+    New readings keep them up to date on their own; this is for history, or after changing thresholds. 
+    """
+    days, attendance = Rollup.backfill(start, end)
+    click.echo(f'{days} days and {attendance} monthly attendance rows rebuilt.')
+
+@rollup_cli.command('settle')
+def rollup_settle():
+    """
+    Write the daily summaries of days that have ended. The analytics pages do this on their own 
+    when they're opened, run it from cron to keep the summaries current regardless. 
+    """
+    days = Rollup.settle()
+    click.echo(f'{days} days settled.')
+
+readings_cli = AppGroup('readings', help='Manage readings storage.')
+
+@readings_cli.command('archive')
+@click.option('--months', type=int, default=None, help='Months of readings to keep, defaults to READINGS_RETENTION_MONTHS.')
+@click.option('--dump', type=click.Path(file_okay=False, writable=True), help='Also write each archived month to DIR as gzipped NDJSON.')
+def readings_archive(months, dump):
+    """
+    Move readings older than the retention window to readings_archive, a month at a time. 
+    Archived readings are left out of the dashboards and the JSON api but are still exported. 
+    """
+    archived = ReadingsArchive.archive(months, dump)
+    for month, count in archived:
+        click.echo(f'{month}: {count} readings archived.')
+    click.echo(f'{len(archived)} months archived, readings now start at {ReadingsArchive.cutoff(months)}.')
+
+@readings_cli.command('partitions')
+@click.option('--ahead', type=int, default=None, help='Months past this one to create, defaults to READINGS_PARTITIONS_AHEAD.')
+def readings_partitions(ahead):
+    """
+    Create the coming months' readings partitions (PostgreSQL only), run it monthly. 
+    """
+    created = ReadingsArchive.ensure_partitions(db.session.connection(), ahead=ahead)
+    db.session.commit()
+    click.echo(f'{len(created)} partitions created.')
+
+@click.command('bootstrap')
+@with_appcontext
+def bootstrap():
+    """
+    Create the tables, the roles and the admin user (BOOTSTRAP_EMAIL), if they don't exist yet. 
+    The app does this at startup too unless BOOTSTRAP_ON_START is false. 
+    """
+    bootstrap_datastore()
+    click.echo('Datastore bootstrapped.')
+
+@click.command('seed')
+@with_appcontext
+@click.option('--users', default=100, show_default=True, help='Employees to create.')
+@click.option('--days', default=365, show_default=True, help='Days of readings history per employee, ending today.')
+@click.option('--coverage', default=0.85, show_default=True, help='Average share of days each employee records a reading.')
+@click.option('--seed', type=int, default=None, help='Random seed, for the same data every time.')
+@click.option('--password', default='password', show_default=True, help='Password for every seeded user.')
+def seed(users, days, coverage, seed, password):
+    """
+    Fill the datastore (DATABASE_URL) with synthetic employees and readings. 
+    For development and benchmarking only, never run this against real data. 
+    """
+    started = time.perf_counter()
+    result = Seeder(users, days, coverage=coverage, seed=seed, password=password).run()
+    click.echo(f'{result.users} users and {result.readings} readings created in {time.perf_counter() - started:.1f}s.')
+
+def init_app(app):
+    app.cli.add_command(users_cli)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(rollup_cli)
+    app.cli.add_command(readings_cli)
+    app.cli.add_command(bootstrap)
+    app.cli.add_command(seed)
@@ -0,0 +1,309 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Users, Readings, RosterEvent
+from app.utilities import Utilities
+from config import Config
+from datetime import datetime, timedelta
+from itertools import chain
+from sqlalchemy import event, func, inspect, or_
+import json
+import queue
+import threading
+import time
+
+class RosterEvents:
+    """
+    RosterEvents pushes roster changes to open admin dashboards as Server-Sent Events, so they 
+    patch the roster table in place instead of reloading the whole page. 
+
+    - Every commit that records a reading, or activates or deactivates a user, also writes a 
+      roster_event row in the same transaction (see the after_flush listener at the bottom of 
+      this module). The table is the only channel between processes, so it works the same with 
+      any number of workers and hosts. 
+    - Each worker process runs one poller thread, and only while someone is subscribed. It reads 
+      new events every EVENTS_POLL_INTERVAL seconds with one indexed query and hands them to every 
+      subscriber's queue, so the cost of polling doesn't grow with the number of dashboards. 
+    - A dashboard's stream only waits on its queue and doesn't hold a datastore connection. 
+      Under gunicorn's gthread workers (see the Dockerfile) that's still a thread per open 
+      dashboard, so each process takes at most EVENTS_MAX_SUBSCRIBERS of them and turns the rest 
+      away (see full()), leaving its other threads for ordinary requests. Under gevent workers 
+      it's only a greenlet, and the limit can be raised a lot. 
+    - A subscriber that stops reading while its queue fills up is dropped and told to reload, 
+      rather than buffering events for it forever. 
+    - Ids are handed out when an event is written, not when it commits, so on PostgreSQL an event 
+      can become visible after newer ones have already been sent. The ids the poller skips over 
+      are looked for again on every poll until EXPORT_WATERMARK_LAG seconds have passed, the 
+      same allowance the exports give a slow commit. 
+    """
+    GAP_LIMIT = 1000
+
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.poller = None
+        self.last_id = 0
+        # ids below last_id not seen yet -> time.monotonic() when they were first skipped
+        self.gaps = {}
+
+    @staticmethod
+    def latest():
+        """
+        latest is the id of the newest event, or 0, for dashboards to resume from. 
+        """
+        return db.session.query(func.max(RosterEvent.id)).scalar() or 0
+
+    @staticmethod
+    def after(last_id, limit=None, gaps=()):
+        """
+        after returns the events newer than last_id, plus any with the ids in gaps, oldest first. 
+        """
+        criterion = RosterEvent.id > last_id
+        if gaps:
+            criterion = or_(criterion, RosterEvent.id.in_(sorted(gaps)))
+        query = RosterEvent.query.filter(criterion).order_by(RosterEvent.id)
+        return query.limit(limit).all() if limit else query.all()
+
+    @staticmethod
+    def prune(hours=None):
+        """
+        prune deletes events older than EVENTS_RETENTION_HOURS. 
+        """
+        hours = Config.EVENTS_RETENTION_HOURS if hours is None else hours
+        RosterEvent.query.filter(RosterEvent.created < datetime.utcnow() - timedelta(hours=hours)).delete(synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def message(roster_event, resume=True):
+        """
+        message formats an event for the text/event-stream wire format. 
+        Without resume the event goes out without its id, so a browser that reconnects still resumes 
+        after the newest event it saw rather than after one that turned up late. 
+        """
+        head = f'id: {roster_event.id}\n' if resume else ''
+        return f'{head}event: {roster_event.kind}\ndata: {roster_event.data}\n\n'
+
+    def subscribe(self, app):
+        """
+        subscribe registers a new dashboard and starts this process' poller if it isn't running. 
+
+        Must be run inside an app context. 
+
+        Args:
+            app - Flask app, for the poller's app context
+        Returns:
+            queue.Queue the subscriber's events arrive on. None means the subscriber fell behind.
+        """
+        subscriber = queue.Queue(maxsize=Config.EVENTS_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.poller is None:
+                # taken before the stream below replays what the subscriber missed, so nothing 
+                # committed in between falls through the gap
+                self.last_id = self.latest()
+                self.gaps = {}
+                self.poller = threading.Thread(target=self.poll, args=(app,), name='roster-events', daemon=True)
+                self.poller.start()
+        return subscriber
+
+    def full(self):
+        """
+        full tells whether this process already has EVENTS_MAX_SUBSCRIBERS open dashboards. 
+        """
+        with self.lock:
+            return len(self.subscribers) >= Config.EVENTS_MAX_SUBSCRIBERS
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def drop(self, subscriber):
+        """
+        drop unsubscribes a dashboard and tells it to reload. 
+        """
+        self.unsubscribe(subscriber)
+        # make room for the reload notice, the queued events won't be sent anyway
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.put_nowait(None)
+
+    def publish(self, roster_event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(roster_event)
+            except queue.Full:
+                self.drop(subscriber)
+
+    def advance(self, roster_event):
+        """
+        advance moves the poller on to a newly seen event. An event from a gap fills it, anything 
+        newer moves last_id up and leaves the ids it jumped over as gaps, so a transaction that 
+        took one of them and hasn't committed yet isn't missed. At most GAP_LIMIT ids are kept, 
+        the lowest go first. 
+        """
+        if roster_event.id <= self.last_id:
+            self.gaps.pop(roster_event.id, None)
+            return
+        now = time.monotonic()
+        for missing in range(max(self.last_id + 1, roster_event.id - self.GAP_LIMIT), roster_event.id):
+            self.gaps[missing] = now
+        self.last_id = roster_event.id
+        for missing in sorted(self.gaps)[:max(len(self.gaps) - self.GAP_LIMIT, 0)]:
+            del self.gaps[missing]
+
+    def settle(self):
+        """
+        settle stops looking for skipped ids which are older than EXPORT_WATERMARK_LAG seconds. 
+        By then they belong to transactions that rolled back, or that never will commit. 
+        """
+        expired = time.monotonic() - Config.EXPORT_WATERMARK_LAG
+        for missing in [missing for missing, skipped in self.gaps.items() if skipped < expired]:
+            del self.gaps[missing]
+
+    def poll(self, app):
+        """
+        poll is the body of the poller thread. It exits once nobody is subscribed. 
+        """
+        pruned = 0
+        with app.app_context():
+            try:
+                while True:
+                    with self.lock:
+                        if not self.subscribers:
+                            self.poller = None
+                            return
+                    for roster_event in self.after(self.last_id, Config.EVENTS_QUEUE_SIZE, self.gaps):
+                        self.publish(roster_event)
+                        self.advance(roster_event)
+                    self.settle()
+                    if time.monotonic() - pruned > 3600:
+                        self.prune()
+                        pruned = time.monotonic()
+                    db.session.remove()
+                    time.sleep(Config.EVENTS_POLL_INTERVAL)
+            except Exception:
+                app.logger.exception('Roster events poller stopped')
+                with self.lock:
+                    self.poller = None
+                    subscribers = list(self.subscribers)
+                for subscriber in subscribers:
+                    self.drop(subscriber)
+            finally:
+                db.session.remove()
+
+    def stream(self, app, last_id):
+        """
+        stream yields a dashboard's text/event-stream: the events it missed since last_id, then 
+        new ones as they come, with a comment every EVENTS_HEARTBEAT seconds to keep proxies from 
+        closing an idle connection. 
+
+        Args:
+            app - Flask app
+            last_id - id of the last event the dashboard has seen
+        """
+        subscriber = self.subscribe(app)
+        try:
+            missed = self.after(last_id)
+            db.session.remove()
+            # the poller may hand over some of the same events again
+            replayed = {roster_event.id for roster_event in missed}
+            yield 'retry: 5000\n\n'
+            for roster_event in missed:
+                last_id = roster_event.id
+                yield self.message(roster_event)
+            while True:
+                try:
+                    roster_event = subscriber.get(timeout=Config.EVENTS_HEARTBEAT)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if roster_event is None:
+                    yield 'event: reload\ndata: {}\n\n'
+                    return
+                if roster_event.id not in replayed:
+                    yield self.message(roster_event, resume=roster_event.id > last_id)
+                    last_id = max(last_id, roster_event.id)
+        finally:
+            self.unsubscribe(subscriber)
+
+    @staticmethod
+    def changes(session):
+        """
+        changes lists the roster events for what the session is about to commit: new readings, 
+        new active users, and users whose active flag changed. 
+
+        Returns:
+            list of dicts with kind, user_id and data, for record()
+        """
+        changes = []
+        for instance in chain(session.new, session.dirty):
+            if isinstance(instance, Readings) and instance in session.new:
+                changes.append(dict(kind='reading', user_id=instance.user_id, data={'reading': instance.as_dict()}))
+            elif isinstance(instance, Users):
+                if instance in session.new:
+                    changed = bool(instance.active)
+                else:
+                    changed = inspect(instance).attrs.active.history.has_changes()
+                if changed and instance.active:
+                    # someone reactivated later in the day may already have a reading on the roster
+                    reading = None if instance in session.new else session.query(Readings) \
+                        .filter(Readings.user_id == instance.id, Readings.today(Utilities.today())).first()
+                    changes.append(RosterEvents.activated(instance, reading))
+                elif changed:
+                    changes.append(dict(kind='deactivated', user_id=instance.id, data={'username': instance.username}))
+        return changes
+
+    @staticmethod
+    def activated(user, reading=None):
+        """
+        activated is the event for a user joining the roster, with their reading for today if they have one. 
+        """
+        return dict(kind='activated', user_id=user.id,
+            data={'username': user.username, 'reading': reading.as_dict() if reading else None})
+
+    @staticmethod
+    def record(connection, changes):
+        """
+        record writes roster events on the connection (and so in the transaction) making the changes. 
+        Writes that bypass the ORM, like the bulk user import, have to call this themselves. 
+
+        Args:
+            connection - connection of the transaction doing the write
+            changes - list of dicts with kind, user_id and data, as from changes()
+        """
+        now = datetime.utcnow()
+        rows = [dict(kind=change['kind'], user_id=change['user_id'], created=now,
+            data=json.dumps(dict(change['data'], user_id=change['user_id']), default=Utilities.json_value)) for change in changes]
+        if rows:
+            connection.execute(RosterEvent.__table__.insert(), rows)
+
+events = RosterEvents()
+
+@event.listens_for(db.session, 'after_flush')
+def record_roster_events(session, flush_context):
+    RosterEvents.record(session.connection(), RosterEvents.changes(session))
\ No newline at end of file
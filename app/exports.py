@@ -0,0 +1,192 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Readings
+from config import Config
+from datetime import datetime, timedelta
+from sqlalchemy import false
+
+class ReadingsExport:
+    """
+    ReadingsExport turns a list of requested header columns into a single column-projection 
+    query over readings, so an export is one query no matter how many rows it returns. 
+    Header names are either a column on Readings ('temp', 'reading_date', ...) or a dotted 
+    'relationship.column' pair such as 'users.email', which joins through the named 
+    relationship on Readings and pulls the column from the related model. 
+    'username' is kept as a shorthand for 'users.username' since that is what the csv 
+    headers have always been called. 
+    Rows come back as plain tuples in header order, ready to be handed to a csv writer. 
+    They are fetched Config.EXPORT_CHUNK_SIZE at a time so a worker never holds the whole 
+    readings table in memory: PostgreSQL streams through a server-side (named) cursor, other 
+    datastores (sqlite) fall back to keyset pages over (created, id). 
+    Exports cover archived months too: the same query is run over readings_archive (see 
+    Readings.archived), after readings when newest first and before it when oldest first. 
+    """
+    ALIASES = {
+        'username': 'users.username',
+    }
+
+    def __init__(self, header, *criterion, chunk_size=None):
+        """
+        Args:
+            header - list of col headings to export, in order. 
+            criterion - optional filter expressions applied to the readings query, 
+                        e.g. Readings.user_id == user.id
+            chunk_size - rows fetched per round trip, defaults to Config.EXPORT_CHUNK_SIZE
+        """
+        self.header = tuple(header)
+        self.criterion = criterion
+        self.chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+        self.oldest_first = False
+
+    def since(self, created, id=None, lag=None):
+        """
+        since narrows the export to the readings recorded after a watermark, oldest first, so a 
+        downstream sync only pulls what's new since its last pull. 
+        The newest reading to include is settled before any rows are sent, so the next watermark 
+        can go out in a response header, and so readings arriving mid-export wait for the next 
+        pull rather than being half included. Readings from the last `lag` seconds are left for 
+        the next pull too: created is stamped a moment before the reading commits, and without 
+        the lag a reading that commits late could land behind a watermark that was already handed out. 
+        Both ends are ranges on created, so this is an index range scan however long the history. 
+
+        Args:
+            created - watermark timestamp (naive UTC), only readings after it are included
+            id - id of the reading at the watermark, when it came from a previous export
+            lag - seconds, defaults to Config.EXPORT_WATERMARK_LAG
+        Returns:
+            (created, id) of the newest reading included, the next watermark, or None if there's nothing new
+        """
+        lag = Config.EXPORT_WATERMARK_LAG if lag is None else lag
+        after = Readings.after(created, id) if id is not None else Readings.created > created
+        settled = Readings.created <= datetime.utcnow() - timedelta(seconds=lag)
+        query = Readings.query.filter(*self.criterion, after, settled)
+        # archived months are all older than anything left in readings, so only look there if readings has nothing
+        newest = Readings.newest(query) or db.session.execute(Readings.archived(query.with_entities(Readings.created, Readings.id)
+            .order_by(Readings.created.desc(), Readings.id.desc()).limit(1).statement)).first()
+        self.oldest_first = True
+        if newest is None:
+            self.criterion += (false(),)
+        else:
+            self.criterion += (after, Readings.up_to(*newest))
+        return newest
+
+    def columns(self):
+        """
+        columns resolves each header name to a labeled column expression and collects 
+        the relationships which need to be joined to reach them. 
+
+        Returns:
+            (columns, joins) tuple of lists
+        """
+        mapper = Readings.__mapper__
+        columns = []
+        joins = []
+        for name in self.header:
+            path = self.ALIASES.get(name, name)
+            if '.' in path:
+                relationship, attribute = path.split('.', 1)
+                if relationship not in mapper.relationships:
+                    raise ValueError(f'Unknown export column: {name}')
+                target = mapper.relationships[relationship].mapper
+                if attribute not in target.column_attrs:
+                    raise ValueError(f'Unknown export column: {name}')
+                join = getattr(Readings, relationship)
+                if join not in joins:
+                    joins.append(join)
+                columns.append(getattr(target.class_, attribute).label(name))
+            else:
+                if path not in mapper.column_attrs:
+                    raise ValueError(f'Unknown export column: {name}')
+                columns.append(getattr(Readings, path).label(name))
+        return columns, joins
+
+    def query(self):
+        """
+        query builds the projection query, newest readings first (oldest first after since()). 
+        id breaks ties between readings created at the same instant so the order is stable 
+        enough to page through. 
+        """
+        columns, joins = self.columns()
+        query = db.session.query(*columns).select_from(Readings)
+        for join in joins:
+            query = query.outerjoin(join)
+        if self.oldest_first:
+            return query.filter(*self.criterion).order_by(Readings.created.asc(), Readings.id.asc())
+        return query.filter(*self.criterion).order_by(Readings.created.desc(), Readings.id.desc())
+
+    def statements(self, statement):
+        """
+        statements returns statement as it is and rewritten over readings_archive, in export order. 
+        Archived months are older than anything in readings, so one table simply follows the other. 
+        """
+        if self.oldest_first:
+            return (Readings.archived(statement), statement)
+        return (statement, Readings.archived(statement))
+
+    def rows(self):
+        """
+        rows yields each reading as a tuple of values in header order. 
+        """
+        if db.session.get_bind().dialect.name == 'postgresql':
+            return self.streamed()
+        return self.chunked()
+
+    def streamed(self):
+        """
+        streamed reads the export through a server-side cursor per table; psycopg2 hands us 
+        chunk_size rows per network round trip and discards them once they are written out. 
+        """
+        for statement in self.statements(self.query().statement):
+            result = db.session.execute(statement.execution_options(stream_results=True))
+            while True:
+                rows = result.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+
+    def chunked(self):
+        """
+        chunked is the fallback for datastores without server-side cursors. 
+        Each chunk is its own LIMIT query which picks up strictly after the (created, id) 
+        of the last row from the previous chunk, so every chunk costs the same regardless 
+        of how deep into the export we are, and sqlite never holds a long-running read open. 
+        """
+        width = len(self.header)
+        query = self.query().add_columns(Readings.created, Readings.id)
+        following = Readings.after if self.oldest_first else Readings.before
+        for archived in (self.oldest_first, not self.oldest_first):
+            last = None
+            while True:
+                chunk = query
+                if last:
+                    created, id = last
+                    chunk = chunk.filter(following(created, id))
+                statement = chunk.limit(self.chunk_size).statement
+                rows = db.session.execute(Readings.archived(statement) if archived else statement).fetchall()
+                for row in rows:
+                    yield tuple(row)[:width]
+                if len(rows) < self.chunk_size:
+                    break
+                last = tuple(rows[-1])[width:]
\ No newline at end of file
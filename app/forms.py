@@ -20,25 +20,38 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 Please refer to LICENSE in the project repository for details.
 """
-from app import app
 from flask import flash
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, RadioField, TextAreaField, SelectField
 from wtforms.validators import DataRequired, ValidationError, Email, Length, Regexp, Optional, NumberRange
 from wtforms.fields.html5 import TelField, DateField, DecimalField
 from app.models import Users, Role
 import re
 
+_roles = None
+
 def get_roles():
+    """
+    get_roles returns the choices for the role select on AddUser. 
+    Roles are only ever created by bootstrap, so they are queried once per process, the first 
+    time they are needed (app.startup.warm_up asks for them before the workers fork) rather 
+    than when this module is imported. 
+    """
+    global _roles
+    if _roles is not None:
+        return _roles
     try:
         roles = Role.query.all()
         choose = 'Choose...'
         container = [('', choose)]
         for role in roles:
             container.append((role.name, role.name))
-        return container
     except Exception as e:
         return [('error', 'error')]
+    if roles:
+        _roles = container
+    return container
 
 def decimal_validation(form, field):
     pattern = re.compile('^\d{2,3}(\.\d{1})?$')
@@ -46,8 +59,8 @@ def decimal_validation(form, field):
         raise ValidationError('Must be a 2-3 digit number with 0 or 1 decimal place')
 
 class ReadingsForm(FlaskForm):
-    temp = DecimalField('Temperature', validators=[DataRequired(message='This field is required'), decimal_validation])
-    oximeter = DecimalField('Oximeter', validators=[DataRequired(message='This field is required'), decimal_validation])
+    temp = DecimalField('Temperature', places=1, validators=[DataRequired(message='This field is required'), decimal_validation])
+    oximeter = DecimalField('Oximeter', places=1, validators=[DataRequired(message='This field is required'), decimal_validation])
     symptoms = BooleanField('Are you experiencing COVID-19 symptoms?', validators=[])
     working_btn = SubmitField("I'm Working")
     not_working_btn = SubmitField("I'm Going Home")
@@ -55,5 +68,13 @@ class ReadingsForm(FlaskForm):
 class AddUser(FlaskForm):
     email = StringField('Email', validators=[DataRequired(message='This field is required'), Email(message='A valid email address is required.')])
     username = StringField('Username', validators=[DataRequired(message='This field is required')])
-    roles = SelectField('Role', choices=get_roles())
-    submit = SubmitField("Add")
\ No newline at end of file
+    roles = SelectField('Role')
+    submit = SubmitField("Add")
+
+    def __init__(self, *args, **kwargs):
+        super(AddUser, self).__init__(*args, **kwargs)
+        self.roles.choices = get_roles()
+
+class ImportUsers(FlaskForm):
+    csv_file = FileField('CSV File', validators=[FileRequired(message='This field is required'), FileAllowed(['csv'], message='Only .csv files can be imported.')])
+    submit = SubmitField("Import")
\ No newline at end of file
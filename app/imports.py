@@ -0,0 +1,208 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import create_app, db
+from app.models import Users, Role, roles_users
+from app.mailer import Mailer
+from app.cache import FragmentCache
+from app.events import RosterEvents
+from config import Config
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from flask import current_app
+from email_validator import validate_email, EmailNotValidError
+from flask_security.utils import hash_password
+from flask_security.recoverable import generate_reset_password_token
+from sqlalchemy import or_
+from types import SimpleNamespace
+import csv
+import multiprocessing
+import uuid
+
+class UserImport:
+    """
+    UserImport onboards a whole site's worth of users from a csv with email, username and role 
+    columns, doing in bulk what new_user() does one form post at a time. 
+
+    - Every row is validated up front and duplicates are dropped, both within the file and 
+      against existing users (one set-based query for the whole file). 
+    - The placeholder passwords are hashed on a pool of worker processes. Password hashes are 
+      slow on purpose (bcrypt by default) and doing 2,000 of them one after another is most of the 
+      cost of an import. The reset tokens for the invitation links are only an md5 of the hash 
+      and a signature, so they're made here once the hashes come back. 
+    - The pool's processes are spawned rather than forked: the import runs in a threaded gunicorn 
+      worker, and a fork would copy whatever locks the other threads held at that moment. 
+    - Users and their roles_users rows are inserted Config.IMPORT_BATCH_SIZE at a time, one 
+      transaction per batch, so a bad batch doesn't undo the whole import. 
+    - Invitation emails are queued in the outbox rather than sent inline. 
+
+    Must be run inside a request context (a test_request_context is fine) so that the 
+    invitation links can be built. 
+    """
+    COLUMNS = ('email', 'username', 'role')
+
+    def __init__(self, stream, batch_size=None, workers=None):
+        """
+        Args:
+            stream - text file-like object containing the csv
+            batch_size - users inserted per transaction, defaults to Config.IMPORT_BATCH_SIZE
+            workers - password hashing processes, defaults to Config.IMPORT_HASH_WORKERS
+        """
+        self.stream = stream
+        self.batch_size = batch_size or Config.IMPORT_BATCH_SIZE
+        self.workers = workers or Config.IMPORT_HASH_WORKERS
+        self.created = []
+        self.skipped = []
+
+    def skip(self, line, row, reason):
+        self.skipped.append({'line': line, 'email': row.get('email'), 'username': row.get('username'), 'reason': reason})
+
+    def parse(self):
+        """
+        parse reads and validates the csv. 
+
+        Returns:
+            list of (line, row) tuples which passed validation, where row is a dict of the 
+            email, username and role columns. Rejected rows are recorded in self.skipped. 
+        """
+        reader = csv.DictReader(self.stream)
+        if reader.fieldnames is None:
+            return []
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        missing = [column for column in self.COLUMNS if column not in reader.fieldnames]
+        if missing:
+            raise ValueError(f'The csv is missing the column(s): {", ".join(missing)}')
+
+        roles = {role.name: role.id for role in Role.query.all()}
+        emails = set()
+        usernames = set()
+        rows = []
+        for row in reader:
+            line = reader.line_num
+            row = {column: (row.get(column) or '').strip() for column in self.COLUMNS}
+            try:
+                validate_email(row['email'], check_deliverability=False)
+            except EmailNotValidError:
+                self.skip(line, row, 'invalid email address')
+                continue
+            if not row['username']:
+                self.skip(line, row, 'missing username')
+                continue
+            if row['username'][0].isdigit():
+                self.skip(line, row, 'usernames cannot begin with a number')
+                continue
+            if row['role'] not in roles:
+                self.skip(line, row, f'unknown role "{row["role"]}"')
+                continue
+            if row['email'] in emails or row['username'] in usernames:
+                self.skip(line, row, 'duplicate of an earlier row in this file')
+                continue
+            emails.add(row['email'])
+            usernames.add(row['username'])
+            row['role_id'] = roles[row['role']]
+            rows.append((line, row))
+
+        if rows:
+            existing = db.session.query(Users.email, Users.username) \
+                .filter(or_(Users.email.in_(emails), Users.username.in_(usernames))) \
+                .all()
+            taken_emails = {email for email, _ in existing}
+            taken_usernames = {username for _, username in existing}
+            fresh = []
+            for line, row in rows:
+                if row['email'] in taken_emails:
+                    self.skip(line, row, 'a user with this email already exists')
+                elif row['username'] in taken_usernames:
+                    self.skip(line, row, 'a user with this username already exists')
+                else:
+                    fresh.append((line, row))
+            rows = fresh
+        return rows
+
+    @staticmethod
+    def _start_worker():
+        """
+        Runs once in each pool process: the hashing below needs an app context of its own. 
+        """
+        create_app().app_context().push()
+
+    @staticmethod
+    def _hash(_):
+        """
+        Runs in a pool process: hash a placeholder password. 
+        """
+        return hash_password(Users.random_password())
+
+    def run(self):
+        """
+        run performs the import. 
+
+        Returns:
+            self, with self.created holding the imported users (as dicts) and self.skipped 
+            holding every rejected row and the reason for it. 
+        """
+        rows = self.parse()
+        ids = [uuid.uuid1() for _ in rows]
+        credentials = []
+        if rows:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=self._start_worker) as pool:
+                passwords = list(pool.map(self._hash, ids, chunksize=16))
+            credentials = [(password, generate_reset_password_token(SimpleNamespace(id=id, password=password)))
+                for id, password in zip(ids, passwords)]
+
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            now = datetime.utcnow()
+            users = []
+            for (line, row), id, (password, token) in zip(batch, ids[start:start + self.batch_size], credentials[start:start + self.batch_size]):
+                users.append({
+                    'id': id,
+                    'email': row['email'],
+                    'username': row['username'],
+                    'password': password,
+                    'active': True,
+                    'created': now,
+                    'token': token,
+                })
+            try:
+                db.session.execute(Users.__table__.insert(), [
+                    {column: value for column, value in user.items() if column != 'token'} for user in users
+                ])
+                db.session.execute(roles_users.insert(), [
+                    {'user_id': user['id'], 'role_id': row['role_id']} for user, (_, row) in zip(users, batch)
+                ])
+                # core inserts skip the ORM's flush events, so invalidate the cached users table and 
+                # put the new users on open dashboards here. There can't be anything cached under 
+                # the new users' own scopes yet. 
+                FragmentCache.bump(db.session.connection(), {'users'})
+                RosterEvents.record(db.session.connection(), [RosterEvents.activated(SimpleNamespace(**user)) for user in users])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.debug(f'User import batch failed: {e}')
+                for line, row in batch:
+                    self.skip(line, row, 'could not be saved, the batch it was in failed')
+                continue
+            self.created.extend(users)
+
+        Mailer.enqueue(*[Mailer.invitation(SimpleNamespace(**user), token=user['token']) for user in self.created])
+        return self
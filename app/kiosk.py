@@ -0,0 +1,177 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Users, Readings
+from app.forms import ReadingsForm
+from app.utilities import Utilities
+from config import Config
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+import uuid
+
+class ReadingsBatch:
+    """
+    ReadingsBatch records readings for a whole crew at once, for sites where a supervisor takes 
+    everyone's readings at a shared station. It does for a list of rows what new_reading() does 
+    one login and form post at a time: 
+
+    - Each row is validated by ReadingsForm, so the temp/oximeter rules are the same as the form's. 
+    - The crew is looked up with one query, and "already recorded today" is one query for the whole batch. 
+    - All the readings go in with one commit. If another reading for one of them commits first (the 
+      unique (user_id, reading_date) constraint catches it), the batch is checked again and retried 
+      once without that row. The retry inserts each row under its own savepoint, so if someone 
+      else is still racing the batch only their row comes back 'exists' and the rest are recorded. 
+
+    Rows are dicts with a 'username' (or 'user_id'), 'temp', 'oximeter', 'status' ('working' or 
+    'not working') and optionally 'symptoms' (bool). Every row gets a result, in the same order: 
+    'created' with the reading, or 'invalid', 'unknown user', 'inactive user', 'duplicate' (the 
+    same person twice in the batch) or 'exists' (already recorded today). 
+    """
+    STATUSES = ('working', 'not working')
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows - list of row dicts, at most Config.KIOSK_MAX_BATCH of them
+        """
+        self.rows = rows
+        self.results = [None] * len(rows)
+
+    @staticmethod
+    def validate(row):
+        """
+        validate checks one row with ReadingsForm. 
+
+        Returns:
+            (form, errors) - errors is a dict of field -> list of messages, empty when the row is valid
+        """
+        if not isinstance(row, dict):
+            return None, {'row': ['Must be an object']}
+        data = MultiDict({key: str(row[key]) for key in ('temp', 'oximeter') if row.get(key) is not None})
+        if row.get('symptoms'):
+            data['symptoms'] = 'y'
+        form = ReadingsForm(formdata=data, meta={'csrf': False})
+        form.validate()
+        errors = dict(form.errors)
+        if row.get('status') not in ReadingsBatch.STATUSES:
+            errors['status'] = [f'Must be one of: {", ".join(ReadingsBatch.STATUSES)}']
+        if not row.get('username') and not row.get('user_id'):
+            errors['username'] = ['username or user_id is required']
+        return form, errors
+
+    @staticmethod
+    def user_key(row):
+        """
+        user_key is the username or uuid that identifies the row's user, None if it can't. 
+        """
+        if row.get('username'):
+            return str(row['username'])
+        try:
+            return uuid.UUID(str(row['user_id']))
+        except ValueError:
+            return None
+
+    def find_users(self, keys):
+        """
+        find_users looks the whole crew up in one query. 
+
+        Returns:
+            dict of username and id -> Users
+        """
+        names = [key for key in keys if isinstance(key, str)]
+        ids = [key for key in keys if isinstance(key, uuid.UUID)]
+        users = {}
+        if names or ids:
+            for user in Users.query.filter(or_(Users.username.in_(names), Users.id.in_(ids))):
+                users[user.username] = users[user.id] = user
+        return users
+
+    def run(self):
+        """
+        run validates and records the batch. 
+
+        Returns:
+            list of per-row result dicts, in the order of the rows
+        """
+        pending = {}
+        for index, row in enumerate(self.rows):
+            form, errors = self.validate(row)
+            key = None if errors else self.user_key(row)
+            if errors or key is None:
+                self.results[index] = {'index': index, 'result': 'invalid', 'errors': errors or {'user_id': ['Not a valid id']}}
+            else:
+                pending[index] = (key, form, row['status'] == 'working')
+
+        users = self.find_users({key for key, _, _ in pending.values()})
+        seen = set()
+        for index, (key, form, working) in list(pending.items()):
+            user = users.get(key)
+            if user is None:
+                result = 'unknown user'
+            elif not user.active:
+                result = 'inactive user'
+            elif user.id in seen:
+                result = 'duplicate'
+            else:
+                seen.add(user.id)
+                # just the id, the users are expired if the insert below has to be rolled back 
+                # and we don't want to load them again one by one 
+                pending[index] = (user.id, form, working)
+                continue
+            self.results[index] = {'index': index, 'result': result}
+            del pending[index]
+
+        for attempt in range(2):
+            today = Utilities.today()
+            recorded = {user_id for (user_id,) in db.session.query(Readings.user_id)
+                .filter(Readings.user_id.in_([user_id for user_id, _, _ in pending.values()]), Readings.today(today))}
+            for index, (user_id, _, _) in list(pending.items()):
+                if user_id in recorded:
+                    self.results[index] = {'index': index, 'result': 'exists'}
+                    del pending[index]
+            # ids up front let the ORM insert the whole batch with one executemany
+            readings = {index: Readings(id=uuid.uuid1(), user_id=user_id, temp=form.temp.data, oximeter=form.oximeter.data, status=working, symptoms=form.symptoms.data)
+                for index, (user_id, form, working) in pending.items()}
+            if attempt:
+                # still racing someone, so a conflict now only costs the row it's on
+                for index, reading in list(readings.items()):
+                    try:
+                        with db.session.begin_nested():
+                            db.session.add(reading)
+                    except IntegrityError:
+                        self.results[index] = {'index': index, 'result': 'exists'}
+                        del readings[index]
+            else:
+                db.session.add_all(readings.values())
+                try:
+                    db.session.flush()
+                except IntegrityError:
+                    # someone in the batch recorded a reading of their own meanwhile, check again
+                    db.session.rollback()
+                    continue
+            for index, reading in readings.items():
+                self.results[index] = {'index': index, 'result': 'created', 'reading': reading.as_dict()}
+            db.session.commit()
+            break
+        return self.results
\ No newline at end of file
@@ -0,0 +1,293 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db, mail
+from app.models import Outbox
+from app.metrics import Metrics
+from config import Config
+from datetime import datetime, timedelta
+from flask import current_app, render_template
+from flask_mail import Message
+from flask_security import url_for_security
+from flask_security.utils import config_value, _security
+from flask_security.recoverable import generate_reset_password_token
+from sqlalchemy import func
+import smtplib
+import time
+
+class Mailer:
+    """
+    Mailer renders emails while we still have a request to render them with, and stores them 
+    in the outbox table instead of sending them, so the request that triggered them never 
+    waits on the SMTP relay. 
+    Every flask_security send_mail call (ours and flask-security's own, like password resets) 
+    goes through Mailer.enqueue, see the send_mail_task registration in create_app(). 
+    Delivery is done by a separate worker process, `flask outbox work`, see OutboxWorker. 
+    """
+    @staticmethod
+    def message(subject, recipient, template, **context):
+        """
+        message renders one of our custom email templates into a Message, exactly the way 
+        flask_security.utils.send_mail does, but without sending it. 
+        Requires an app (and, for external links, a request) context. 
+
+        Args:
+            subject - email subject
+            recipient - email address, or None when the message is a template for Mailer.personalize
+            template - name of the template in security/email, without extension
+            context - template context
+        Returns:
+            flask_mail.Message
+        """
+        context.setdefault('security', _security)
+        context.update(_security._run_ctx_processor('mail'))
+        msg = Message(subject, sender=_security.email_sender, recipients=[recipient] if recipient else [])
+        ctx = ('security/email', template)
+        if config_value('EMAIL_PLAINTEXT'):
+            msg.body = render_template('%s/%s.txt' % ctx, **context)
+        if config_value('EMAIL_HTML'):
+            msg.html = render_template('%s/%s.html' % ctx, **context)
+        return msg
+
+    @staticmethod
+    def invitation(user, token=None):
+        """
+        invitation builds the "activate your account" email for a new user. 
+        This is just the reset password flow with our invite_new_user template, see new_user(). 
+
+        Args:
+            user - anything with the id, email and password of the user (hashed password, as stored)
+            token - reset password token, if already generated for this user
+        Returns:
+            flask_mail.Message
+        """
+        token = token or generate_reset_password_token(user)
+        link = url_for_security('reset_password', token=token, _external=True)
+        subject = 'Activate your account for the Health Tracker'
+        if Config.ORG:
+            subject = f'Activate your account for the {Config.ORG} Health Tracker'
+        return Mailer.message(subject, user.email, 'invite_new_user', reset_link=link)
+
+    @staticmethod
+    def personalize(msg, recipients):
+        """
+        personalize copies a rendered message once per recipient, so an email that is the same 
+        for everyone (like the reading reminder) only has to be rendered once. 
+
+        Args:
+            msg - flask_mail.Message to copy
+            recipients - list of email addresses
+        Returns:
+            list of flask_mail.Message, one per recipient
+        """
+        return [
+            Message(msg.subject, sender=msg.sender, recipients=[recipient], body=msg.body, html=msg.html)
+            for recipient in recipients
+        ]
+
+    @staticmethod
+    def enqueue(*messages):
+        """
+        enqueue stores rendered messages in the outbox and commits. 
+        Anything else pending in the session is committed along with them, so call this 
+        once your own changes are either committed or ready to be. 
+        """
+        now = datetime.utcnow()
+        for msg in messages:
+            db.session.add(Outbox(
+                created=now,
+                next_attempt=now,
+                subject=msg.subject,
+                sender=msg.sender if isinstance(msg.sender, str) else '{} <{}>'.format(*msg.sender),
+                recipients=','.join(msg.recipients),
+                body=msg.body,
+                html=msg.html,
+            ))
+        db.session.commit()
+
+    @staticmethod
+    def stats():
+        """
+        stats reports how the outbox is doing: how many messages are waiting (and how long the 
+        oldest has waited), how many have given up, and how long it took to deliver the messages 
+        sent in the last hour, from enqueue to hand-off to the relay. 
+
+        Returns:
+            dict
+        """
+        now = datetime.utcnow()
+        pending, oldest = db.session.query(func.count(Outbox.id), func.min(Outbox.created)) \
+            .filter(Outbox.status.in_(('pending', 'sending'))).one()
+        failed = db.session.query(func.count(Outbox.id)).filter(Outbox.status == 'failed').scalar()
+        sent = db.session.query(Outbox.created, Outbox.sent) \
+            .filter(Outbox.status == 'sent', Outbox.sent >= now - timedelta(hours=1)) \
+            .all()
+        latencies = sorted((delivered - created).total_seconds() for created, delivered in sent)
+        return {
+            'pending': pending,
+            'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0,
+            'failed': failed,
+            'sent_last_hour': len(latencies),
+            'latency_p50_seconds': latencies[len(latencies) // 2] if latencies else None,
+            'latency_p95_seconds': latencies[int(len(latencies) * 0.95)] if latencies else None,
+        }
+
+class OutboxWorker:
+    """
+    OutboxWorker drains the outbox table over one SMTP connection which is kept open for as 
+    long as there is mail to send, instead of connecting and logging in to the relay for 
+    every message. 
+    Messages are claimed Config.OUTBOX_BATCH_SIZE at a time, in a short transaction of their own 
+    which marks them 'sending' and commits before anything is sent, so no row locks are held while 
+    we wait on the relay. On PostgreSQL the claim uses SELECT ... FOR UPDATE SKIP LOCKED so several 
+    workers can run side by side; on sqlite run a single worker. A claim is a lease: if the worker 
+    dies mid-batch, its messages are picked up again once Config.OUTBOX_LEASE_SECONDS have passed. 
+    A message which fails is retried with exponential backoff (Config.OUTBOX_RETRY_BASE seconds, 
+    doubling each attempt, capped at an hour) and marked failed after Config.OUTBOX_MAX_ATTEMPTS. 
+    """
+    def __init__(self, batch_size=None, poll_interval=None):
+        self.batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+        self.poll_interval = poll_interval or Config.OUTBOX_POLL_INTERVAL
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            connection = mail.connect()
+            connection.__enter__()
+            self.connection = connection
+        return self.connection
+
+    def disconnect(self):
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.connection = None
+
+    def deliver(self, msg):
+        """
+        deliver sends one message over the shared connection, reconnecting once if the relay 
+        has dropped us since the last message. 
+
+        Returns:
+            seconds spent talking to the relay
+        """
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            try:
+                self.connect().send(msg)
+            except smtplib.SMTPServerDisconnected:
+                self.disconnect()
+                self.connect().send(msg)
+            outcome = 'sent'
+        finally:
+            elapsed = time.perf_counter() - started
+            Metrics.smtp.observe(elapsed, outcome=outcome)
+        return elapsed
+
+    def send_batch(self, messages):
+        """
+        send_batch sends messages right now, over this worker's single connection, for the 
+        cases where an admin is waiting on the result. 
+        Anything which fails is handed to the outbox so it still gets retried later. 
+
+        Args:
+            messages - list of flask_mail.Message
+        Returns:
+            list of (recipient, error) tuples in the order given, error is None for a message 
+            which was accepted by the relay
+        """
+        results = []
+        retry = []
+        for msg in messages:
+            try:
+                self.deliver(msg)
+                results.append((', '.join(msg.recipients), None))
+            except Exception as e:
+                self.disconnect()
+                results.append((', '.join(msg.recipients), str(e)))
+                retry.append(msg)
+        if retry:
+            Mailer.enqueue(*retry)
+        return results
+
+    def run_once(self):
+        """
+        run_once claims and sends one batch of due messages. 
+
+        Returns:
+            (sent, failed) counts for the batch
+        """
+        now = datetime.utcnow()
+        batch = Outbox.query \
+            .filter(Outbox.status.in_(('pending', 'sending')), Outbox.next_attempt <= now) \
+            .order_by(Outbox.next_attempt, Outbox.id) \
+            .limit(self.batch_size) \
+            .with_for_update(skip_locked=True) \
+            .all()
+        claimed = []
+        for item in batch:
+            item.status = 'sending'
+            item.attempts = (item.attempts or 0) + 1
+            item.next_attempt = now + timedelta(seconds=Config.OUTBOX_LEASE_SECONDS)
+            msg = Message(item.subject, sender=item.sender, recipients=item.recipients.split(','), body=item.body, html=item.html)
+            claimed.append((item, item.attempts, msg))
+        db.session.commit()
+
+        sent = failed = 0
+        smtp_seconds = 0.0
+        for item, attempts, msg in claimed:
+            try:
+                smtp_seconds += self.deliver(msg)
+                item.status = 'sent'
+                item.sent = datetime.utcnow()
+                item.last_error = None
+                sent += 1
+            except Exception as e:
+                self.disconnect()
+                item.last_error = str(e)[:500]
+                if attempts >= Config.OUTBOX_MAX_ATTEMPTS:
+                    item.status = 'failed'
+                else:
+                    item.status = 'pending'
+                    backoff = min(Config.OUTBOX_RETRY_BASE * 2 ** (attempts - 1), 3600)
+                    item.next_attempt = datetime.utcnow() + timedelta(seconds=backoff)
+                failed += 1
+            # one at a time, so a worker dying mid-batch only resends what it hadn't recorded yet
+            db.session.commit()
+        if claimed:
+            current_app.logger.info(f'Outbox: sent {sent}, failed {failed}, {smtp_seconds:.2f}s on smtp')
+        return sent, failed
+
+    def run(self):
+        """
+        run drains the outbox forever, sleeping Config.OUTBOX_POLL_INTERVAL seconds (and 
+        closing the SMTP connection) whenever there is nothing due. 
+        """
+        while True:
+            sent, failed = self.run_once()
+            if sent + failed < self.batch_size:
+                self.disconnect()
+                db.session.remove()
+                time.sleep(self.poll_interval)
@@ -0,0 +1,191 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from config import Config
+from flask import current_app, g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import threading
+import time
+
+class Histogram:
+    """
+    A Prometheus style histogram: for every combination of label values, cumulative counts of 
+    observations falling at or under each bucket boundary plus the running sum and count. 
+    Only what /metrics needs is here, so there's no dependency on prometheus_client. 
+    """
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        """
+        expose renders the histogram in the Prometheus text exposition format. 
+
+        Returns:
+            list of lines
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self.series.items())]
+        for key, counts, total, count in snapshot:
+            labels = list(zip(self.labelnames, key))
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{Metrics.labels(labels + [("le", bound)])} {bucket}')
+            lines.append(f'{self.name}_bucket{Metrics.labels(labels + [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{Metrics.labels(labels)} {total}')
+            lines.append(f'{self.name}_count{Metrics.labels(labels)} {count}')
+        return lines
+
+class RequestStats:
+    """
+    What we've seen so far while handling the current request, kept on flask.g. 
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.templates = []
+
+class Metrics:
+    """
+    Metrics collects per-endpoint request latency, SQL query counts and time, template render time 
+    and SMTP send time for this worker process, and renders them for Prometheus at /metrics. 
+
+    Requests are timed from before_request to after_request, so for the streamed csv exports this is 
+    the time to the first byte rather than the whole download. SQL is timed with engine cursor events 
+    and attributed to whichever request is running on the thread. Every gunicorn worker keeps its own 
+    numbers, so scrape each worker (or run a single worker) if you need the complete picture. 
+
+    When SLOW_REQUEST_MS or QUERY_BUDGET are set, any request going over either is logged as a warning 
+    with its timings, which is usually enough to find the page that needs a look. 
+    """
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+    requests = Histogram('health_tracker_request_duration_seconds', 'Time spent handling requests, by endpoint.',
+        ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+    queries = Histogram('health_tracker_request_queries', 'SQL statements executed per request, by endpoint.',
+        ('endpoint',), QUERY_BUCKETS)
+    sql = Histogram('health_tracker_request_sql_seconds', 'Time spent in SQL per request, by endpoint.',
+        ('endpoint',), LATENCY_BUCKETS)
+    templates = Histogram('health_tracker_template_render_seconds', 'Time spent rendering templates, by template.',
+        ('template',), LATENCY_BUCKETS)
+    smtp = Histogram('health_tracker_smtp_send_seconds', 'Time spent sending a message to the SMTP relay, by outcome.',
+        ('outcome',), LATENCY_BUCKETS)
+
+    @staticmethod
+    def labels(pairs):
+        """
+        labels formats (name, value) pairs as a Prometheus label set, escaping the values. 
+        """
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    @staticmethod
+    def expose():
+        """
+        expose renders every metric in the Prometheus text exposition format (version 0.0.4). 
+        """
+        lines = []
+        for histogram in (Metrics.requests, Metrics.queries, Metrics.sql, Metrics.templates, Metrics.smtp):
+            lines.extend(histogram.expose())
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def current():
+        """
+        current returns the RequestStats of the request being handled on this thread, or None 
+        outside of a request (cli commands, the outbox worker). 
+        """
+        if has_request_context():
+            return g.get('request_stats')
+        return None
+
+def start_request_stats():
+    g.request_stats = RequestStats()
+
+def record_request_stats(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unmatched'
+    Metrics.requests.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    Metrics.queries.observe(stats.queries, endpoint=endpoint)
+    Metrics.sql.observe(stats.sql_seconds, endpoint=endpoint)
+    slow = Config.SLOW_REQUEST_MS and elapsed * 1000 > Config.SLOW_REQUEST_MS
+    chatty = Config.QUERY_BUDGET and stats.queries > Config.QUERY_BUDGET
+    if slow or chatty:
+        current_app.logger.warning(f'{request.method} {request.path} ({endpoint}) took {elapsed * 1000:.0f}ms, '
+            f'{stats.queries} queries in {stats.sql_seconds * 1000:.0f}ms, '
+            f'templates: {", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in stats.templates) or "none"}')
+    return response
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats = Metrics.current()
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += elapsed
+
+@before_render_template.connect
+def start_template_timer(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+@template_rendered.connect
+def stop_template_timer(sender, template, context, **extra):
+    started = g.get('template_started') if has_request_context() else None
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    Metrics.templates.observe(elapsed, template=template.name)
+    stats = Metrics.current()
+    if stats is not None:
+        stats.templates.append((template.name, elapsed))
+
+def init_app(app):
+    app.before_request(start_request_stats)
+    app.after_request(record_request_stats)
\ No newline at end of file
@@ -20,12 +20,14 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 Please refer to LICENSE in the project repository for details.
 """
-from app import app
 from app import db
 from config import Config
 from flask_security import Security, SQLAlchemyUserDatastore, UserMixin, RoleMixin
-from sqlalchemy import ForeignKey, desc, text
-from sqlalchemy.orm import relationship
+from sqlalchemy import ForeignKey, func, case, or_, and_, event
+from sqlalchemy.orm import relationship, joinedload
+from sqlalchemy.sql import visitors
+from sqlalchemy.types import TypeDecorator, CHAR
+from sqlalchemy.dialects import postgresql
 import uuid
 import re
 from datetime import datetime, timedelta, date
@@ -33,8 +35,38 @@ import random
 import string
 from app.utilities import Utilities
 
+class GUID(TypeDecorator):
+    """
+    GUID stores a uuid as compactly as the datastore allows: PostgreSQL's native 16 byte uuid type, 
+    or the 32 hex digits (no dashes) in a CHAR(32) everywhere else. 
+    Values come back as uuid.UUID, whose str() is the usual dashed form we put in urls, csv 
+    exports and tokens. Strings are accepted anywhere a value is bound, so filter_by(id='...') 
+    with an id from a url or a reset token works as it always has. 
+    """
+    impl = CHAR
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID())
+        return dialect.type_descriptor(CHAR(32))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        if dialect.name == 'postgresql':
+            return str(value)
+        return value.hex
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        return uuid.UUID(value)
+
 roles_users = db.Table('roles_users',
-    db.Column('user_id', db.String(), db.ForeignKey('users.id')),
+    db.Column('user_id', GUID(), db.ForeignKey('users.id')),
     db.Column('role_id', db.Integer(), db.ForeignKey('role.id')))
 
 class Role(db.Model, RoleMixin):
@@ -43,7 +75,7 @@ class Role(db.Model, RoleMixin):
     description = db.Column(db.String())
 
 class Users(db.Model, UserMixin):
-    id = db.Column(db.String(), primary_key=True, default=str(uuid.uuid1()))
+    id = db.Column(GUID(), primary_key=True, default=uuid.uuid1)
     email = db.Column(db.String(), unique=True)
     name = db.Column(db.String)
     phone = db.Column(db.String)
@@ -54,35 +86,56 @@ class Users(db.Model, UserMixin):
     active = db.Column(db.Boolean())
     confirmed_at = db.Column(db.DateTime())
     roles = db.relationship('Role', secondary=roles_users, backref=db.backref('users', lazy='dynamic'))
-    readings = db.relationship('Readings', backref=db.backref('users'), order_by=desc(text('Readings.created')))
+    # a query rather than a list, so pages take a window with .limit() or a slice (LIMIT) instead of loading every reading
+    readings = db.relationship('Readings', backref=db.backref('users'), lazy='dynamic', order_by='(desc(Readings.created), desc(Readings.id))')
 
     def __init__(self, **kwargs):
         super(Users, self).__init__(**kwargs)
-        self.id = str(uuid.uuid1())
         self.created = datetime.utcnow()
+
+    @property
+    def role_names(self):
+        """
+        role_names is the set of the user's role names, worked out once per loaded user (so once 
+        per request for current_user) and forgotten whenever roles changes. 
+        The users that Flask-Security loads come with their roles already joined in (see UserDatastore), 
+        so for current_user this never queries. 
+        """
+        names = self.__dict__.get('_role_names')
+        if names is None:
+            names = self.__dict__['_role_names'] = frozenset(role.name for role in self.roles)
+        return names
+
+    def has_role(self, role):
+        """
+        has_role replaces UserMixin.has_role, which walks roles on every call, with a set lookup. 
+        It's what the templates and our own checks use. 
+
+        Args:
+            role - role name or Role instance
+        Returns:
+            bool
+        """
+        return (role if isinstance(role, str) else role.name) in self.role_names
     
     def reading_today(self):
         """
         reading_today checks to see if the user has satisifed their reading for _today_.
-        Today is determined by a comparison for the return value of Utilities.get_date() to get 
-        today's current date in our YYYY-mm-dd format and the reading_date value of the very most 
-        recent entry in user.readings. 
-        If a user does not have any readings, False will be returned. 
-        If a user has readings but the most recent doesn't pass the date check, False is 
-        returned as we assume they have not yet done a reading for today. 
+        Today is determined by Utilities.today(), which gives us the UTC bounds of the 
+        current local day. 
+        Rather than loading the user's readings, this is a single EXISTS lookup on the 
+        (user_id, created) index of readings, so the cost does not grow 
+        with the number of readings a user has recorded. 
 
         Args:
             None
         Returns: 
             bool - True for a reading recorded today, False if no reading for today. 
         """
-        if len(self.readings) < 1:
-            return False
-        else:
-            if Utilities.get_date() == self.readings[0].reading_date:
-                return True
-            else:
-                return False
+        today = Utilities.today()
+        return db.session.query(
+            Readings.query.filter(Readings.user_id == self.id, Readings.today(today)).exists()
+        ).scalar()
     
     #TODO: update all instances where this method is used to respect that it is staticmethod
     @staticmethod
@@ -128,20 +181,32 @@ class Users(db.Model, UserMixin):
                 return normalized
 
 class Readings(db.Model):
-    id = db.Column(db.String(), primary_key=True, default=str(uuid.uuid1()))
+    """
+    On PostgreSQL readings is partitioned by month of reading_date, and months past the retention 
+    window are moved to readings_archive (see app.archive). Partitioned tables need the partition 
+    key in every unique constraint, hence the (id, reading_date) primary key, which the other 
+    datastores get too so the model is the same everywhere; the ORM still treats id alone as the identity. 
+    """
+    __table_args__ = (
+        db.PrimaryKeyConstraint('id', 'reading_date', name='readings_pkey'),
+        db.UniqueConstraint('user_id', 'reading_date', name='uq_readings_user_id_reading_date'),
+        db.Index('ix_readings_user_id_created', 'user_id', 'created'),
+        {'postgresql_partition_by': 'RANGE (reading_date)'},
+    )
+    id = db.Column(GUID(), default=uuid.uuid1)
     created = db.Column(db.DateTime, index=True)
     reading_date = db.Column(db.String)
-    temp = db.Column(db.String)
-    oximeter = db.Column(db.String)
+    temp = db.Column(db.Numeric(4, 1), index=True)
+    oximeter = db.Column(db.Numeric(4, 1), index=True)
     status = db.Column(db.String)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'))
+    user_id = db.Column(GUID(), db.ForeignKey('users.id'))
     symptoms = db.Column(db.Boolean) # True == user indicated "symptoms" and system default is Reading == not-working
+    __mapper_args__ = {'primary_key': [id]}
 
     def __init__(self, **kwargs):
         super(Readings, self).__init__(**kwargs)
-        self.id = str(uuid.uuid1())
         self.created = datetime.utcnow()
-        self.reading_date = Utilities.get_date()
+        self.reading_date = Utilities.day_of(self.created).date
         if self.status == True:
             self.status = 'working'
         else:
@@ -156,9 +221,298 @@ class Readings(db.Model):
             self.symptoms = True
             self.status = 'not working'
 
-    def get_username(self):
+
+    def as_dict(self):
+        """
+        as_dict is the JSON representation of a reading used by the JSON api routes. 
+        Timestamps are UTC in ISO 8601, and temp/oximeter are plain numbers rather than Decimals. 
+        Only the reading's own columns are included, so a representation can't change after the 
+        reading is recorded (the api's ETags depend on that, see FragmentCache.generations()). 
+        """
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'created': self.created.isoformat() + 'Z',
+            'reading_date': self.reading_date,
+            'temp': float(self.temp) if self.temp is not None else None,
+            'oximeter': float(self.oximeter) if self.oximeter is not None else None,
+            'symptoms': self.symptoms,
+            'status': self.status,
+        }
+
+    @staticmethod
+    def newest(query):
+        """
+        newest returns the (created, id) sort key of the most recent reading matched by query, or 
+        None when nothing matches. It's a single indexed ORDER BY ... LIMIT 1. 
+        created is set before the reading commits, so a reading can become visible after a newer 
+        one already has: use it as a watermark only with some lag (see ReadingsExport.since()), and 
+        not as a validator for whether the query's results have changed. 
+
+        Args:
+            query - a Readings query, already filtered but not yet ordered
+        Returns:
+            (created, id) tuple or None
+        """
+        return query.with_entities(Readings.created, Readings.id) \
+            .order_by(Readings.created.desc(), Readings.id.desc()) \
+            .first()
+
+    @staticmethod
+    def today(day):
+        """
+        Filter expression for readings recorded on the given day, as a range on created so 
+        the created indexes can be used instead of comparing reading_date strings. 
+        reading_date is always the local day of created, so comparing it too changes nothing 
+        except that PostgreSQL only has to look in this month's partition. 
+
+        Args:
+            day - Day tuple, typically the return value of Utilities.today()
+        """
+        return and_(Readings.created >= day.start, Readings.created < day.end, Readings.reading_date == day.date)
+
+    @staticmethod
+    def before(created, id):
+        """
+        Filter expression for readings which sort strictly after (created, id) in our usual 
+        newest-first order, i.e. older readings. Written so the created index can be used 
+        as a range scan, with id only breaking ties. 
+        """
+        return and_(Readings.created <= created, or_(Readings.created < created, Readings.id < id))
+
+    @staticmethod
+    def after(created, id):
+        """
+        Filter expression for readings newer than (created, id), the mirror of before(). 
+        """
+        return and_(Readings.created >= created, or_(Readings.created > created, Readings.id > id))
+
+    @staticmethod
+    def up_to(created, id):
+        """
+        Filter expression for readings up to and including (created, id), the inclusive 
+        counterpart of before(). 
+        """
+        return and_(Readings.created <= created, or_(Readings.created < created, Readings.id <= id))
+
+    @staticmethod
+    def archived(statement):
+        """
+        archived rewrites a select over readings to read from readings_archive instead, which has 
+        the same columns. That's how exports and the rollup backfill see archived months without 
+        each needing a second copy of their queries. 
+
+        Args:
+            statement - select (e.g. a Query's .statement) which reads from readings
+        Returns:
+            the same select over readings_archive
+        """
+        table = Readings.__table__
+
+        def replace(element):
+            if element is table:
+                return readings_archive
+            if isinstance(element, db.Column) and element.table is table:
+                return readings_archive.c[element.key]
+            return None
+        return visitors.replacement_traverse(statement, {}, replace)
+
+    @staticmethod
+    def keyset_page(query, token, page_size):
+        """
+        keyset_page pages through a readings query, newest first, by remembering the sort key 
+        of the rows at the edges of the page instead of counting and offsetting. 
+        Every page costs one indexed LIMIT query no matter how deep into the readings it is, 
+        and there is no COUNT(*) over the table. 
+
+        Args:
+            query - a Readings query, already filtered but not yet ordered
+            token - page token from a previous call (see Utilities.encode_cursor), or None for the first page
+            page_size - number of readings per page
+        Returns:
+            (readings, next_token, prev_token) - tokens are None when there is no page in that direction
+        """
+        cursor = Utilities.decode_cursor(token)
+        if cursor and cursor[2] == 'prev':
+            created, id, _ = cursor
+            rows = query.filter(Readings.after(created, id)) \
+                .order_by(Readings.created.asc(), Readings.id.asc()) \
+                .limit(page_size + 1).all()
+            has_prev = len(rows) > page_size
+            rows = list(reversed(rows[:page_size]))
+            has_next = True
+        else:
+            if cursor:
+                created, id, _ = cursor
+                query = query.filter(Readings.before(created, id))
+            rows = query.order_by(Readings.created.desc(), Readings.id.desc()) \
+                .limit(page_size + 1).all()
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+            has_prev = cursor is not None
+        next_token = Utilities.encode_cursor(rows[-1].created, rows[-1].id, 'next') if rows and has_next else None
+        prev_token = Utilities.encode_cursor(rows[0].created, rows[0].id, 'prev') if rows and has_prev else None
+        return rows, next_token, prev_token
+
+    @staticmethod
+    def fever():
+        """
+        Filter expression for readings at or above Config.FEVER_THRESHOLD. 
+        The threshold is in whatever units the org records temperatures in (see TEMP_UNITS_ENCODING). 
+        """
+        return Readings.temp >= Config.FEVER_THRESHOLD
+
+    @staticmethod
+    def low_oximeter():
+        """
+        Filter expression for readings below Config.LOW_OXIMETER_THRESHOLD. 
+        """
+        return Readings.oximeter < Config.LOW_OXIMETER_THRESHOLD
+
+    @staticmethod
+    def filters(name):
+        """
+        filters maps the ?filter= query arg used by the readings views and exports onto 
+        filter expressions. Unknown or missing names mean no filtering. 
+
+        Args:
+            name - 'fever', 'low_oximeter' or None
+        Returns:
+            list of filter expressions
+        """
+        if name == 'fever':
+            return [Readings.fever()]
+        if name == 'low_oximeter':
+            return [Readings.low_oximeter()]
+        return []
+
+    @staticmethod
+    def vitals(*criterion):
         """
-        This could prob be done differently 
+        vitals aggregates the readings matching the given criterion in a single query, 
+        letting the datastore do the math rather than pulling every reading into python. 
+
+        Args:
+            criterion - filter expressions, e.g. Readings.user_id == user.id
+        Returns:
+            dict of count, avg_temp, max_temp, avg_oximeter, min_oximeter, fever, low_oximeter
         """
-        user = Users.query.get(self.user_id)
-        return user.username
\ No newline at end of file
+        row = db.session.query(
+            func.count(Readings.id),
+            func.avg(Readings.temp),
+            func.max(Readings.temp),
+            func.avg(Readings.oximeter),
+            func.min(Readings.oximeter),
+            func.coalesce(func.sum(case([(Readings.fever(), 1)], else_=0)), 0),
+            func.coalesce(func.sum(case([(Readings.low_oximeter(), 1)], else_=0)), 0),
+        ).filter(*criterion).one()
+        keys = ('count', 'avg_temp', 'max_temp', 'avg_oximeter', 'min_oximeter', 'fever', 'low_oximeter')
+        return dict(zip(keys, row))
+
+readings_archive = db.Table('readings_archive',
+    db.Column('id', GUID()),
+    db.Column('created', db.DateTime, index=True),
+    db.Column('reading_date', db.String),
+    db.Column('temp', db.Numeric(4, 1)),
+    db.Column('oximeter', db.Numeric(4, 1)),
+    db.Column('status', db.String),
+    db.Column('user_id', GUID(), db.ForeignKey('users.id')),
+    db.Column('symptoms', db.Boolean),
+    db.PrimaryKeyConstraint('id', 'reading_date', name='readings_archive_pkey'),
+    db.Index('ix_readings_archive_user_id_created', 'user_id', 'created'),
+    postgresql_partition_by='RANGE (reading_date)',
+)
+
+class Outbox(db.Model):
+    """
+    Outgoing email waiting to be (or already) delivered by the outbox worker, see app.mailer. 
+    status moves from 'pending' to 'sending' while a worker has it claimed, then to 'sent', back to 
+    'pending' to be retried, or to 'failed' once every retry has been used up. 
+    """
+    __table_args__ = (
+        db.Index('ix_outbox_status_next_attempt', 'status', 'next_attempt'),
+    )
+    id = db.Column(db.Integer(), primary_key=True)
+    created = db.Column(db.DateTime, index=True)
+    subject = db.Column(db.String)
+    sender = db.Column(db.String)
+    recipients = db.Column(db.String)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String, default='pending')
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt = db.Column(db.DateTime)
+    sent = db.Column(db.DateTime)
+    last_error = db.Column(db.String)
+
+class DailySummary(db.Model):
+    """
+    One row per reading date with that day's totals, written once the day is over (see 
+    Rollup.settle()) so the analytics pages never have to scan old readings. 
+    Temperature and oximeter are stored as sums so averages can be worked out for any range. 
+    active_users is the number of active users when the day was settled, and is the denominator 
+    for the day's reporting rate. 
+    """
+    __tablename__ = 'daily_summary'
+    day = db.Column(db.String(10), primary_key=True)
+    readings = db.Column(db.Integer, default=0)
+    working = db.Column(db.Integer, default=0)
+    not_working = db.Column(db.Integer, default=0)
+    symptoms = db.Column(db.Integer, default=0)
+    fever = db.Column(db.Integer, default=0)
+    low_oximeter = db.Column(db.Integer, default=0)
+    temp_total = db.Column(db.Numeric(12, 1), default=0)
+    oximeter_total = db.Column(db.Numeric(12, 1), default=0)
+    active_users = db.Column(db.Integer, default=0)
+    updated = db.Column(db.DateTime)
+
+class Attendance(db.Model):
+    """
+    Which days of a month a user recorded a reading, one row per user per month. 
+    days is a bitmask where bit n set means a reading on day n + 1 of the month, so a 
+    users x days attendance matrix for a range is a handful of rows per user instead of one per reading. 
+    """
+    user_id = db.Column(GUID(), db.ForeignKey('users.id'), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    days = db.Column(db.BigInteger, default=0)
+
+class CacheGeneration(db.Model):
+    """
+    A counter per cache scope ('readings', 'users', 'user:<id>'), bumped as soon as any write that 
+    touches the scope commits (see app.cache). Cached fragments are keyed on the counters of the 
+    scopes they were rendered from, so a bump makes the old entries unreachable for every worker at once. 
+    """
+    __tablename__ = 'cache_generation'
+    name = db.Column(db.String, primary_key=True)
+    generation = db.Column(db.Integer, default=0)
+    updated = db.Column(db.DateTime)
+
+class RosterEvent(db.Model):
+    """
+    A change to the dashboard roster: a reading recorded, or a user activated or deactivated. 
+    Written in the same transaction as the change (see app.events), and streamed from there to 
+    open admin dashboards. data is the JSON sent to them. Rows are pruned after EVENTS_RETENTION_HOURS. 
+    """
+    __tablename__ = 'roster_event'
+    id = db.Column(db.Integer(), primary_key=True)
+    created = db.Column(db.DateTime, index=True)
+    kind = db.Column(db.String)
+    user_id = db.Column(GUID())
+    data = db.Column(db.Text)
+
+@event.listens_for(Users.roles, 'append')
+@event.listens_for(Users.roles, 'remove')
+def forget_role_names(target, *args):
+    target.__dict__.pop('_role_names', None)
+
+class UserDatastore(SQLAlchemyUserDatastore):
+    """
+    Flask-Security loads current_user through find_user at the start of every authenticated 
+    request, and then reads its roles for the roles_required/roles_accepted checks, the nav and 
+    the dashboard. Joining the roles in here makes that one query instead of two. 
+    """
+
+    def find_user(self, **kwargs):
+        return self.user_model.query.options(joinedload(self.user_model.roles)).filter_by(**kwargs).first()
+
+user_datastore = UserDatastore(db, Users, Role)
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Users, Readings, DailySummary, Attendance
+from app.utilities import Utilities
+from config import Config
+from datetime import date, datetime, timedelta
+from itertools import chain
+from sqlalchemy import case, event, func, select
+
+class Rollup:
+    """
+    Rollup keeps the daily_summary and attendance tables in step with readings, so the analytics 
+    pages only ever read pre-aggregated rows. 
+
+    - Every new reading sets its bit in the user's attendance row for the month, in the same 
+      transaction as the reading itself (see the after_flush listener at the bottom of this module). 
+      That row is the user's own, so concurrent readings never wait on each other for it. 
+    - A day's daily_summary row is only written once the day is over ("settled", see settle()), 
+      with one GROUP BY over that day's readings. Nothing on the path of recording a reading 
+      touches a row that every other reading of the day would also have to lock. Days that 
+      are still open (today, and yesterday for the first EXPORT_WATERMARK_LAG seconds after 
+      midnight) are added up from readings when they're asked for, see open_totals(). 
+
+    Readings are never edited once recorded so inserts are all we need to follow. 
+    If history needs rebuilding, e.g. after changing FEVER_THRESHOLD, run `flask rollup backfill`. 
+    """
+    COUNTS = ('readings', 'working', 'not_working', 'symptoms', 'fever', 'low_oximeter', 'temp_total', 'oximeter_total')
+
+    @staticmethod
+    def active_users():
+        """
+        Scalar subquery counting active users. 
+        """
+        return select([func.count(Users.id)]).where(Users.active == True).as_scalar()
+
+    @staticmethod
+    def next_day(day):
+        """
+        next_day is the YYYY-mm-dd string for the day after day. 
+        """
+        return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+    @staticmethod
+    def closed():
+        """
+        closed is the last day which can't get any more readings: yesterday, once today is 
+        EXPORT_WATERMARK_LAG seconds old, so readings from just before midnight have had time to commit. 
+
+        Returns:
+            YYYY-mm-dd string
+        """
+        today = Utilities.day_of(datetime.utcnow() - timedelta(seconds=Config.EXPORT_WATERMARK_LAG))
+        return (date.fromisoformat(today.date) - timedelta(days=1)).isoformat()
+
+    @staticmethod
+    def totals(connection, start=None, end=None):
+        """
+        totals adds readings up by reading date for dates between start and end (inclusive, 
+        YYYY-mm-dd strings, either may be None for no limit), archived months included. 
+        reading_date is the local day of created, so the range is also put on created where the 
+        created indexes can narrow it down. 
+
+        Args:
+            connection - connection (or session) to run the queries on
+            start - first reading date, or None
+            end - last reading date, or None
+        Returns:
+            list of (day, *COUNTS) rows, in no particular order
+        """
+        criterion = []
+        if start:
+            criterion += [Readings.reading_date >= start, Readings.created >= Utilities.local_day(date.fromisoformat(start)).start]
+        if end:
+            criterion += [Readings.reading_date <= end, Readings.created < Utilities.local_day(date.fromisoformat(end)).end]
+        counts = db.session.query(
+            Readings.reading_date,
+            func.count(Readings.id),
+            func.sum(case([(Readings.status == 'working', 1)], else_=0)),
+            func.sum(case([(Readings.status == 'not working', 1)], else_=0)),
+            func.sum(case([(Readings.symptoms == True, 1)], else_=0)),
+            func.sum(case([(Readings.fever(), 1)], else_=0)),
+            func.sum(case([(Readings.low_oximeter(), 1)], else_=0)),
+            func.coalesce(func.sum(Readings.temp), 0),
+            func.coalesce(func.sum(Readings.oximeter), 0),
+        ).filter(*criterion).group_by(Readings.reading_date).statement
+        return connection.execute(counts).fetchall() + connection.execute(Readings.archived(counts)).fetchall()
+
+    @staticmethod
+    def open_totals(start, end):
+        """
+        open_totals adds up the days between start and end that haven't been settled yet, straight 
+        from readings, in the same shape as daily_summary rows. 
+
+        Args:
+            start - first day of the range, YYYY-mm-dd string
+            end - last day of the range, YYYY-mm-dd string
+        Returns:
+            list of (day, active_users, *COUNTS) rows, empty when every day in the range is settled
+        """
+        start = max(start, Rollup.next_day(Rollup.closed()))
+        if start > end:
+            return []
+        rows = Rollup.totals(db.session, start, end)
+        if not rows:
+            return []
+        active = db.session.query(Rollup.active_users()).scalar()
+        return [(row[0], active, *row[1:]) for row in rows]
+
+    @staticmethod
+    def settle():
+        """
+        settle writes the daily_summary rows of the days which have closed since it last ran, 
+        with the number of users active right now as their active_users. Most of the time there 
+        is nothing to do and it costs one max() lookup. The last settled day is done again in case 
+        it was written while still open (by a backfill, say). 
+        It reads and writes on the primary even inside read_only views, so a lagging replica can't 
+        leave out a day's last readings for good. Upserts make it safe for several workers to 
+        settle the same days at once. 
+        Called by the analytics views before they read, and by `flask rollup settle`. 
+
+        Returns:
+            number of daily_summary rows written
+        """
+        closed = Rollup.closed()
+        connection = db.session.connection(bind=db.engine)
+        last = connection.execute(select([func.max(DailySummary.day)])).scalar()
+        if last and last >= closed:
+            return 0
+        days = {row[0]: row[1:] for row in Rollup.totals(connection, last, closed)}
+        # days without readings get an empty row too, so they aren't looked at again. With 
+        # active_users 0 they count the same as a missing row: no reporting rate. 
+        day = last
+        while day and day <= closed:
+            days.setdefault(day, None)
+            day = Rollup.next_day(day)
+        if days:
+            summary = DailySummary.__table__
+            active = connection.execute(select([Rollup.active_users()])).scalar()
+            now = datetime.utcnow()
+            for day, counts in days.items():
+                if counts is None:
+                    changes = dict(dict.fromkeys(Rollup.COUNTS, 0), active_users=0, updated=now)
+                else:
+                    changes = dict(zip(Rollup.COUNTS, counts), active_users=active, updated=now)
+                Utilities.upsert(connection, summary, dict(changes, day=day), changes)
+        db.session.commit()
+        return len(days)
+
+    @staticmethod
+    def record(connection, readings):
+        """
+        record adds newly inserted readings to their users' attendance, one update per reading. 
+
+        Args:
+            connection - connection of the transaction the readings were inserted in
+            readings - the Readings instances that were inserted
+        """
+        attendance = Attendance.__table__
+        for reading in readings:
+            bit = 1 << (int(reading.reading_date[8:10]) - 1)
+            Utilities.upsert(connection, attendance,
+                dict(user_id=reading.user_id, month=reading.reading_date[:7], days=bit),
+                dict(days=attendance.c.days.op('|')(bit)))
+
+    @staticmethod
+    def backfill(start=None, end=None):
+        """
+        backfill rebuilds the rollup tables from the readings table for reading dates between start 
+        and end (inclusive, YYYY-mm-dd strings, either may be None for no limit). 
+        The summary is rebuilt with one GROUP BY over readings (see totals()), attendance by streaming 
+        (user_id, reading_date) pairs for the months touched and or-ing the bits together. 
+        Both are run over readings_archive as well; months are archived whole, so no day or 
+        month shows up in both. 
+        Historical active user counts aren't recorded anywhere, so backfilled days get today's count. 
+
+        Args:
+            start - first reading date to rebuild, or None
+            end - last reading date to rebuild, or None
+        Returns:
+            (days, attendance rows) tuple of how many rows were written
+        """
+        counts = Rollup.totals(db.session, start, end)
+        active = db.session.query(Rollup.active_users()).scalar()
+        now = datetime.utcnow()
+        summaries = [dict(zip(Rollup.COUNTS, row[1:]), day=row[0], active_users=active, updated=now) for row in counts]
+
+        # attendance rows cover whole months, so widen the range out to the month boundaries
+        months = {}
+        month_criterion = []
+        if start:
+            month_criterion.append(Readings.reading_date >= start[:7] + '-01')
+        if end:
+            month_criterion.append(Readings.reading_date <= end[:7] + '-31')
+        pairs = db.session.query(Readings.user_id, Readings.reading_date).filter(*month_criterion)
+        archived = db.session.execute(Readings.archived(pairs.statement).execution_options(stream_results=True))
+        for user_id, reading_date in chain(pairs.yield_per(Config.EXPORT_CHUNK_SIZE), archived):
+            key = (user_id, reading_date[:7])
+            months[key] = months.get(key, 0) | 1 << (int(reading_date[8:10]) - 1)
+        attendance = [dict(user_id=user_id, month=month, days=days) for (user_id, month), days in months.items()]
+
+        summary_criterion = []
+        attendance_criterion = []
+        if start:
+            summary_criterion.append(DailySummary.day >= start)
+            attendance_criterion.append(Attendance.month >= start[:7])
+        if end:
+            summary_criterion.append(DailySummary.day <= end)
+            attendance_criterion.append(Attendance.month <= end[:7])
+        DailySummary.query.filter(*summary_criterion).delete(synchronize_session=False)
+        Attendance.query.filter(*attendance_criterion).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(DailySummary, summaries)
+        db.session.bulk_insert_mappings(Attendance, attendance)
+        db.session.commit()
+        return len(summaries), len(attendance)
+
+@event.listens_for(db.session, 'after_flush')
+def rollup_readings(session, flush_context):
+    readings = [instance for instance in session.new if isinstance(instance, Readings)]
+    if readings:
+        Rollup.record(session.connection(), readings)
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Users, Readings
+from sqlalchemy import and_, exists
+
+class Roster:
+    """
+    The Roster is the admin's view of "who has checked in today". 
+    Rather than loading every user and then walking each user's full readings relationship 
+    (one query per user, plus every reading they have ever recorded), the roster is 
+    built in a single round trip: active users outer joined to their reading for the given day. 
+    The join is a range on the (user_id, created) index of readings, so the cost of 
+    building the roster grows with headcount and not with reading history. 
+    """
+    @staticmethod
+    def today(today):
+        """
+        today returns the roster for the given reading date. 
+
+        Args:
+            today - Day tuple, typically the return value of Utilities.today()
+        Returns:
+            list of (Users, Readings) tuples, ordered by username. The Readings member 
+            is None when the user has not recorded a reading for the given day. 
+        """
+        return db.session.query(Users, Readings) \
+            .outerjoin(Readings, and_(Readings.user_id == Users.id, Readings.today(today))) \
+            .filter(Users.active == True) \
+            .order_by(Users.username) \
+            .all()
+
+    @staticmethod
+    def missing(today):
+        """
+        missing returns every active user who has not recorded a reading for the given day, 
+        in a single query. This is who the "remind everyone" button on the dashboard emails. 
+
+        Args:
+            today - Day tuple, typically the return value of Utilities.today()
+        Returns:
+            list of Users, ordered by username
+        """
+        recorded = exists().where(and_(Readings.user_id == Users.id, Readings.today(today)))
+        return Users.query \
+            .filter(Users.active == True, ~recorded) \
+            .order_by(Users.username) \
+            .all()
\ No newline at end of file
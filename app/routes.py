@@ -20,29 +20,41 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 Please refer to LICENSE in the project repository for details.
 """
-from app import app
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import desc
+from sqlalchemy import desc, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from app import db
-from flask import render_template, flash, redirect, url_for, Response, request, g
+from flask import Blueprint, current_app, render_template, flash, redirect, url_for, Response, request, g, stream_with_context, jsonify, abort
 from flask_security import Security, SQLAlchemyUserDatastore, UserMixin, RoleMixin, login_required, current_user, url_for_security
 from flask_security.utils import encrypt_password, verify_password, hash_password, login_user, send_mail
 from flask_security.decorators import roles_required, roles_accepted
-from app.models import Users, Readings, Role
-from app.forms import ReadingsForm, AddUser
+from app.models import Users, Readings, Role, user_datastore
+from app.forms import ReadingsForm, AddUser, ImportUsers
 import os
 from datetime import datetime
 from config import Config
 from app import mail
 from flask_security.recoverable import generate_reset_password_token
 from app.utilities import Utilities
+from app.roster import Roster
+from app.exports import ReadingsExport
+from app.imports import UserImport
+from app.kiosk import ReadingsBatch
+from app.mailer import Mailer, OutboxWorker
+from app.analytics import Analytics
+from app.cache import cache
+from app.events import events
+from app.metrics import Metrics
+import hmac
+import io
 import traceback
+import time
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-user_datastore = SQLAlchemyUserDatastore(db, Users, Role)
-security = Security(app, user_datastore)
+bp = Blueprint('main', __name__)
 
-@app.context_processor
+@bp.app_context_processor
 def inject_org():
     """Inject the org variable into our templates
     as it is commonly used
@@ -52,7 +64,7 @@ def inject_org():
     else:
         return dict(org=None)
 
-@app.context_processor
+@bp.app_context_processor
 def inject_units():
     """Inject the units variable into our templates
     as it is commonly used. If config var isn't set 
@@ -64,82 +76,55 @@ def inject_units():
         return dict(units="&#8457;")
 
 
-@app.before_first_request
-def bootstrap():
-    """
-    bootstrap will handle the creation of our user roles and admin 
-    user setup when the app is first run. 
-    This func will not be run until a request is made; it does not run 
-    when the app is invoked. 
-    Typically just loading the home or login page will be enough to run 
-    bootstrap, but do not expect roles and admin user to exist before you 
-    have requested at least one page. 
-    It should go without saying that the admin user should immediately reset their 
-    password once registered. Just follow the reset password flow from the link on the login page. 
-    
-    *Should you lose the admin login credentials and you cannot recover from a password reset*
-    You will need to manually go into your datastore and identify the id of the admin user. 
-    Once you have that id, you will need to remove any associated readings and then also delete the 
-    roles_users entry where userid = user.id of your admin. 
-    Once readings and the roles_users entries have been removed, you can then delete the admin user 
-    from the datastore. 
-    Once deleted, stop and then restart the application and load a page to kick off the bootstrap func again. 
-    Your admin user will be restored to the initial state, using the password defined in the BOOTSTRAP_PASS env var. 
-    The admin user has no ownership over anything other than their own readings, so there is no danger in 
-    removing and re-adding this user, other than the fact that you will lose their readings, if they have any.
-    """
-    db.create_all()
-    admin = user_datastore.find_role('admin')
-    if not admin:
-        user_datastore.create_role(name='admin', description='admin user role')
-        db.session.commit()
-        admin = user_datastore.find_role('admin')
-    employee = user_datastore.find_role('employee')
-    if not employee:
-        user_datastore.create_role(name='employee', description='employee user role')
-        db.session.commit()
-    admin_user = user_datastore.find_user(email=Config.BOOTSTRAP_EMAIL)
-    if not admin_user:
-        user_datastore.create_user(email=Config.BOOTSTRAP_EMAIL, username=Config.BOOTSTRAP_USERNAME, password=hash_password(Config.BOOTSTRAP_PASS))
-        db.session.commit()
-        admin_user = user_datastore.find_user(email=Config.BOOTSTRAP_EMAIL)
-        user_datastore.add_role_to_user(admin_user, admin)
-        db.session.commit()
-
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/home')
+@bp.route('/home')
 @login_required
+@db.read_only
 def home():
     """
     These items are explicitly stated for clarity. 
     TODO: make use of the methods and objects available by default in jinja to clean up this template.
     """
     user = current_user
-    today = Utilities.get_date()
+    today = Utilities.today()
     is_admin = False
-    all_users = []
+    roster = None
+    recent = []
+    last_event = None
     if user.has_role('admin'):
         is_admin = True
-        all_users = Users.query.all()
-    return render_template('home.html', user=user, is_admin=is_admin, users=all_users, today=today)
+        # before the roster, so the live updates replay anything the (possibly cached) roster misses
+        last_event = events.latest()
+        roster = cache.fragment('roster', ('readings', 'users'),
+            lambda: render_template('includes/roster.html', roster=Roster.today(today), today=today.date),
+            today.date)
+    if user.has_role('employee'):
+        recent = user.readings.limit(Config.HOME_RECENT_READINGS).all()
+    return render_template('home.html', user=user, is_admin=is_admin, roster=roster, recent=recent, last_event=last_event, today=today.date)
 
-@app.route('/readings', methods=['GET'])
+@bp.route('/readings', methods=['GET'])
 @login_required
 @roles_required('admin')
+@db.read_only
 def readings():
     """
     A paginated view of all readings, sorted in desc order. 
-    """
-    page = request.args.get("page", 1, type=int)
-    readings = Readings.query.order_by(Readings.created.desc()).paginate(page, Config.POSTS_PER_PAGE, True)
-    next_url = url_for('readings', page=readings.next_num) if readings.has_next else None
-    prev_url = url_for('readings', page=readings.prev_num) if readings.has_prev else None
-    return render_template('all_readings.html', readings=readings.items, next=next_url, prev=prev_url)
+    Appending ?filter=fever or ?filter=low_oximeter limits the view to readings over the 
+    configured thresholds. 
+    Pages are keyed on (created, id) rather than page numbers (see Readings.keyset_page), so 
+    the hundredth page loads as quickly as the first. 
+    """
+    reading_filter = request.args.get('filter')
+    query = Readings.query.filter(*Readings.filters(reading_filter))
+    readings, next_token, prev_token = Readings.keyset_page(query, request.args.get('cursor'), Config.POSTS_PER_PAGE)
+    next_url = url_for('main.readings', cursor=next_token, filter=reading_filter) if next_token else None
+    prev_url = url_for('main.readings', cursor=prev_token, filter=reading_filter) if prev_token else None
+    return render_template('all_readings.html', readings=readings, next=next_url, prev=prev_url, reading_filter=reading_filter)
 
-@app.route('/readings/new', methods=['GET', 'POST'])
+@bp.route('/readings/new', methods=['GET', 'POST'])
 @login_required
 def new_reading():
     """
@@ -147,7 +132,10 @@ def new_reading():
     This is available to both admins and employees.
     Before taking a reading we will check the most recent user's reading and compare that 
     to "today" in order to see if a reading is required. 
-    No date math or time deltas, just str comparison via Users.reading_today()
+    No date math or time deltas, just an indexed lookup via Users.reading_today()
+    Two submits racing each other (double taps, two open tabs) will both pass that check, 
+    so the unique (user_id, reading_date) constraint on readings has the final say and the 
+    loser is shown the "reading exists" page. 
     """
     user = current_user
     form = ReadingsForm()
@@ -155,19 +143,23 @@ def new_reading():
         return render_template('reading_exists.html')
     if form.validate_on_submit():
         try:
-            reading = Readings(user_id=user.id, temp=str(form.temp.data), oximeter=str(form.oximeter.data), status=form.working_btn.data, symptoms=form.symptoms.data)
+            reading = Readings(user_id=user.id, temp=form.temp.data, oximeter=form.oximeter.data, status=form.working_btn.data, symptoms=form.symptoms.data)
             db.session.add(reading)
             db.session.commit()
             flash('Your reading has been recorded', category='success')
-            return redirect(url_for('single_reading', id=reading.id))
+            return redirect(url_for('main.single_reading', id=reading.id))
+        except IntegrityError:
+            db.session.rollback()
+            return render_template('reading_exists.html')
         except Exception as e:
             flash('Your reading could not be recorded, please try again. If this problem continues, please inform your manager.', category='error')
-            app.logger.debug(f'Reading err: {datetime.now()} \n {e}')
-            return redirect(url_for('new_reading'))
+            current_app.logger.debug(f'Reading err: {datetime.now()} \n {e}')
+            return redirect(url_for('main.new_reading'))
     return render_template('new_reading.html', form=form)
 
-@app.route('/readings/<id>', methods=['GET'])
+@bp.route('/readings/<uuid:id>', methods=['GET'])
 @login_required
+@db.read_only
 def single_reading(id):
     """
     Single view of a reading, really only shown after a reading has been recorded. 
@@ -177,27 +169,50 @@ def single_reading(id):
     return render_template('reading_accepted.html', reading=reading)
 
 
-@app.route('/users', methods=['GET'])
+@bp.route('/users', methods=['GET'])
 @login_required
 @roles_accepted('admin')
+@db.read_only
 def users():
     """
     Simple view of all users. 
+    The table is a cached fragment, see app.cache. Everyone's roles are loaded with one 
+    more query rather than one per row. 
     """
-    users = Users.query.all()
-    return render_template('all_users.html', users=users)
+    table = cache.fragment('users', ('users',),
+        lambda: render_template('includes/users_table.html', users=Users.query.options(selectinload(Users.roles)).all()))
+    return render_template('all_users.html', table=table)
 
-@app.route('/users/<id>', methods=['GET', 'POST'])
+@bp.route('/users/<uuid:id>', methods=['GET', 'POST'])
 @login_required
 @roles_accepted('admin')
+@db.read_only
 def single_user(id):
     """
     View of single user. 
+    The vitals and readings below the user's card are cached fragments, only rebuilt after 
+    this user or their readings change, see app.cache. 
+    The vitals cover every reading the user has recorded, with one aggregate query found through the 
+    (user_id, created) index. They're cached apart from the readings, so paging doesn't run it again. 
+    The readings are HISTORY_PER_PAGE at a time, newest first, paged with ?cursor the same way as 
+    the readings view, so the page costs the same for someone with years of readings as for a new hire. 
     """
     user = Users.query.get(id)
-    return render_template('single_user.html', user=user)
+    cursor = request.args.get('cursor')
+
+    def render_vitals():
+        return render_template('includes/user_vitals.html', vitals=Readings.vitals(Readings.user_id == user.id))
 
-@app.route('/users/add', methods=['GET', 'POST'])
+    def render():
+        readings, next_token, prev_token = Readings.keyset_page(Readings.query.filter(Readings.user_id == user.id), cursor, Config.HISTORY_PER_PAGE)
+        return render_template('includes/user_readings.html', user=user, readings=readings,
+            next=url_for('main.single_user', id=user.id, cursor=next_token) if next_token else None,
+            prev=url_for('main.single_user', id=user.id, cursor=prev_token) if prev_token else None)
+    vitals = cache.fragment('user_vitals', (f'user:{user.id}',), render_vitals, user.id)
+    readings = cache.fragment('user_readings', (f'user:{user.id}',), render, user.id, cursor)
+    return render_template('single_user.html', user=user, vitals=vitals, readings=readings)
+
+@bp.route('/users/add', methods=['GET', 'POST'])
 @login_required
 @roles_accepted('admin')
 def new_user():
@@ -216,7 +231,7 @@ def new_user():
         new_user = user_datastore.find_user(email=form.email.data)
         if new_user:
             flash('User with given email address already exists. User not created.', category='error')
-            return redirect(url_for('new_user'))
+            return redirect(url_for('main.new_user'))
         
         """
         Try and create the new user with given email, username, and role. 
@@ -231,10 +246,10 @@ def new_user():
             user_datastore.activate_user(new_user)
             db.session.commit()
         except Exception as e:
-            app.logger.debug(e)
+            current_app.logger.debug(e)
             db.session.rollback()
             flash('There was an error creating this user. Please try again before reporting.', category='error')
-            return redirect(url_for('new_user'))
+            return redirect(url_for('main.new_user'))
         
         """
         Now that we have a new user, we're going to try and send them their "activation" link via email. 
@@ -252,54 +267,270 @@ def new_user():
         except Exception as e:
             db.session.rollback()
             flash('New user was created but invitation email was not sent.', category='error')
-            return redirect(url_for('new_user'))
+            return redirect(url_for('main.new_user'))
         
         flash(f'New user "{new_user.username}" was created and invitation email sent.', category='success')
-        return redirect(url_for('new_user'))
+        return redirect(url_for('main.new_user'))
     return render_template('new_user.html', form=form)
 
-@app.route('/api/readings', methods=['GET'])
+@bp.route('/users/import', methods=['GET', 'POST'])
+@login_required
+@roles_accepted('admin')
+def import_users():
+    """
+    import_users is the bulk version of new_user: upload a csv with email, username and role 
+    columns and every valid, new user in it is created and sent their invitation email. 
+    Rows which are invalid or would duplicate an existing user are skipped and listed back 
+    to the admin with the reason. 
+    The same import is available from the command line via `flask users import <file>`. 
+    """
+    form = ImportUsers()
+    result = None
+    if form.validate_on_submit():
+        try:
+            stream = io.StringIO(form.csv_file.data.read().decode('utf-8-sig'))
+            result = UserImport(stream).run()
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f'The file could not be imported: {e}', category='error')
+            return redirect(url_for('main.import_users'))
+        flash(f'{len(result.created)} users were created and invitation emails queued. {len(result.skipped)} rows were skipped.', category='success')
+    return render_template('import_users.html', form=form, result=result)
+
+@bp.route('/analytics', methods=['GET'])
+@login_required
+@roles_required('admin')
+@db.read_only
+def analytics():
+    """
+    Daily reporting, fever, low oximeter and working numbers for a range of days 
+    (?start=YYYY-mm-dd&end=YYYY-mm-dd, defaulting to the last ANALYTICS_DAYS days), or with 
+    ?view=matrix the users x days attendance grid for the same range. 
+    Everything comes from the rollup tables, see app.analytics. The same data is available 
+    as JSON from /api/analytics. 
+    """
+    view = 'matrix' if request.args.get('view') == 'matrix' else 'summary'
+    try:
+        days = Analytics.days(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        flash(f'Invalid date range: {e}', category='error')
+        days = Analytics.days()
+    report = Analytics.matrix(days) if view == 'matrix' else Analytics.summary(days)
+    return render_template('analytics.html', view=view, report=report)
+
+@bp.route('/api/analytics', methods=['GET'])
+@login_required
+@roles_required('admin')
+@db.read_only
+def api_analytics():
+    """
+    JSON version of the analytics page, taking the same start, end and view args. 
+    A bad date range is a 400 rather than falling back to the default range. 
+    """
+    try:
+        days = Analytics.days(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if request.args.get('view') == 'matrix':
+        return jsonify(Analytics.matrix(days))
+    return jsonify(Analytics.summary(days))
+
+def export_response(export, filename):
+    """
+    export_response streams a ReadingsExport to the client as a download. 
+    - ?format=ndjson writes one JSON object per reading per line instead of csv. 
+    - A client sending "Accept-Encoding: gzip" gets the body gzipped with a Content-Encoding 
+      header, so it arrives (and is saved) exactly as it would have been uncompressed. 
+    - ?compress=gzip downloads a .gz file instead, for clients which don't negotiate encodings. 
+    - ?since= makes it incremental: only readings after the watermark (a timestamp, or the 
+      X-Next-Watermark header of the previous export), oldest first, see ReadingsExport.since. 
+      The response's X-Next-Watermark is what to pass as ?since= next time. 
+    Compression happens on the fly, chunk by chunk, so nothing is ever buffered whole. 
+
+    Args:
+        export - ReadingsExport to stream
+        filename - download name, without an extension
+    Returns:
+        streamed Response
+    """
+    headers = {'Vary': 'Accept-Encoding'}
+    since = request.args.get('since')
+    if since:
+        try:
+            created, id = Utilities.decode_watermark(since)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        newest = export.since(created, id)
+        headers['X-Next-Watermark'] = Utilities.encode_cursor(*newest, 'prev') if newest else since
+    format = 'ndjson' if request.args.get('format') == 'ndjson' else 'csv'
+    mimetype = 'application/x-ndjson' if format == 'ndjson' else 'text/csv'
+    filename = f'{filename}.{format}'
+    body = Utilities.stream_generate_readings(export.header, export.rows(), format)
+    if request.args.get('compress') == 'gzip':
+        body = Utilities.gzip_stream(body)
+        mimetype = 'application/gzip'
+        filename = f'{filename}.gz'
+    elif request.accept_encodings['gzip']:
+        body = Utilities.gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    response = Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    return response
+
+@bp.route('/api/readings', methods=['GET'])
 @login_required
 @roles_required('admin')
+@db.read_only
 def api_readings():
     """
     This route returns a csv file of all readings, grouped by reading date. 
     The default is to include all relevant columns in the csv, which includes username. 
     An alternate version of this report can be obtained by appending ?anon=true to the end of the URL. 
     This "anonymous" csv will have the usernames stripped out.
+    Either version can be limited with ?filter=fever or ?filter=low_oximeter. 
+    Any of them can be had as NDJSON or gzipped, see export_response. 
     """
-    filename = "all_readings-{}.csv".format(Utilities.get_date())
+    filename = "all_readings-{}".format(Utilities.get_date())
     header_cols = ('id', 'created', 'temp', 'oximeter', 'symptoms', 'reading_date', 'status', 'username')
     if request.args.get('anon') == 'true':
-        filename = "all_readings_anon-{}.csv".format(Utilities.get_date())
+        filename = "all_readings_anon-{}".format(Utilities.get_date())
         header_cols = ('id', 'created', 'temp', 'oximeter', 'symptoms', 'reading_date', 'status')
-    readings = Readings.query.order_by(Readings.created.desc()).all()
-    response = Response(Utilities.stream_generate_readings(header_cols, readings), mimetype='text/csv')
-    response.headers.set("Content-Disposition", "attachment", filename=filename)
-    return response
+    export = ReadingsExport(header_cols, *Readings.filters(request.args.get('filter')))
+    return export_response(export, filename)
 
-@app.route('/api/readings/<user_id>', methods=['GET'])
+@bp.route('/api/readings/<uuid:user_id>', methods=['GET'])
 @login_required
 @roles_required('admin')
+@db.read_only
 def api_readings_user(user_id):
     """
     This route returns a csv file of all readings for a particular user, grouped by reading date. 
     The default is to include all relevant columns in the csv, which includes username. 
     An alternate version of this report can be obtained by appending ?anon=true to the end of the URL. 
     This "anonymous" csv will have the usernames stripped out.
+    Either version can be limited with ?filter=fever or ?filter=low_oximeter. 
+    Any of them can be had as NDJSON or gzipped, see export_response. 
     """
     user = Users.query.get(user_id)
-    readings = user.readings
-    filename = "{}_readings-{}.csv".format(user.username, Utilities.get_date())
+    filename = "{}_readings-{}".format(user.username, Utilities.get_date())
     header_cols = ('id', 'created', 'temp', 'oximeter', 'symptoms', 'reading_date', 'status')
     if request.args.get('anon') == 'true':
-        filename = "anon_user_{}_readings-{}.csv".format(user.id, Utilities.get_date())
+        filename = "anon_user_{}_readings-{}".format(user.id, Utilities.get_date())
         header_cols = ('created', 'temp', 'oximeter', 'symptoms', 'reading_date', 'status')
-    response = Response(Utilities.stream_generate_readings(header_cols, readings), mimetype='text/csv')
-    response.headers.set("Content-Disposition", "attachment", filename=filename)
-    return response
+    export = ReadingsExport(header_cols, Readings.user_id == user.id, *Readings.filters(request.args.get('filter')))
+    return export_response(export, filename)
+
+@bp.route('/api/readings/batch', methods=['POST'])
+@login_required
+@roles_required('admin')
+def api_readings_batch():
+    """
+    Record readings for a whole crew in one request, for a supervisor at a shared kiosk station. 
+    Takes a JSON object with a 'readings' list (at most KIOSK_MAX_BATCH rows), validates each row 
+    like the new reading form and records the valid ones in one transaction, see app.kiosk. 
+    Responds with a result for every row in the same order, so one bad row doesn't sink the rest. 
+    """
+    data = request.get_json(silent=True)
+    rows = data.get('readings') if isinstance(data, dict) else None
+    if not isinstance(rows, list):
+        return jsonify(error='expected a JSON object with a readings list'), 400
+    if len(rows) > Config.KIOSK_MAX_BATCH:
+        return jsonify(error=f'at most {Config.KIOSK_MAX_BATCH} readings per batch'), 400
+    results = ReadingsBatch(rows).run()
+    return jsonify(created=len([result for result in results if result['result'] == 'created']), results=results)
+
+@bp.route('/api/readings.json', methods=['GET'])
+@bp.route('/api/readings/<uuid:user_id>.json', methods=['GET'])
+@login_required
+@roles_required('admin')
+@db.read_only
+def api_readings_json(user_id=None):
+    """
+    JSON version of the readings exports, newest first, one page at a time. 
+    ?filter=fever or ?filter=low_oximeter limit it the same way as the csv, ?limit sets the page size 
+    (POSTS_PER_PAGE by default, at most API_MAX_PAGE_SIZE) and the 'next'/'prev' urls in the 
+    response carry the ?cursor for the neighbouring pages (see Readings.keyset_page). 
+    Responses carry a strong ETag and Last-Modified built from the readings cache generation (the 
+    user's, for one user's readings), which moves on once for every commit that adds or archives 
+    readings. A dashboard polling with If-None-Match gets an empty 304 until that happens, 
+    whatever order concurrent readings commit in. 
+    """
+    criterion = list(Readings.filters(request.args.get('filter')))
+    if user_id is not None:
+        if Users.query.get(user_id) is None:
+            return jsonify(error='user not found'), 404
+        criterion.append(Readings.user_id == user_id)
+    limit = min(request.args.get('limit', Config.POSTS_PER_PAGE, type=int), Config.API_MAX_PAGE_SIZE)
+    args = dict(filter=request.args.get('filter'), limit=limit if 'limit' in request.args else None)
+    query = Readings.query.filter(*criterion)
+    generations, last_modified = cache.generations(('readings',) if user_id is None else (f'user:{user_id}',))
+    etag = Utilities.etag('readings', user_id, generations, args, request.args.get('cursor'))
+    if Utilities.not_modified(request, etag, last_modified):
+        return Utilities.validated(Response(status=304), etag, last_modified)
 
-@app.route('/users/<user_id>/reminder', methods=['POST'])
+    readings, next_token, prev_token = Readings.keyset_page(query, request.args.get('cursor'), max(limit, 1))
+    endpoint = request.endpoint
+    view_args = dict(request.view_args, **args)
+    response = jsonify(
+        readings=[reading.as_dict() for reading in readings],
+        next=url_for(endpoint, cursor=next_token, _external=True, **view_args) if next_token else None,
+        prev=url_for(endpoint, cursor=prev_token, _external=True, **view_args) if prev_token else None,
+    )
+    return Utilities.validated(response, etag, last_modified)
+
+@bp.route('/api/roster.json', methods=['GET'])
+@login_required
+@roles_required('admin')
+@db.read_only
+def api_roster_json():
+    """
+    JSON version of the dashboard roster: every active user and their reading for today, if any. 
+    The ETag covers today's date and the readings and users cache generations, so it changes when 
+    someone checks in, at midnight, and when users are added, activated or deactivated. It's one 
+    primary key lookup before the roster itself is built. 
+    """
+    today = Utilities.today()
+    generations, last_modified = cache.generations(('readings', 'users'))
+    etag = Utilities.etag('roster', today.date, generations)
+    if Utilities.not_modified(request, etag, last_modified):
+        return Utilities.validated(Response(status=304), etag, last_modified)
+
+    roster = Roster.today(today)
+    response = jsonify(
+        date=today.date,
+        active_users=len(roster),
+        reported=len([reading for _, reading in roster if reading]),
+        roster=[{
+            'user_id': member.id,
+            'username': member.username,
+            'reading': reading.as_dict() if reading else None,
+        } for member, reading in roster],
+    )
+    return Utilities.validated(response, etag, last_modified)
+
+@bp.route('/api/roster/events', methods=['GET'])
+@login_required
+@roles_required('admin')
+def api_roster_events():
+    """
+    Server-Sent Events stream of changes to today's roster, for the dashboard to patch its roster 
+    table in place (static/js/roster.js): 'reading' events carry the new reading, 'activated' and 
+    'deactivated' the user. Starts after ?after=<event id> (or the Last-Event-ID a reconnecting 
+    browser sends), or from now. See app.events for how the events get here. 
+    A worker that already has EVENTS_MAX_SUBSCRIBERS streams open answers 503 instead, and the 
+    dashboard goes back to reloading itself. 
+    """
+    if events.full():
+        return jsonify(error='too many live dashboards open, try again later'), 503, {'Retry-After': '60'}
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('after', type=int)
+    if last_id is None:
+        last_id = events.latest()
+    stream = events.stream(current_app._get_current_object(), last_id)
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/users/<uuid:user_id>/reminder', methods=['POST'])
 @login_required
 @roles_required('admin')
 def send_reminder(user_id):
@@ -311,7 +542,7 @@ def send_reminder(user_id):
     """
     try:
         user = Users.query.get(user_id)
-        send_mail('You are required to record health readings', user.email, 'send_reminder', link=url_for('new_reading', _external=True))
+        send_mail('You are required to record health readings', user.email, 'send_reminder', link=url_for('main.new_reading', _external=True))
         flash(f'Reminder email sent to { user.email }', category='success')
     except Exception as e:
         flash(f'Reminder email was not sent to { user.email }, there was an error. ', category='error')
@@ -319,9 +550,38 @@ def send_reminder(user_id):
     if request.args.get('return'):
         return redirect(request.args.get('return'))
     else:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
-@app.route('/users/<user_id>/invitation', methods=['POST'])
+@bp.route('/users/reminders', methods=['POST'])
+@login_required
+@roles_required('admin')
+def send_reminders():
+    """
+    The dashboard version of send_reminder: email every active user who hasn't recorded a 
+    reading today, in one go. 
+    The reminder is the same for everyone so it is rendered once, then sent to each recipient 
+    over a single SMTP connection while the admin waits, so they get a per-recipient report 
+    of what was sent. Anything the relay rejects is left in the outbox to be retried. 
+    """
+    today = Utilities.today()
+    users = Roster.missing(today)
+    reminder = Mailer.message('You are required to record health readings', None, 'send_reminder', link=url_for('main.new_reading', _external=True))
+    messages = Mailer.personalize(reminder, [user.email for user in users])
+    worker = OutboxWorker()
+    started = time.perf_counter()
+    try:
+        results = worker.send_batch(messages)
+    finally:
+        worker.disconnect()
+    elapsed = time.perf_counter() - started
+    failed = len([error for _, error in results if error])
+    if failed:
+        flash(f'{failed} of {len(results)} reminders could not be sent right away and will be retried.', category='error')
+    else:
+        flash(f'Reminder email sent to all {len(results)} users missing a reading.', category='success')
+    return render_template('reminders_sent.html', today=today.date, results=zip(users, results), sent=len(results) - failed, failed=failed, elapsed=elapsed)
+
+@bp.route('/users/<uuid:user_id>/invitation', methods=['POST'])
 @login_required
 @roles_required('admin')
 def resend_invitation(user_id):
@@ -344,12 +604,12 @@ def resend_invitation(user_id):
         send_mail(subject, user.email, 'invite_new_user', reset_link=link)
         flash('User invitation email was sent.', category='success')
     except Exception as e:
-        app.logger.debug(e)
+        current_app.logger.debug(e)
         db.session.rollback()
         flash('User invitation email was not sent, there was an error', category='error')
-    return redirect(url_for('single_user', id=user_id))
+    return redirect(url_for('main.single_user', id=user_id))
 
-@app.route('/users/<user_id>/deactivate', methods=['POST'])
+@bp.route('/users/<uuid:user_id>/deactivate', methods=['POST'])
 @login_required
 @roles_required('admin')
 def deactivate_user(user_id):
@@ -363,7 +623,7 @@ def deactivate_user(user_id):
     """
     if user_model == current_user:
         flash('You cannot deactivate your own account.', category='error')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     try:
         result = user_datastore.deactivate_user(user_model)
         db.session.commit()
@@ -372,15 +632,15 @@ def deactivate_user(user_id):
         else:
             raise Exception
     except Exception as e:
-        app.logger.debug("Error in deactivating user - user_datastore.deactivate_user raised an exception")
+        current_app.logger.debug("Error in deactivating user - user_datastore.deactivate_user raised an exception")
         flash(f'Error: could not be deactivated. ', category='error')
     
     if request.args.get('return'):
         return redirect(request.args.get('return'))
     else:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
-@app.route('/users/<user_id>/activate', methods=['POST'])
+@bp.route('/users/<uuid:user_id>/activate', methods=['POST'])
 @login_required
 @roles_required('admin')
 def activate_user(user_id):
@@ -399,28 +659,48 @@ def activate_user(user_id):
         else:
             raise Exception
     except Exception as e:
-        app.logger.debug("Error in activating user - user_datastore.activate_user raised an exception")
+        current_app.logger.debug("Error in activating user - user_datastore.activate_user raised an exception")
         flash(f'Error: could not be activated. ', category='error')
     
     if request.args.get('return'):
         return redirect(request.args.get('return'))
     else:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Request latency, query counts, template and SMTP timings for this worker in the Prometheus 
+    text format, see app.metrics. 
+    Admins can open it in the browser; a scraper authenticates with an 
+    "Authorization: Bearer <METRICS_TOKEN>" header instead, when METRICS_TOKEN is set. 
+    """
+    token = request.headers.get('Authorization', '')
+    scraper = Config.METRICS_TOKEN and hmac.compare_digest(token, f'Bearer {Config.METRICS_TOKEN}')
+    if not scraper:
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        if not current_user.has_role('admin'):
+            abort(403)
+    return Response(Metrics.expose(), mimetype='text/plain; version=0.0.4')
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def system_err(e):
     """
     We're not anticipating full-blown monitoring in the context of running this 
     app, so in the interest of alerting if a 500 err is encountered, we're going 
     to attempt to email the admin with the details of err. 
+    The email is queued in the outbox, so roll back whatever the failed request left 
+    in the session first. 
     """
     try:
+        db.session.rollback()
         send_mail('The Health Tracker system encountered an error', Config.BOOTSTRAP_EMAIL, 'system_500_email', error=traceback.format_exc())
     except Exception as ex:
         """I mean, if this exception is raised, you got problems"""
-        app.logger.debug(ex)
+        current_app.logger.debug(ex)
     return render_template('500.html'), 500
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from flask import current_app, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from functools import wraps
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+import random
+import time
+
+class RoutingSession(SignallingSession):
+    """
+    RoutingSession sends reads to a replica once read_only (see RoutingSQLAlchemy) has picked 
+    one for it. Flushes and Core INSERT/UPDATE/DELETE statements run through the session (like 
+    Query.update() or session.execute(table.insert())) always go to the primary, as does 
+    everything else. A connection taken with session.connection() in a read_only view is the 
+    replica's, so code writing on it directly has to ask for session.connection(bind=db.engine). 
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if isinstance(clause, UpdateBase):
+            self.info['writing'] = True
+        elif replica is not None and not self._flushing:
+            return replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+def notice_flushed_write(session, flush_context):
+    if session.new or session.deleted or any(session.is_modified(instance) for instance in session.dirty):
+        session.info['writing'] = True
+
+def remember_write(session):
+    # only commits which actually wrote something count, not the empty ones that end most requests. 
+    # Savepoints fire this and forget_write too, only the outermost transaction decides. 
+    if not session.transaction.nested and session.info.pop('writing', False):
+        session.info['wrote'] = True
+
+def forget_write(session):
+    if not session.transaction.nested:
+        session.info.pop('writing', None)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with optional read replicas. 
+    Each url in DATABASE_REPLICA_URLS becomes a replica_<n> bind (see Config.SQLALCHEMY_BINDS). 
+    Views decorated with db.read_only run their queries, and stream their responses, from one of 
+    those replicas picked at random; everything else, including any writes a read-only view makes, 
+    stays on the primary. 
+    Replicas lag the primary, so for REPLICA_STICKY_SECONDS after a request commits a write, that 
+    browser's read-only views go to the primary too. That's what lets the redirect after recording 
+    a reading show the reading that was just saved. 
+    Without any replicas configured read_only does nothing. 
+    """
+    STICKY_KEY = '_primary_until'
+
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        # listeners go on the factory: sessionmaker makes its own subclass of RoutingSession, 
+        # which doesn't pick up listeners added to RoutingSession itself 
+        event.listen(factory, 'after_flush', notice_flushed_write)
+        event.listen(factory, 'after_commit', remember_write)
+        event.listen(factory, 'after_rollback', forget_write)
+        return factory
+
+    def init_app(self, app):
+        super(RoutingSQLAlchemy, self).init_app(app)
+        app.after_request(self.stick_to_primary)
+
+    @staticmethod
+    def replicas(app):
+        """
+        replicas lists the bind names of the configured replicas. 
+        """
+        return sorted(bind for bind in app.config['SQLALCHEMY_BINDS'] or () if bind.startswith('replica_'))
+
+    def read_only(self, view):
+        """
+        Decorator for views which only read, to run them against a replica. 
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            replicas = self.replicas(current_app)
+            if replicas and session.get(self.STICKY_KEY, 0) < time.time():
+                self.session.info['replica'] = self.get_engine(current_app, bind=random.choice(replicas))
+            return view(*args, **kwargs)
+        return wrapper
+
+    def stick_to_primary(self, response):
+        if self.session.info.get('wrote') and self.replicas(current_app):
+            session[self.STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+        return response
+
+    def dispose(self, app):
+        """
+        dispose closes the pooled connections of the primary and every replica. 
+        """
+        self.get_engine(app).dispose()
+        for bind in self.replicas(app):
+            self.get_engine(app, bind=bind).dispose()
\ No newline at end of file
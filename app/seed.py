@@ -0,0 +1,194 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import Users, Role, Readings, roles_users
+from app.archive import ReadingsArchive
+from app.cache import FragmentCache
+from app.rollup import Rollup
+from app.utilities import Utilities
+from config import Config
+from datetime import datetime, timedelta
+from flask_security.utils import hash_password
+from types import SimpleNamespace
+import numpy as np
+import uuid
+
+class Seeder:
+    """
+    Seeder fills the datastore with made up but plausible users and readings, for trying the app 
+    (and benchmarks/routes.py) at a realistic scale, e.g. 10,000 users with a year of history. 
+
+    - Every user reports on most days but not all: each has their own compliance rate, spread 
+      around the coverage asked for, so the dashboard has a realistic handful missing each day. 
+    - Readings are taken some time in the local morning, so created and reading_date line up 
+      the same way they would for real readings. 
+    - Temperatures sit around normal (in whichever units TEMP_UNITS_ENCODING says) with the odd 
+      fever, oximeter readings are mostly in the high 90s, and a few percent report symptoms. 
+    - Everything is bulk inserted a batch at a time, one transaction per batch, the same way the 
+      user import does. Seeded users all share one password (hashing thousands of them would take 
+      longer than the rest of the seed), which also lets benchmarks log in as any of them. 
+    - The rows skip the ORM, so the rollup tables are rebuilt and the cache generations bumped 
+      at the end. 
+
+    The same seed always produces the same data, apart from ids and dates, which are relative to today. 
+    """
+    FIRST_NAMES = ('james', 'mary', 'robert', 'patricia', 'john', 'jennifer', 'michael', 'linda', 'david', 'elizabeth',
+        'william', 'barbara', 'richard', 'susan', 'joseph', 'jessica', 'thomas', 'sarah', 'carlos', 'karen',
+        'daniel', 'nancy', 'matthew', 'lisa', 'anthony', 'maria', 'mark', 'sandra', 'paul', 'ashley',
+        'wei', 'priya', 'ahmed', 'fatima', 'hiroshi', 'yuki', 'olga', 'ivan', 'amara', 'kwame')
+    LAST_NAMES = ('smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez', 'martinez',
+        'hernandez', 'lopez', 'gonzalez', 'wilson', 'anderson', 'thomas', 'taylor', 'moore', 'jackson', 'martin',
+        'lee', 'perez', 'thompson', 'white', 'harris', 'clark', 'lewis', 'walker', 'nguyen', 'patel',
+        'kim', 'chen', 'singh', 'kowalski', 'okafor', 'tanaka', 'ivanova', 'haddad', 'mensah', 'silva')
+
+    def __init__(self, users, days, coverage=0.85, seed=None, password='password', batch_size=10000):
+        """
+        Args:
+            users - number of employees to create
+            days - days of history to create for each of them, ending today
+            coverage - average share of days each user records a reading on
+            seed - seed for the random generator, for repeatable data
+            password - password for every seeded user
+            batch_size - rows inserted per transaction
+        """
+        self.users = users
+        self.days = days
+        self.coverage = coverage
+        self.random = np.random.RandomState(seed)
+        self.password = password
+        self.batch_size = batch_size
+        self.celsius = Config.TEMP_UNITS_ENCODING == '&#8451;'
+        self.now = datetime.utcnow()
+
+    def roles(self):
+        """
+        roles makes sure the admin and employee roles exist (normally bootstrap's job) and returns the employee role. 
+        """
+        for name in ('admin', 'employee'):
+            if Role.query.filter_by(name=name).first() is None:
+                db.session.add(Role(name=name, description=f'{name} user role'))
+        db.session.commit()
+        return Role.query.filter_by(name='employee').first()
+
+    def calendar(self):
+        """
+        calendar returns the seeded days, oldest first, as Day tuples (see Utilities.local_day). 
+        """
+        today = Utilities.today()
+        last = datetime.strptime(today.date, '%Y-%m-%d').date()
+        return [Utilities.local_day(last - timedelta(days=offset)) for offset in range(self.days - 1, -1, -1)]
+
+    def readings(self, user_id, calendar):
+        """
+        readings generates one user's history as a list of row dicts for the readings table. 
+        """
+        n = len(calendar)
+        rate = min(max(self.random.normal(self.coverage, 0.1), 0.2), 1.0)
+        reported = np.flatnonzero(self.random.random_sample(n) < rate)
+        k = len(reported)
+        if self.celsius:
+            temps = np.where(self.random.random_sample(k) < 0.02, self.random.normal(38.6, 0.4, k), self.random.normal(36.7, 0.3, k))
+        else:
+            temps = np.where(self.random.random_sample(k) < 0.02, self.random.normal(101.4, 0.7, k), self.random.normal(98.1, 0.5, k))
+        oximeters = np.clip(np.round(self.random.normal(97.6, 1.3, k)), 85, 100)
+        symptoms = self.random.random_sample(k) < 0.03
+        working = ~symptoms & (self.random.random_sample(k) < 0.95)
+        # some time between 6 and 10:30 in the morning, local time
+        seconds = self.random.randint(6 * 3600, 10 * 3600 + 1800, k)
+        rows = []
+        for i, day in enumerate(reported):
+            created = calendar[day].start + timedelta(seconds=int(seconds[i]))
+            if created > self.now:
+                # today's readings from people who haven't got up yet
+                continue
+            rows.append({
+                'id': uuid.uuid1(),
+                'created': created,
+                'reading_date': calendar[day].date,
+                'temp': round(float(temps[i]), 1),
+                'oximeter': float(oximeters[i]),
+                'symptoms': bool(symptoms[i]),
+                'status': 'working' if working[i] else 'not working',
+                'user_id': user_id,
+            })
+        return rows
+
+    def run(self):
+        """
+        run creates the users and readings. 
+
+        Returns:
+            SimpleNamespace of users and readings created
+        """
+        db.create_all()
+        role = self.roles()
+        password = hash_password(self.password)
+        calendar = self.calendar()
+        ReadingsArchive.ensure_partitions(db.session.connection(), start=calendar[0].date)
+        db.session.commit()
+        taken = {username for (username,) in db.session.query(Users.username)}
+        now = self.now
+        result = SimpleNamespace(users=0, readings=0)
+        users, links, readings = [], [], []
+        serial = len(taken)
+
+        def flush():
+            if users:
+                db.session.execute(Users.__table__.insert(), users)
+                db.session.execute(roles_users.insert(), links)
+            if readings:
+                db.session.execute(Readings.__table__.insert(), readings)
+            db.session.commit()
+            result.users += len(users)
+            result.readings += len(readings)
+            users.clear()
+            links.clear()
+            readings.clear()
+
+        for _ in range(self.users):
+            while True:
+                serial += 1
+                username = f'{self.random.choice(self.FIRST_NAMES)}.{self.random.choice(self.LAST_NAMES)}{serial}'
+                if username not in taken:
+                    break
+            taken.add(username)
+            id = uuid.uuid1()
+            users.append({
+                'id': id,
+                'email': f'{username}@example.com',
+                'username': username,
+                'password': password,
+                'active': True,
+                'created': now - timedelta(days=self.days),
+                'confirmed_at': now,
+            })
+            links.append({'user_id': id, 'role_id': role.id})
+            readings.extend(self.readings(id, calendar))
+            if len(readings) >= self.batch_size:
+                flush()
+        flush()
+
+        Rollup.backfill()
+        FragmentCache.bump(db.session.connection(), {'users', 'readings'})
+        db.session.commit()
+        return result
\ No newline at end of file
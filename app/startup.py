@@ -0,0 +1,106 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import db
+from app.models import user_datastore
+from app.archive import ReadingsArchive
+from app.forms import get_roles
+from app.utilities import Utilities
+from config import Config
+from flask_security.utils import hash_password
+import time
+
+def bootstrap():
+    """
+    bootstrap will handle the creation of our tables, user roles and admin user setup. 
+    It runs once at startup (see prepare below, and health-tracker.py), or on its own with 
+    `flask bootstrap`, and is safe to run again: anything that already exists is left alone. 
+    Must be run inside an app context. 
+    It should go without saying that the admin user should immediately reset their 
+    password once registered. Just follow the reset password flow from the link on the login page. 
+    
+    *Should you lose the admin login credentials and you cannot recover from a password reset*
+    You will need to manually go into your datastore and identify the id of the admin user. 
+    Once you have that id, you will need to remove any associated readings and then also delete the 
+    roles_users entry where userid = user.id of your admin. 
+    Once readings and the roles_users entries have been removed, you can then delete the admin user 
+    from the datastore. 
+    Once deleted, run `flask bootstrap` (or restart the application) to restore the admin user to the 
+    initial state, using the password defined in the BOOTSTRAP_PASS env var. 
+    The admin user has no ownership over anything other than their own readings, so there is no danger in 
+    removing and re-adding this user, other than the fact that you will lose their readings, if they have any.
+    """
+    db.create_all()
+    ReadingsArchive.ensure_partitions(db.session.connection())
+    db.session.commit()
+    admin = user_datastore.find_role('admin')
+    if not admin:
+        user_datastore.create_role(name='admin', description='admin user role')
+        db.session.commit()
+        admin = user_datastore.find_role('admin')
+    employee = user_datastore.find_role('employee')
+    if not employee:
+        user_datastore.create_role(name='employee', description='employee user role')
+        db.session.commit()
+    admin_user = user_datastore.find_user(email=Config.BOOTSTRAP_EMAIL)
+    if not admin_user:
+        user_datastore.create_user(email=Config.BOOTSTRAP_EMAIL, username=Config.BOOTSTRAP_USERNAME, password=hash_password(Config.BOOTSTRAP_PASS))
+        db.session.commit()
+        admin_user = user_datastore.find_user(email=Config.BOOTSTRAP_EMAIL)
+        user_datastore.add_role_to_user(admin_user, admin)
+        db.session.commit()
+
+def warm_up(app):
+    """
+    warm_up does the work the first request after a deploy would otherwise pay for: running the 
+    before_first_request hooks, compiling every template, loading the role choices and the 
+    timezone. Must be run inside an app context. 
+    """
+    app.try_trigger_before_first_request_functions()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    get_roles()
+    Utilities.today()
+
+def prepare(app, bootstrap_datastore=True):
+    """
+    prepare gets an app from create_app ready to serve. 
+    Run it once in the process that will fork the workers (gunicorn --preload, see 
+    health-tracker.py) and every worker starts warm. The datastore connections it opened are 
+    closed again at the end so that no worker inherits a socket that another worker also holds. 
+
+    Args:
+        app - Flask app from create_app
+        bootstrap_datastore - run bootstrap() first (Config.BOOTSTRAP_ON_START)
+    Returns:
+        seconds taken
+    """
+    started = time.perf_counter()
+    with app.app_context():
+        if bootstrap_datastore:
+            bootstrap()
+        warm_up(app)
+        db.session.remove()
+        db.dispose(app)
+    elapsed = time.perf_counter() - started
+    app.logger.info(f'Startup: ready to serve in {elapsed:.2f}s')
+    return elapsed
\ No newline at end of file
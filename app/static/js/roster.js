@@ -0,0 +1,135 @@
+/*
+ * Live roster for the admin dashboard.
+ * Listens to /api/roster/events (see api_roster_events in app/routes.py) and patches the roster
+ * table in place as readings come in and users are activated or deactivated, so nobody has to
+ * keep reloading the page. The browser reconnects on its own, resuming after the last event it saw.
+ * If the server turns the stream away (every worker is busy with other dashboards) the browser
+ * gives up on it, and the page falls back to reloading itself every minute.
+ */
+(function () {
+    var script = document.getElementById('roster-events');
+    var table = document.getElementById('roster');
+    if (!script || !table || !window.EventSource) {
+        return;
+    }
+    var labels = table.dataset;
+    var body = table.tBodies[0];
+
+    function badge(kind, text) {
+        var span = document.createElement('span');
+        span.className = 'badge badge-' + kind;
+        span.textContent = text;
+        return span;
+    }
+
+    function cell(content) {
+        var td = document.createElement('td');
+        td.className = 'p-1';
+        if (typeof content === 'string') {
+            td.textContent = content;
+        } else {
+            td.appendChild(content);
+        }
+        return td;
+    }
+
+    function fill(row, reading) {
+        while (row.cells.length > 1) {
+            row.deleteCell(1);
+        }
+        if (reading) {
+            var symptoms = cell(reading.symptoms ? badge('danger', '+') : badge('success', '−'));
+            symptoms.style.textAlign = 'center';
+            row.appendChild(cell(reading.temp === null ? '-' : reading.temp.toFixed(1)));
+            row.appendChild(cell(reading.oximeter === null ? '-' : reading.oximeter.toFixed(1)));
+            row.appendChild(symptoms);
+            row.appendChild(cell(reading.status === 'working' ? badge('success', labels.working) : badge('danger', labels.notWorking)));
+        } else {
+            row.appendChild(cell('-'));
+            row.appendChild(cell('-'));
+            row.appendChild(cell('-'));
+            row.appendChild(cell(badge('warning', labels.noRecord)));
+        }
+        row.dataset.recorded = reading ? 'true' : 'false';
+    }
+
+    function find(userId) {
+        return body.querySelector('tr[data-user-id="' + userId + '"]');
+    }
+
+    function count() {
+        var missing = body.querySelectorAll('tr[data-recorded="false"]').length;
+        var counter = document.getElementById('roster-missing');
+        if (counter) {
+            counter.textContent = missing;
+            document.getElementById('roster-reminders').style.display = missing ? '' : 'none';
+        }
+    }
+
+    function highlight(row) {
+        row.classList.add('table-info');
+        setTimeout(function () { row.classList.remove('table-info'); }, 3000);
+    }
+
+    var source = new EventSource(script.dataset.events);
+
+    source.addEventListener('reading', function (e) {
+        var data = JSON.parse(e.data);
+        if (data.reading.reading_date !== labels.today) {
+            // a new day, start over with an empty roster
+            source.close();
+            location.reload();
+            return;
+        }
+        var row = find(data.user_id);
+        if (row) {
+            fill(row, data.reading);
+            highlight(row);
+            count();
+        }
+    });
+
+    source.addEventListener('activated', function (e) {
+        var data = JSON.parse(e.data);
+        if (find(data.user_id)) {
+            return;
+        }
+        var row = document.createElement('tr');
+        var url = labels.userUrl.replace('00000000-0000-0000-0000-000000000000', data.user_id);
+        row.dataset.userId = data.user_id;
+        row.dataset.username = data.username;
+        row.addEventListener('click', function () { location.assign(url); });
+        row.appendChild(cell(data.username));
+        fill(row, data.reading);
+        var rows = body.rows;
+        var before = null;
+        for (var i = 0; i < rows.length; i++) {
+            if (rows[i].dataset.username > data.username) {
+                before = rows[i];
+                break;
+            }
+        }
+        body.insertBefore(row, before);
+        highlight(row);
+        count();
+    });
+
+    source.addEventListener('deactivated', function (e) {
+        var row = find(JSON.parse(e.data).user_id);
+        if (row) {
+            row.parentNode.removeChild(row);
+            count();
+        }
+    });
+
+    source.onerror = function () {
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(function () { location.reload(); }, 60000);
+        }
+    };
+
+    source.addEventListener('reload', function () {
+        source.close();
+        location.reload();
+    });
+})();
@@ -21,12 +21,23 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 Please refer to LICENSE in the project repository for details.
 """
 from config import Config
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, time
+from collections import namedtuple
 from pytz import timezone
 import io
 import pytz
 import csv
-import re
+import json
+import base64
+import binascii
+import hashlib
+import uuid
+import zlib
+from decimal import Decimal
+from sqlalchemy import and_
+from sqlalchemy.dialects import postgresql
+
+Day = namedtuple('Day', ['date', 'start', 'end'])
 
 class Utilities:
     """
@@ -34,60 +45,277 @@ class Utilities:
     dependencies on the core application and do not logically fit in a particular 
     Model. 
     """
+    _timezone = None
+    _day = None
+
+    def timezone():
+        """
+        timezone returns the pytz zone named by the TIMEZONE config variable. 
+        The zone is looked up once per process and reused, since it can't change without a restart. 
+        If no timezone is set this app will crash. 
+        """
+        if Utilities._timezone is None:
+            Utilities._timezone = pytz.timezone(Config.TIMEZONE)
+        return Utilities._timezone
+
+    def day_of(moment):
+        """
+        day_of works out which local day a UTC timestamp falls on, along with the UTC bounds of that day. 
+
+        Args:
+            moment - naive UTC datetime, like the value stored in Readings.created
+        Returns:
+            Day tuple, see Utilities.local_day()
+        """
+        tz = Utilities.timezone()
+        return Utilities.local_day(pytz.utc.localize(moment).astimezone(tz).date())
+
+    def local_day(local_date):
+        """
+        local_day returns the UTC bounds of a local date. 
+        The bounds are found by localizing local midnight at each end of the day, so a 23 hour 
+        "spring ahead" day and a 25 hour "fall back" day come out the right length. 
+
+        Args:
+            local_date - datetime.date in the configured timezone
+        Returns:
+            Day tuple of (date, start, end) where date is the YYYY-mm-dd string and start/end are 
+            naive UTC datetimes bounding the day as [start, end). 
+        """
+        tz = Utilities.timezone()
+        bounds = []
+        for d in (local_date, local_date + timedelta(days=1)):
+            midnight = tz.localize(datetime.combine(d, time.min))
+            bounds.append(midnight.astimezone(pytz.utc).replace(tzinfo=None))
+        return Day(local_date.strftime("%Y-%m-%d"), bounds[0], bounds[1])
+
+    def today():
+        """
+        today returns the Day (see day_of) we're currently in. 
+        The result is cached for the whole process and only recalculated once the clock 
+        passes the end of the cached day, so the request path is just a comparison against utcnow(). 
+        Queries that ask "did this happen today?" should filter Readings.created on 
+        [start, end) rather than comparing reading_date strings, that's what the 
+        (user_id, created) index on readings is for. 
+        """
+        now = datetime.utcnow()
+        day = Utilities._day
+        if day is None or not day.start <= now < day.end:
+            day = Utilities._day = Utilities.day_of(now)
+        return day
+
     def get_date():
         """
-        get_date returns a YYYY-mm-dd string that is localized to the 
+        get_date returns a YYYY-mm-dd string for today, localized to the 
         timezone set in the app's config variables. 
-        If no timezone is set this app will crash. 
-        **As of right now there are no considerations for daylight savings time. 
-        This app might give incorrect readings during a timechange, specifically in March and 
-        October, but even more so when we "fall back". 
-        """
-        tz = timezone(Config.TIMEZONE)
-        local_date = datetime.now()
-        localized_date = tz.localize(local_date)
-        str_date = localized_date.strftime("%Y-%m-%d")
-        return str_date
+        This is the date half of Utilities.today(), kept for filenames and templates 
+        that only want the string. 
+        """
+        return Utilities.today().date
     
-    def stream_generate_readings(header, contents):
+    def encode_cursor(created, id, direction='next'):
+        """
+        encode_cursor builds the opaque page token used by keyset (cursor) pagination. 
+        The token is just the (created, id) sort key of the row to page from plus a direction, 
+        serialized and base64'd so that templates and API clients treat it as a black box. 
+
+        Args:
+            created - datetime of the boundary row
+            id - id of the boundary row
+            direction - 'next' for older rows, 'prev' for newer rows
+        Returns:
+            url-safe str token
+        """
+        payload = json.dumps([created.isoformat(), str(id), direction])
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(token):
+        """
+        decode_cursor reverses encode_cursor. 
+        Garbage in (hand-edited urls, stale bookmarks from another format) is treated as no 
+        cursor at all, which lands the user back on the first page rather than on an error. 
+
+        Args:
+            token - str token from encode_cursor, or None
+        Returns:
+            (created, id, direction) tuple, or None
+        """
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            created, id, direction = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            created = datetime.fromisoformat(created)
+            id = uuid.UUID(id)
+        except (ValueError, TypeError, binascii.Error, UnicodeError):
+            return None
+        if direction not in ('next', 'prev'):
+            return None
+        return created, id, direction
+
+    def decode_watermark(value):
+        """
+        decode_watermark reads the ?since= of an incremental export, which is either the 
+        X-Next-Watermark token from the previous export or an ISO 8601 timestamp 
+        (UTC unless it carries an offset, e.g. 2020-12-01 or 2020-12-01T06:00:00Z). 
+
+        Args:
+            value - str from the query string
+        Returns:
+            (created, id) tuple, id is None for a timestamp
+        Raises:
+            ValueError when value is neither
+        """
+        cursor = Utilities.decode_cursor(value)
+        if cursor:
+            return cursor[0], cursor[1]
+        try:
+            moment = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+        except ValueError:
+            raise ValueError('since must be an ISO 8601 timestamp or the X-Next-Watermark of an earlier export')
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(pytz.utc).replace(tzinfo=None)
+        return moment, None
+
+    def upsert(connection, table, values, changes):
+        """
+        upsert inserts values into table, or applies changes to the existing row if the primary key 
+        is already there. 
+        Postgres does this in one statement with ON CONFLICT DO UPDATE, so two writers racing on the 
+        same new key can't both try to insert. Elsewhere (SQLite, which only has one writer 
+        at a time anyway) we try the update first and insert if it didn't match anything. 
+
+        Args:
+            connection - connection of the transaction in progress
+            table - Table to write to
+            values - dict of column values for a new row, including the primary key
+            changes - dict of column values (or expressions) to set on an existing row
+        """
+        key = list(table.primary_key.columns)
+        if connection.dialect.name == 'postgresql':
+            statement = postgresql.insert(table).values(**values)
+            connection.execute(statement.on_conflict_do_update(index_elements=key, set_=changes))
+            return
+        match = and_(*[column == values[column.name] for column in key])
+        if connection.execute(table.update().where(match).values(**changes)).rowcount == 0:
+            connection.execute(table.insert().values(**values))
+
+    def etag(*parts):
+        """
+        etag builds a strong entity tag out of whatever identifies the state of a response, typically 
+        the newest (created, id) of the rows behind it plus the query args that shaped it. 
+        The parts are hashed, so it doesn't matter what they are as long as they serialize the same way 
+        every time for the same state. 
+
+        Args:
+            parts - json serializable values (datetimes are turned into strings)
+        Returns:
+            str hex digest, unquoted
+        """
+        payload = json.dumps(parts, default=str, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def not_modified(request, etag, last_modified=None):
+        """
+        not_modified checks a request's conditional headers against the response we'd send, so a view 
+        can bail out with a 304 before doing any of the work of building the body. 
+        If-None-Match wins when it's present, If-Modified-Since is only consulted without it (RFC 7232). 
+
+        Args:
+            request - the flask request
+            etag - str from Utilities.etag()
+            last_modified - naive UTC datetime, or None if unknown
+        Returns:
+            bool - True when the client's copy is current
+        """
+        if request.if_none_match:
+            return request.if_none_match.contains(etag)
+        if last_modified and request.if_modified_since:
+            return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+        return False
+
+    def validated(response, etag, last_modified=None):
+        """
+        validated sets ETag, Last-Modified and Cache-Control on a response (a full one or a 304). 
+        no-cache lets clients keep a copy but makes them revalidate on every poll, which with 
+        not_modified() costs us one indexed query. 
         """
-        This func will return a csv stream of all readings, intended to be streamed to the browser 
-        for downloading a csv. 
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified.replace(tzinfo=pytz.utc)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    def stream_generate_readings(header, rows, format='csv'):
+        """
+        This func will return a csv (or NDJSON) stream of all readings, intended to be streamed 
+        to the browser for downloading. 
         
         Args:
             header - list of col headings to capture, in order. 
-            contents - query object to use as datasource
+            rows - iterable of tuples with values in header order, typically ReadingsExport.rows()
+            format - 'csv', or 'ndjson' for one JSON object per line keyed by the header
 
         Returns:
-            StringIO stream 
+            generator of str chunks
 
-        This was intended to be generic, allowing for input of any row headers, able to transpose items 
-        like 'user_id.id' into the second level relationship structure of the query set and pull values 
-        from those dicts. We got as far as identifying and splitting the header keys but could not traverse 
-        into the second level obj as the obj was somehow lost. 
-        `item.__dict__[match.group('base')]` is how we were accessing the members of the Readings obj programmatically, 
-        but the result of that is a string, not a Users obj as expected when looking for Readings.user_id - relationship as 
-        defined should make that a Users obj. 
-        This might be eligible for a re-write, but it does the job needed for now. 
+        This is only the writer; figuring out which columns to select (including dotted 
+        relationship columns like 'users.username') is handled by app.exports.ReadingsExport, 
+        which hands us plain tuples so nothing here touches the ORM. 
+        Rows are buffered up to Config.EXPORT_BUFFER_SIZE characters before being yielded, so the 
+        socket sees a steady stream of reasonably sized writes instead of one tiny write per row. 
         """
         data = io.StringIO()
-        w = csv.writer(data)
-
-        w.writerow(header)
-        yield data.getvalue()
-        data.seek(0)
-        data.truncate(0)
-        pattern = re.compile('^username$')
-
-        for item in contents:
-            row = []
-            for i in header:
-                match = pattern.match(i)
-                if match:
-                    row.append(item.get_username())
-                else:
-                    row.append(item.__dict__[i])
-            w.writerow(row)
+        if format == 'ndjson':
+            def write(row):
+                data.write(json.dumps(dict(zip(header, map(Utilities.json_value, row)))))
+                data.write('\n')
+        else:
+            write = csv.writer(data).writerow
+            write(header)
             yield data.getvalue()
             data.seek(0)
-            data.truncate(0)
\ No newline at end of file
+            data.truncate(0)
+
+        for row in rows:
+            write(row)
+            if data.tell() >= Config.EXPORT_BUFFER_SIZE:
+                yield data.getvalue()
+                data.seek(0)
+                data.truncate(0)
+        if data.tell():
+            yield data.getvalue()
+
+    def json_value(value):
+        """
+        json_value converts an export value to what Readings.as_dict would have used for it: 
+        UTC timestamps in ISO 8601, numbers rather than Decimals and ids as strings. 
+        """
+        if isinstance(value, datetime):
+            return value.isoformat() + 'Z'
+        if isinstance(value, Decimal):
+            return float(value)
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return value
+
+    def gzip_stream(chunks, level=None):
+        """
+        gzip_stream compresses a stream of str chunks into gzip as it goes, so a compressed 
+        export starts flowing straight away and never has to be held in memory as a whole. 
+        zlib only emits a block once it has collected enough input, so some chunks yield nothing. 
+
+        Args:
+            chunks - iterable of str, e.g. from stream_generate_readings
+            level - compression level 1-9, defaults to Config.EXPORT_GZIP_LEVEL
+        Returns:
+            generator of bytes making up one gzip member
+        """
+        # wbits 16 + 15 asks zlib for the gzip header and trailer rather than a raw zlib stream
+        compressor = zlib.compressobj(level or Config.EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk.encode('utf-8'))
+            if compressed:
+                yield compressed
+        yield compressor.flush()
\ No newline at end of file
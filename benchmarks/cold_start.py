@@ -0,0 +1,111 @@
+"""
+Cold start: how long a fresh process takes to be ready, and what the first requests cost.
+
+Each run starts a new python process which imports the app, builds it with create_app and then
+either prepares it the way health-tracker.py does under gunicorn --preload (--mode warm), or
+only bootstraps the datastore and leaves everything else to the first request (--mode cold,
+which is how the app used to start). It then times the login page and an admin's /home, twice
+each, through the flask test client. Reported as JSON, medians over --runs processes:
+
+    python benchmarks/cold_start.py --runs 5
+
+With --max-first-request-ms it exits non-zero when the first /home request of a warm process
+takes longer than that, for use as a check in CI.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+def child(mode):
+    """
+    Runs in the measured process, prints one JSON sample.
+    """
+    started = time.perf_counter()
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    from app import create_app, db
+    from app.startup import bootstrap, prepare
+    from config import Config
+    imported = time.perf_counter()
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    created = time.perf_counter()
+    if mode == 'warm':
+        prepare(app)
+    else:
+        with app.app_context():
+            bootstrap()
+            db.session.remove()
+    ready = time.perf_counter()
+
+    def timed(client, path):
+        began = time.perf_counter()
+        response = client.get(path)
+        response.get_data()
+        assert response.status_code == 200, f'{path} returned {response.status_code}'
+        return time.perf_counter() - began
+
+    client = app.test_client()
+    login = [timed(client, '/login'), timed(client, '/login')]
+    client.post('/login', data={'email': Config.BOOTSTRAP_EMAIL, 'password': Config.BOOTSTRAP_PASS})
+    home = [timed(client, '/home'), timed(client, '/home')]
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'startup_ms': (ready - created) * 1000,
+        'first_login_ms': login[0] * 1000,
+        'second_login_ms': login[1] * 1000,
+        'first_home_ms': home[0] * 1000,
+        'second_home_ms': home[1] * 1000,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='processes started per mode')
+    parser.add_argument('--mode', choices=('cold', 'warm', 'both'), default='both')
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--max-first-request-ms', type=float, default=None)
+    parser.add_argument('--child', choices=('cold', 'warm'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'health-tracker-cold-start.db')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('TIMEZONE', 'UTC')
+    os.environ.setdefault('BOOTSTRAP_EMAIL', 'bench-admin@example.com')
+    os.environ.setdefault('BOOTSTRAP_USERNAME', 'bench-admin')
+    os.environ.setdefault('BOOTSTRAP_PASS', 'bench-admin-password')
+    os.environ.setdefault('SECURITY_PASSWORD_SALT', 'bench-salt')
+    if args.child:
+        child(args.child)
+        return
+
+    modes = ('cold', 'warm') if args.mode == 'both' else (args.mode,)
+    results = {}
+    for mode in modes:
+        samples = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, __file__, '--child', mode], check=True,
+                stdout=subprocess.PIPE, universal_newlines=True, env=os.environ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        results[mode] = {key: round(statistics.median(sample[key] for sample in samples), 1) for key in samples[0]}
+
+    print(json.dumps({
+        'meta': {
+            'database': database_url.split(':')[0],
+            'runs': args.runs,
+            'python': platform.python_version(),
+        },
+        'modes': results,
+    }, indent=2))
+    if args.max_first_request_ms and 'warm' in results and results['warm']['first_home_ms'] > args.max_first_request_ms:
+        print(f"first request took {results['warm']['first_home_ms']}ms, more than {args.max_first_request_ms}ms", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
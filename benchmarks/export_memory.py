@@ -0,0 +1,118 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+"""
+Peak memory of a full readings export. 
+
+Seeds a throwaway sqlite datastore with synthetic readings (1M by default), then runs the 
+same export pipeline used by /api/readings and reports peak RSS as JSON. 
+Run it from the project root: 
+
+    python benchmarks/export_memory.py --rows 1000000
+
+Pass --database-url to point at a scratch PostgreSQL database instead. 
+--mode eager loads every row up front, the way the export used to, for comparison. 
+Peak RSS only ever goes up, so run each mode in its own process. 
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--mode', choices=('stream', 'eager'), default='stream')
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'health-tracker-export-bench.db')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('TIMEZONE', 'UTC')
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+    from app import create_app, db
+    from app.models import Users, Readings
+    from app.exports import ReadingsExport
+    from app.utilities import Utilities
+
+    app = create_app()
+    header = ('id', 'created', 'temp', 'oximeter', 'symptoms', 'reading_date', 'status', 'username')
+    with app.app_context():
+        db.create_all()
+        existing = Readings.query.count()
+        if existing < args.rows:
+            # one reading per user per day, a year of history per synthetic user
+            start = datetime.utcnow() - timedelta(days=365)
+            batch = []
+            for i in range(existing, args.rows):
+                if i == existing or i % 365 == 0:
+                    user_id = str(uuid.uuid1())
+                    db.session.execute(Users.__table__.insert(), [{'id': user_id, 'username': f'bench-{user_id}', 'active': True}])
+                created = start + timedelta(days=i % 365)
+                batch.append({
+                    'id': str(uuid.uuid1()), 'created': created, 'reading_date': created.strftime('%Y-%m-%d'),
+                    'temp': '98.6', 'oximeter': '97', 'status': 'working', 'symptoms': False, 'user_id': user_id,
+                })
+                if len(batch) == 10000:
+                    db.session.execute(Readings.__table__.insert(), batch)
+                    batch = []
+            if batch:
+                db.session.execute(Readings.__table__.insert(), batch)
+            db.session.commit()
+        db.session.remove()
+
+    with app.test_request_context():
+        baseline = peak_rss_mb()
+        started = time.perf_counter()
+        if args.mode == 'eager':
+            rows = ReadingsExport(header).query().all()
+        else:
+            rows = ReadingsExport(header).rows()
+        count = 0
+        written = 0
+        for chunk in Utilities.stream_generate_readings(header, rows):
+            written += len(chunk)
+            count += chunk.count('\n')
+        elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'mode': args.mode,
+        'database': database_url.split(':')[0],
+        'rows': count - 1,
+        'bytes': written,
+        'seconds': round(elapsed, 2),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+if __name__ == '__main__':
+    main()
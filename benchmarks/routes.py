@@ -0,0 +1,190 @@
+"""
+Latency, query counts and memory of the hot routes. 
+
+Seeds a scratch datastore with synthetic users and readings (see `flask seed`) if it doesn't 
+already hold that many users, then drives home, readings, new_reading, api_readings and 
+single_user through the flask test client and reports per-route latency percentiles, SQL 
+statements per request and peak RSS as JSON. 
+Run it from the project root: 
+
+    python benchmarks/routes.py --users 10000 --days 365 --output before.json
+
+The seeded sqlite file is kept between runs (seeding 10k x 365 takes a while), delete it or pass 
+--database-url to start over. Point --database-url at a scratch PostgreSQL database to benchmark 
+that instead. 
+To catch regressions, compare against an earlier run: 
+
+    python benchmarks/routes.py --users 10000 --compare before.json
+
+which exits non-zero when any route's p95 latency grows by more than --tolerance (25% by default) 
+or it runs more queries per request than before. 
+The fragment cache is left on, since that's how the app runs; --no-cache measures the uncached 
+paths instead. 
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def summarize(samples, queries, statuses):
+    import numpy as np
+    ms = np.array(samples) * 1000
+    return {
+        'requests': len(samples),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2),
+        'p90_ms': round(float(np.percentile(ms, 90)), 2),
+        'p95_ms': round(float(np.percentile(ms, 95)), 2),
+        'p99_ms': round(float(np.percentile(ms, 99)), 2),
+        'max_ms': round(float(ms.max()), 2),
+        'mean_ms': round(float(ms.mean()), 2),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+        'statuses': sorted(set(statuses)),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    List the routes which got slower (p95) by more than tolerance, or run more queries, than baseline. 
+    """
+    regressions = []
+    for name, current in results['routes'].items():
+        before = baseline.get('routes', {}).get(name)
+        if not before:
+            continue
+        if current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['queries_max'] > before['queries_max']:
+            regressions.append(f"{name}: queries {before['queries_max']} -> {current['queries_max']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--iterations', type=int, default=50, help='requests per route')
+    parser.add_argument('--export-iterations', type=int, default=3, help='requests for the full csv export')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--no-cache', action='store_true', help='turn the fragment cache off')
+    parser.add_argument('--output', default=None, help='write the JSON here as well as to stdout')
+    parser.add_argument('--compare', default=None, help='JSON from an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'health-tracker-routes-bench.db')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('TIMEZONE', 'UTC')
+    os.environ.setdefault('BOOTSTRAP_EMAIL', 'bench-admin@example.com')
+    os.environ.setdefault('BOOTSTRAP_USERNAME', 'bench-admin')
+    os.environ.setdefault('BOOTSTRAP_PASS', 'bench-admin-password')
+    os.environ.setdefault('SECURITY_PASSWORD_SALT', 'bench-salt')
+    if args.no_cache:
+        os.environ['CACHE_ENABLED'] = 'false'
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+    from app import create_app, db
+    from app.models import Users, Readings
+    from app.roster import Roster
+    from app.seed import Seeder
+    from app.startup import prepare
+    from app.utilities import Utilities
+    from config import Config
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['MAIL_SUPPRESS_SEND'] = True
+    prepare(app)
+
+    with app.app_context():
+        existing = Users.query.count()
+        if existing < args.users:
+            started = time.perf_counter()
+            seeded = Seeder(args.users - existing, args.days, seed=args.seed).run()
+            print(f'seeded {seeded.users} users and {seeded.readings} readings in {time.perf_counter() - started:.0f}s', file=sys.stderr)
+        users = Users.query.count()
+        readings = Readings.query.count()
+        employees = [user.id for user in Users.query.filter(Users.username != Config.BOOTSTRAP_USERNAME).order_by(Users.username).limit(args.iterations).all()]
+        missing = [user.email for user in Roster.missing(Utilities.today())
+            if user.username != Config.BOOTSTRAP_USERNAME][:args.iterations]
+        db.session.remove()
+
+    queries = []
+    event.listen(Engine, 'before_cursor_execute', lambda *_: queries.append(1))
+
+    admin = app.test_client()
+    admin.get('/')
+    admin.post('/login', data={'email': Config.BOOTSTRAP_EMAIL, 'password': Config.BOOTSTRAP_PASS})
+    deep = admin.get('/api/readings.json?limit=50')
+    for _ in range(20):
+        next_url = deep.get_json().get('next')
+        if not next_url:
+            break
+        deep = admin.get(next_url)
+    deep_cursor = next_url.split('cursor=')[1].split('&')[0] if next_url else ''
+
+    def timed(client, method, path, **kwargs):
+        queries.clear()
+        started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        return time.perf_counter() - started, len(queries), response.status_code
+
+    routes = {
+        'home': lambda i: timed(admin, 'GET', '/home'),
+        'readings': lambda i: timed(admin, 'GET', '/readings'),
+        'readings_deep': lambda i: timed(admin, 'GET', f'/readings?cursor={deep_cursor}'),
+        'single_user': lambda i: timed(admin, 'GET', f'/users/{employees[i % len(employees)]}'),
+    }
+    results = {}
+    for name, run in routes.items():
+        samples = [run(i) for i in range(args.iterations)]
+        results[name] = summarize(*zip(*samples))
+
+    samples = [timed(admin, 'GET', '/api/readings') for _ in range(args.export_iterations)]
+    results['api_readings'] = summarize(*zip(*samples))
+
+    # every new reading needs an employee who hasn't recorded one today; logging them in is not timed
+    samples = []
+    for email in missing:
+        client = app.test_client()
+        client.post('/login', data={'email': email, 'password': 'password'})
+        samples.append(timed(client, 'POST', '/readings/new', data={'temp': '98.4', 'oximeter': '98', 'working_btn': "I'm Working"}))
+    if samples:
+        results['new_reading'] = summarize(*zip(*samples))
+
+    output = {
+        'meta': {
+            'database': database_url.split(':')[0],
+            'users': users,
+            'readings': readings,
+            'iterations': args.iterations,
+            'cache': not args.no_cache,
+            'python': platform.python_version(),
+        },
+        'routes': results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            output['regressions'] = compare(output, json.load(f), args.tolerance)
+    text = json.dumps(output, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if output.get('regressions'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
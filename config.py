@@ -42,6 +42,17 @@ class Config(object):
     APP_BASE_URL = os.environ.get('APP_BASE_URL')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_REPLICA_URLS = [url.strip() for url in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = {f'replica_{n}': url for n, url in enumerate(DATABASE_REPLICA_URLS)}
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS') or 10)
+    # connections are pooled per worker process, so the datastore sees up to 
+    # workers * (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW) per database. sqlite isn't pooled. 
+    SQLALCHEMY_ENGINE_OPTIONS = {} if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE') or 5),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW') or 5),
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE') or 1800),
+        'pool_pre_ping': True,
+    }
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'who wants to know'
     TIMEZONE = os.environ.get('TIMEZONE')
     BOOTSTRAP_EMAIL = os.environ.get('BOOTSTRAP_EMAIL')
@@ -66,4 +77,39 @@ class Config(object):
     EMAIL_PLAINTEXT = True
     EMAIL_HTML = False
     TEMP_UNITS_ENCODING = os.environ.get('TEMP_UNITS_ENCODING') or '&#8457;'
-    POSTS_PER_PAGE = 1
\ No newline at end of file
+    FEVER_THRESHOLD = float(os.environ.get('FEVER_THRESHOLD') or (38.0 if TEMP_UNITS_ENCODING == '&#8451;' else 100.4))
+    LOW_OXIMETER_THRESHOLD = float(os.environ.get('LOW_OXIMETER_THRESHOLD') or 95)
+    POSTS_PER_PAGE = int(os.environ.get('POSTS_PER_PAGE') or 25)
+    HISTORY_PER_PAGE = int(os.environ.get('HISTORY_PER_PAGE') or 21)
+    HOME_RECENT_READINGS = int(os.environ.get('HOME_RECENT_READINGS') or 9)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 5000)
+    EXPORT_BUFFER_SIZE = int(os.environ.get('EXPORT_BUFFER_SIZE') or 65536)
+    EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL') or 6)
+    EXPORT_WATERMARK_LAG = int(os.environ.get('EXPORT_WATERMARK_LAG') or 60)
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 500)
+    KIOSK_MAX_BATCH = int(os.environ.get('KIOSK_MAX_BATCH') or 500)
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE') or 100)
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL') or 5)
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or 6)
+    OUTBOX_RETRY_BASE = int(os.environ.get('OUTBOX_RETRY_BASE') or 30)
+    OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS') or 600)
+    EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL') or 1)
+    EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT') or 15)
+    EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE') or 100)
+    # open dashboards per worker process; under gthread each one holds a thread (see the Dockerfile) 
+    EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS') or 8)
+    EVENTS_RETENTION_HOURS = int(os.environ.get('EVENTS_RETENTION_HOURS') or 24)
+    IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS') or os.cpu_count() or 1)
+    ANALYTICS_DAYS = int(os.environ.get('ANALYTICS_DAYS') or 30)
+    ANALYTICS_MAX_DAYS = int(os.environ.get('ANALYTICS_MAX_DAYS') or 366)
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE') or 1000)
+    CACHE_ENABLED = (os.environ.get('CACHE_ENABLED') or 'true').lower() == 'true'
+    CACHE_URL = os.environ.get('CACHE_URL')
+    CACHE_TTL = int(os.environ.get('CACHE_TTL') or 300)
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES') or 512)
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS') or 0)
+    QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET') or 0)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    BOOTSTRAP_ON_START = (os.environ.get('BOOTSTRAP_ON_START') or 'true').lower() == 'true'
+    READINGS_RETENTION_MONTHS = int(os.environ.get('READINGS_RETENTION_MONTHS') or 24)
+    READINGS_PARTITIONS_AHEAD = int(os.environ.get('READINGS_PARTITIONS_AHEAD') or 3)
\ No newline at end of file
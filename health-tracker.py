@@ -20,4 +20,26 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 Please refer to LICENSE in the project repository for details.
 """
-from app import app
\ No newline at end of file
+from app import create_app
+from app.startup import prepare
+from config import Config
+import os
+try:
+    from gevent import monkey
+    from psycogreen.gevent import patch_psycopg
+except ImportError:
+    monkey = None
+
+# under gunicorn's gevent workers (see Live Dashboard in the README) psycopg2 has to hand 
+# control back to the other greenlets while it waits on the datastore 
+if monkey is not None and monkey.is_module_patched('socket'):
+    patch_psycopg()
+
+app = create_app()
+
+# gunicorn imports this module once, in the master process, when started with --preload (see the 
+# Dockerfile), so every worker forks with the datastore bootstrapped and the caches warm. 
+# The flask cli imports it too, and there `flask db upgrade` has to be able to run before 
+# anything creates tables, so startup is left to `flask bootstrap`. 
+if os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+    prepare(app, bootstrap_datastore=Config.BOOTSTRAP_ON_START)
\ No newline at end of file
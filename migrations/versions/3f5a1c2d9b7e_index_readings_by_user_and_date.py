@@ -0,0 +1,24 @@
+"""index readings by user and date
+
+Revision ID: 3f5a1c2d9b7e
+Revises: 
+Create Date: 2020-11-02 09:14:27.551203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f5a1c2d9b7e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_readings_user_id_reading_date', 'readings', ['user_id', 'reading_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_readings_user_id_reading_date', table_name='readings')
@@ -0,0 +1,43 @@
+"""unique reading per user per day
+
+Revision ID: 8c2e4b6a1d0f
+Revises: 3f5a1c2d9b7e
+Create Date: 2020-11-04 10:02:51.337410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2e4b6a1d0f'
+down_revision = '3f5a1c2d9b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Readings recorded by racing submits may already have produced more than one row 
+    for a user on the same day. We won't guess which of those to keep (there are no 
+    delete functions in this app for a reason), so stop and let a human sort it out. 
+    """
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+        'SELECT count(*) FROM (SELECT user_id, reading_date FROM readings '
+        'GROUP BY user_id, reading_date HAVING count(*) > 1) AS duplicates'
+    )).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f'{duplicates} user/day pairs have more than one reading. '
+            'Resolve them before applying the unique (user_id, reading_date) constraint.'
+        )
+    with op.batch_alter_table('readings') as batch_op:
+        batch_op.drop_index('ix_readings_user_id_reading_date')
+        batch_op.create_unique_constraint('uq_readings_user_id_reading_date', ['user_id', 'reading_date'])
+
+
+def downgrade():
+    with op.batch_alter_table('readings') as batch_op:
+        batch_op.drop_constraint('uq_readings_user_id_reading_date', type_='unique')
+        batch_op.create_index('ix_readings_user_id_reading_date', ['user_id', 'reading_date'], unique=False)
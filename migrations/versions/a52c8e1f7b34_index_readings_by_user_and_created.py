@@ -0,0 +1,24 @@
+"""index readings by user and created
+
+Revision ID: a52c8e1f7b34
+Revises: d94f27a6e8b1
+Create Date: 2020-11-20 10:02:41.318764
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a52c8e1f7b34'
+down_revision = 'd94f27a6e8b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_readings_user_id_created', 'readings', ['user_id', 'created'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_readings_user_id_created', table_name='readings')
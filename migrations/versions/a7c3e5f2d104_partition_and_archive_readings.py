@@ -0,0 +1,156 @@
+"""partition and archive readings
+
+Revision ID: a7c3e5f2d104
+Revises: f3a9c71b5e08
+Create Date: 2020-12-07 14:05:12.913520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5f2d104'
+down_revision = 'f3a9c71b5e08'
+branch_labels = None
+depends_on = None
+
+# months of partitions created past the current one, matching READINGS_PARTITIONS_AHEAD
+AHEAD = 3
+
+COLUMNS = 'id, created, reading_date, temp, oximeter, status, user_id, symptoms'
+
+
+def columns(id_type):
+    return [
+        sa.Column('id', id_type, nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('reading_date', sa.String(), nullable=False),
+        sa.Column('temp', sa.Numeric(precision=4, scale=1), nullable=True),
+        sa.Column('oximeter', sa.Numeric(precision=4, scale=1), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('user_id', id_type, nullable=True),
+        sa.Column('symptoms', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+    ]
+
+
+def create_archive(id_type, **kwargs):
+    op.create_table('readings_archive',
+        *columns(id_type),
+        sa.PrimaryKeyConstraint('id', 'reading_date', name='readings_archive_pkey'),
+        **kwargs
+    )
+    op.create_index('ix_readings_archive_created', 'readings_archive', ['created'], unique=False)
+    op.create_index('ix_readings_archive_user_id_created', 'readings_archive', ['user_id', 'created'], unique=False)
+
+
+def shift(month, months):
+    index = int(month[:4]) * 12 + int(month[5:7]) - 1 + months
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def rename_keys(conn, table, suffix):
+    """
+    Give a table's constraints and indexes a suffix, freeing their names for a replacement table.
+    Renaming a primary key or unique constraint renames its index along with it.
+    """
+    for (name,) in conn.execute(sa.text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype IN ('p', 'u', 'f')"), table=table):
+        conn.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {name} TO {name}{suffix}')
+    for (name,) in conn.execute(sa.text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), table=table):
+        if not name.endswith(suffix):
+            conn.execute(f'ALTER INDEX {name} RENAME TO {name}{suffix}')
+
+
+def upgrade_postgresql(conn):
+    """
+    A plain table can't be turned into a partitioned one in place, so readings is rebuilt:
+    the old table is renamed out of the way, the partitioned readings is created with a
+    partition per month from the oldest reading to AHEAD months from now (plus a default
+    partition), and the rows are copied over a month at a time.
+    Writes to readings fail while this runs, so run it with the app stopped; it takes about as
+    long as copying the table. readings_archive starts out empty, see `flask readings archive`.
+    """
+    if conn.execute('SELECT count(*) FROM readings WHERE reading_date IS NULL').scalar():
+        raise RuntimeError('Readings without a reading_date cannot be partitioned. '
+            'Set their reading_date (the local day of created) before applying this migration.')
+    conn.execute('LOCK TABLE readings IN ACCESS EXCLUSIVE MODE')
+    conn.execute('ALTER TABLE readings RENAME TO readings_unpartitioned')
+    rename_keys(conn, 'readings_unpartitioned', '_unpartitioned')
+
+    op.create_table('readings',
+        *columns(postgresql.UUID()),
+        sa.PrimaryKeyConstraint('id', 'reading_date', name='readings_pkey'),
+        sa.UniqueConstraint('user_id', 'reading_date', name='uq_readings_user_id_reading_date'),
+        postgresql_partition_by='RANGE (reading_date)'
+    )
+    op.create_index('ix_readings_created', 'readings', ['created'], unique=False)
+    op.create_index('ix_readings_temp', 'readings', ['temp'], unique=False)
+    op.create_index('ix_readings_oximeter', 'readings', ['oximeter'], unique=False)
+    op.create_index('ix_readings_user_id_created', 'readings', ['user_id', 'created'], unique=False)
+    conn.execute('CREATE TABLE readings_default PARTITION OF readings DEFAULT')
+
+    current = datetime.utcnow().strftime('%Y-%m')
+    oldest = conn.execute('SELECT min(reading_date) FROM readings_unpartitioned').scalar()
+    month = (oldest or current)[:7]
+    while month <= shift(current, AHEAD):
+        following = shift(month, 1)
+        conn.execute(
+            f"CREATE TABLE readings_{month.replace('-', '_')} PARTITION OF readings "
+            f"FOR VALUES FROM ('{month}-01') TO ('{following}-01')")
+        conn.execute(sa.text(
+            f'INSERT INTO readings ({COLUMNS}) SELECT {COLUMNS} FROM readings_unpartitioned '
+            f'WHERE reading_date >= :start AND reading_date < :end'), start=f'{month}-01', end=f'{following}-01')
+        month = following
+    conn.execute(f'INSERT INTO readings ({COLUMNS}) SELECT {COLUMNS} FROM readings_unpartitioned '
+        f"WHERE reading_date >= '{month}-01'")
+    op.drop_table('readings_unpartitioned')
+
+    create_archive(postgresql.UUID(), postgresql_partition_by='RANGE (reading_date)')
+
+
+def downgrade_postgresql(conn):
+    """
+    Back to a single plain readings table holding the archived readings as well.
+    """
+    conn.execute('LOCK TABLE readings, readings_archive IN ACCESS EXCLUSIVE MODE')
+    conn.execute('ALTER TABLE readings RENAME TO readings_partitioned')
+    rename_keys(conn, 'readings_partitioned', '_partitioned')
+    op.create_table('readings',
+        *columns(postgresql.UUID()),
+        sa.PrimaryKeyConstraint('id', name='readings_pkey'),
+        sa.UniqueConstraint('user_id', 'reading_date', name='uq_readings_user_id_reading_date'),
+    )
+    conn.execute(f'INSERT INTO readings ({COLUMNS}) SELECT {COLUMNS} FROM readings_partitioned '
+        f'UNION ALL SELECT {COLUMNS} FROM readings_archive')
+    op.alter_column('readings', 'reading_date', nullable=True)
+    op.create_index('ix_readings_created', 'readings', ['created'], unique=False)
+    op.create_index('ix_readings_temp', 'readings', ['temp'], unique=False)
+    op.create_index('ix_readings_oximeter', 'readings', ['oximeter'], unique=False)
+    op.create_index('ix_readings_user_id_created', 'readings', ['user_id', 'created'], unique=False)
+    # dropping a partitioned table drops its partitions
+    op.drop_table('readings_partitioned')
+    op.drop_table('readings_archive')
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        upgrade_postgresql(conn)
+    else:
+        # no partitioning, readings stays as it is and archived months are copied across
+        create_archive(sa.CHAR(32))
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        downgrade_postgresql(conn)
+    else:
+        conn.execute(f'INSERT INTO readings ({COLUMNS}) SELECT {COLUMNS} FROM readings_archive')
+        op.drop_index('ix_readings_archive_user_id_created', table_name='readings_archive')
+        op.drop_index('ix_readings_archive_created', table_name='readings_archive')
+        op.drop_table('readings_archive')
@@ -0,0 +1,97 @@
+"""store readings as numeric
+
+Revision ID: b71d0e93c5a4
+Revises: 8c2e4b6a1d0f
+Create Date: 2020-11-09 15:41:08.120044
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d0e93c5a4'
+down_revision = '8c2e4b6a1d0f'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+readings = sa.table('readings',
+    sa.column('id', sa.String),
+    sa.column('temp', sa.String),
+    sa.column('oximeter', sa.String),
+    sa.column('temp_value', sa.Numeric(4, 1)),
+    sa.column('oximeter_value', sa.Numeric(4, 1)),
+    sa.column('temp_text', sa.String),
+    sa.column('oximeter_text', sa.String),
+)
+
+
+def to_numeric(conn, column):
+    """
+    Readings were validated as 2-3 digits with an optional decimal before being stored, 
+    but anything that still doesn't look like a number becomes NULL rather than failing 
+    the whole migration. 
+    """
+    if conn.dialect.name == 'postgresql':
+        looks_numeric = column.op('~')(r'^\d{1,3}(\.\d+)?$')
+    else:
+        looks_numeric = sa.and_(column.op('GLOB')('[0-9]*'), column.op('NOT GLOB')('*[^0-9.]*'))
+    return sa.case([(looks_numeric, sa.cast(column, sa.Numeric(4, 1)))], else_=None)
+
+
+def copy_in_batches(conn, **values):
+    """
+    Copy column values over in id order, BATCH_SIZE rows per UPDATE, so a large readings 
+    table is never locked by one giant statement. 
+    """
+    last = ''
+    while True:
+        ids = conn.execute(
+            sa.select([readings.c.id]).where(readings.c.id > last).order_by(readings.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not ids:
+            return
+        conn.execute(
+            readings.update()
+            .where(sa.and_(readings.c.id > last, readings.c.id <= ids[-1][0]))
+            .values(**values)
+        )
+        last = ids[-1][0]
+
+
+def upgrade():
+    op.add_column('readings', sa.Column('temp_value', sa.Numeric(4, 1), nullable=True))
+    op.add_column('readings', sa.Column('oximeter_value', sa.Numeric(4, 1), nullable=True))
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        copy_in_batches(conn,
+            temp_value=to_numeric(conn, readings.c.temp),
+            oximeter_value=to_numeric(conn, readings.c.oximeter))
+    with op.batch_alter_table('readings') as batch_op:
+        batch_op.drop_column('temp')
+        batch_op.drop_column('oximeter')
+    with op.batch_alter_table('readings') as batch_op:
+        batch_op.alter_column('temp_value', new_column_name='temp')
+        batch_op.alter_column('oximeter_value', new_column_name='oximeter')
+    op.create_index('ix_readings_temp', 'readings', ['temp'], unique=False)
+    op.create_index('ix_readings_oximeter', 'readings', ['oximeter'], unique=False)
+
+
+def downgrade():
+    op.add_column('readings', sa.Column('temp_text', sa.String(), nullable=True))
+    op.add_column('readings', sa.Column('oximeter_text', sa.String(), nullable=True))
+    conn = op.get_bind()
+    with op.get_context().autocommit_block():
+        copy_in_batches(conn,
+            temp_text=sa.cast(readings.c.temp, sa.String),
+            oximeter_text=sa.cast(readings.c.oximeter, sa.String))
+    op.drop_index('ix_readings_temp', table_name='readings')
+    op.drop_index('ix_readings_oximeter', table_name='readings')
+    with op.batch_alter_table('readings') as batch_op:
+        batch_op.drop_column('temp')
+        batch_op.drop_column('oximeter')
+    with op.batch_alter_table('readings') as batch_op:
+        batch_op.alter_column('temp_text', new_column_name='temp')
+        batch_op.alter_column('oximeter_text', new_column_name='oximeter')
@@ -0,0 +1,36 @@
+"""roster events
+
+Revision ID: b84d2f6c0e19
+Revises: a7c3e5f2d104
+Create Date: 2020-12-09 11:48:03.271954
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b84d2f6c0e19'
+down_revision = 'a7c3e5f2d104'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    id_type = postgresql.UUID() if conn.dialect.name == 'postgresql' else sa.CHAR(32)
+    op.create_table('roster_event',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('kind', sa.String(), nullable=True),
+        sa.Column('user_id', id_type, nullable=True),
+        sa.Column('data', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_roster_event_created', 'roster_event', ['created'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_roster_event_created', table_name='roster_event')
+    op.drop_table('roster_event')
@@ -0,0 +1,45 @@
+"""daily summary and attendance rollups
+
+Revision ID: c6e0b3f19d27
+Revises: a52c8e1f7b34
+Create Date: 2020-11-24 15:41:09.227514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e0b3f19d27'
+down_revision = 'a52c8e1f7b34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_summary',
+        sa.Column('day', sa.String(length=10), nullable=False),
+        sa.Column('readings', sa.Integer(), nullable=True),
+        sa.Column('working', sa.Integer(), nullable=True),
+        sa.Column('not_working', sa.Integer(), nullable=True),
+        sa.Column('symptoms', sa.Integer(), nullable=True),
+        sa.Column('fever', sa.Integer(), nullable=True),
+        sa.Column('low_oximeter', sa.Integer(), nullable=True),
+        sa.Column('temp_total', sa.Numeric(precision=12, scale=1), nullable=True),
+        sa.Column('oximeter_total', sa.Numeric(precision=12, scale=1), nullable=True),
+        sa.Column('active_users', sa.Integer(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('attendance',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('month', sa.String(length=7), nullable=False),
+        sa.Column('days', sa.BigInteger(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'month')
+    )
+
+
+def downgrade():
+    op.drop_table('attendance')
+    op.drop_table('daily_summary')
@@ -0,0 +1,26 @@
+"""cache generation updated
+
+Revision ID: d2a6f4b8e731
+Revises: b84d2f6c0e19
+Create Date: 2020-12-11 10:21:37.418602
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a6f4b8e731'
+down_revision = 'b84d2f6c0e19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('cache_generation') as batch_op:
+        batch_op.add_column(sa.Column('updated', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('cache_generation') as batch_op:
+        batch_op.drop_column('updated')
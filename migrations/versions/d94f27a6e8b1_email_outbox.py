@@ -0,0 +1,42 @@
+"""email outbox
+
+Revision ID: d94f27a6e8b1
+Revises: b71d0e93c5a4
+Create Date: 2020-11-16 11:27:45.902318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd94f27a6e8b1'
+down_revision = 'b71d0e93c5a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('subject', sa.String(), nullable=True),
+        sa.Column('sender', sa.String(), nullable=True),
+        sa.Column('recipients', sa.String(), nullable=True),
+        sa.Column('body', sa.Text(), nullable=True),
+        sa.Column('html', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('next_attempt', sa.DateTime(), nullable=True),
+        sa.Column('sent', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_created', 'outbox', ['created'], unique=False)
+    op.create_index('ix_outbox_status_next_attempt', 'outbox', ['status', 'next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_status_next_attempt', table_name='outbox')
+    op.drop_index('ix_outbox_created', table_name='outbox')
+    op.drop_table('outbox')
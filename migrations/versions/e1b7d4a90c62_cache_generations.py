@@ -0,0 +1,28 @@
+"""cache generations
+
+Revision ID: e1b7d4a90c62
+Revises: c6e0b3f19d27
+Create Date: 2020-11-30 09:12:55.604381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1b7d4a90c62'
+down_revision = 'c6e0b3f19d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_generation',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('generation', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_generation')
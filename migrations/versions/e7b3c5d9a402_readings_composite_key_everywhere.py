@@ -0,0 +1,41 @@
+"""readings composite key everywhere
+
+Revision ID: e7b3c5d9a402
+Revises: d2a6f4b8e731
+Create Date: 2020-12-14 09:37:52.106244
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c5d9a402'
+down_revision = 'd2a6f4b8e731'
+branch_labels = None
+depends_on = None
+
+# a7c3e5f2d104 only gave readings the (id, reading_date) primary key on PostgreSQL, where 
+# partitioning needs it. Everywhere else readings kept its id-only key, which no longer matched 
+# the model (or what db.create_all() builds), so the other datastores get the same key here. 
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        return
+    if conn.execute('SELECT count(*) FROM readings WHERE reading_date IS NULL').scalar():
+        raise RuntimeError('Readings without a reading_date cannot be keyed on it. '
+            'Set their reading_date (the local day of created) before applying this migration.')
+    with op.batch_alter_table('readings', recreate='always') as batch_op:
+        batch_op.alter_column('reading_date', existing_type=sa.String(), nullable=False)
+        batch_op.create_primary_key('readings_pkey', ['id', 'reading_date'])
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        return
+    with op.batch_alter_table('readings', recreate='always') as batch_op:
+        batch_op.create_primary_key('readings_pkey', ['id'])
+        batch_op.alter_column('reading_date', existing_type=sa.String(), nullable=True)
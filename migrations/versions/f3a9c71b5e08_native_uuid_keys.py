@@ -0,0 +1,178 @@
+"""native uuid keys
+
+Revision ID: f3a9c71b5e08
+Revises: e1b7d4a90c62
+Create Date: 2020-12-03 10:21:37.448016
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c71b5e08'
+down_revision = 'e1b7d4a90c62'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+# every column holding a user or reading id, by table
+COLUMNS = {
+    'users': ('id',),
+    'readings': ('id', 'user_id'),
+    'roles_users': ('user_id',),
+    'attendance': ('user_id',),
+}
+
+# (table, column) -> users.id, with the names Postgres gave them when the tables were created
+FOREIGN_KEYS = (
+    ('readings', 'user_id', 'readings_user_id_fkey'),
+    ('roles_users', 'user_id', 'roles_users_user_id_fkey'),
+    ('attendance', 'user_id', 'attendance_user_id_fkey'),
+)
+
+# (table, not null column, constraint, kind, columns) rebuilt on top of the new uuid columns
+KEYS = (
+    ('users', 'id', 'users_pkey', 'PRIMARY KEY', ('id',)),
+    ('readings', 'id', 'readings_pkey', 'PRIMARY KEY', ('id',)),
+    ('readings', None, 'uq_readings_user_id_reading_date', 'UNIQUE', ('user_id', 'reading_date')),
+    ('attendance', 'user_id', 'attendance_pkey', 'PRIMARY KEY', ('user_id', 'month')),
+)
+
+
+def shadow(column):
+    return f'{column}_uuid'
+
+
+def in_batches(conn, statement):
+    """
+    Run an UPDATE that works through rows matching its own WHERE clause BATCH_SIZE at a time,
+    committing as it goes, until it stops matching anything.
+    """
+    while conn.execute(sa.text(statement), limit=BATCH_SIZE).rowcount:
+        pass
+
+
+def upgrade_postgresql(conn):
+    """
+    Postgres gets the native 16 byte uuid type, switched over without holding a lock on
+    readings for as long as it takes to rewrite it:
+
+    1. Add a nullable uuid shadow column next to each id column, with a trigger keeping it in
+       step for rows the running app inserts meanwhile.
+    2. Backfill the shadows in batches, one short transaction each.
+    3. Build the new keys' indexes CONCURRENTLY, and prove the shadows are NOT NULL with a
+       CHECK that is validated without blocking writes.
+    4. In one short transaction: drop the old columns and constraints, rename the shadows into
+       place and attach the prebuilt indexes as the primary keys and unique constraint.
+       None of these steps scan the tables. The foreign keys come back NOT VALID.
+    5. Validate the foreign keys, again without blocking writes.
+    """
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            op.add_column(table, sa.Column(shadow(column), postgresql.UUID(), nullable=True))
+        assignments = ' '.join(f'NEW.{shadow(column)} := NEW.{column}::uuid;' for column in columns)
+        conn.execute(
+            f'CREATE FUNCTION {table}_uuid_sync() RETURNS trigger AS $$ '
+            f'BEGIN {assignments} RETURN NEW; END $$ LANGUAGE plpgsql'
+        )
+        conn.execute(
+            f'CREATE TRIGGER {table}_uuid_sync BEFORE INSERT OR UPDATE ON {table} '
+            f'FOR EACH ROW EXECUTE PROCEDURE {table}_uuid_sync()'
+        )
+
+    with op.get_context().autocommit_block():
+        for table, columns in COLUMNS.items():
+            # the trigger fills in the shadows, so touching the row is enough
+            in_batches(conn,
+                f'UPDATE {table} SET {columns[0]} = {columns[0]} WHERE ctid IN ('
+                f'SELECT ctid FROM {table} WHERE {columns[0]} IS NOT NULL AND {shadow(columns[0])} IS NULL LIMIT :limit)')
+        for table, column, constraint, kind, columns in KEYS:
+            conn.execute(
+                f'CREATE UNIQUE INDEX CONCURRENTLY {constraint}_uuid ON {table} '
+                f'({", ".join(shadow(c) if c in COLUMNS[table] else c for c in columns)})'
+            )
+            if column:
+                conn.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_not_null CHECK ({shadow(column)} IS NOT NULL) NOT VALID')
+                conn.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_{column}_not_null')
+        conn.execute('CREATE INDEX CONCURRENTLY ix_readings_user_id_created_uuid ON readings (user_id_uuid, created)')
+
+    conn.execute(f'LOCK TABLE {", ".join(COLUMNS)} IN ACCESS EXCLUSIVE MODE')
+    for table, column, constraint in FOREIGN_KEYS:
+        conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT {constraint}')
+    for table, column, constraint, kind, columns in KEYS:
+        conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT {constraint}')
+    conn.execute('DROP INDEX ix_readings_user_id_created')
+    for table, columns in COLUMNS.items():
+        conn.execute(f'DROP TRIGGER {table}_uuid_sync ON {table}')
+        conn.execute(f'DROP FUNCTION {table}_uuid_sync()')
+        for column in columns:
+            conn.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+            conn.execute(f'ALTER TABLE {table} RENAME COLUMN {shadow(column)} TO {column}')
+    for table, column, constraint, kind, columns in KEYS:
+        if column:
+            # the validated CHECK lets Postgres 12+ skip the table scan here
+            conn.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL')
+            conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT {table}_{column}_not_null')
+        conn.execute(f'ALTER TABLE {table} ADD CONSTRAINT {constraint} {kind} USING INDEX {constraint}_uuid')
+    conn.execute('ALTER INDEX ix_readings_user_id_created_uuid RENAME TO ix_readings_user_id_created')
+    for table, column, constraint in FOREIGN_KEYS:
+        conn.execute(f'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) REFERENCES users (id) NOT VALID')
+
+    with op.get_context().autocommit_block():
+        for table, column, constraint in FOREIGN_KEYS:
+            conn.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}')
+
+
+def downgrade_postgresql(conn):
+    """
+    Going back is a plain type change, which rewrites the tables under lock.
+    """
+    for table, column, constraint in FOREIGN_KEYS:
+        conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT {constraint}')
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            conn.execute(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE varchar USING {column}::text')
+    for table, column, constraint in FOREIGN_KEYS:
+        conn.execute(f'ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) REFERENCES users (id)')
+
+
+def convert_sqlite(conn, to_type, where, expression):
+    """
+    SQLite has no uuid type, ids are kept as text either way, so the values are rewritten in
+    place in batches and then the column types are changed to match the models.
+    Changing a column type in SQLite copies the table, so run this one with the app stopped.
+    """
+    with op.get_context().autocommit_block():
+        for table, columns in COLUMNS.items():
+            for column in columns:
+                in_batches(conn,
+                    f'UPDATE {table} SET {column} = {expression.format(column=column)} WHERE rowid IN ('
+                    f'SELECT rowid FROM {table} WHERE {where.format(column=column)} LIMIT :limit)')
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, type_=to_type)
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        upgrade_postgresql(conn)
+    else:
+        convert_sqlite(conn, sa.CHAR(32),
+            where="{column} LIKE '%-%'",
+            expression="replace({column}, '-', '')")
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        downgrade_postgresql(conn)
+    else:
+        convert_sqlite(conn, sa.String(),
+            where="length({column}) = 32",
+            expression="substr({column}, 1, 8) || '-' || substr({column}, 9, 4) || '-' || substr({column}, 13, 4) "
+                "|| '-' || substr({column}, 17, 4) || '-' || substr({column}, 21)")
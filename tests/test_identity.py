@@ -0,0 +1,103 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import create_app, db
+from app.models import user_datastore
+from app.startup import prepare
+from config import Config
+from flask_security.utils import hash_password
+from sqlalchemy import event
+from unittest import mock
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+class IdentityQueriesTest(unittest.TestCase):
+    """
+    Loading current_user (see UserDatastore.find_user and Users.has_role) should cost one query per 
+    request however many role checks the decorators, nav and page make. Every statement a page 
+    sends is counted, and those reading users, role or roles_users must come down to that one. 
+    The pages used here don't list users themselves, so anything more is an identity query. 
+    """
+    IDENTITY_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+(?:users|role|roles_users)\b')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings = dict(TIMEZONE='America/Chicago', BOOTSTRAP_EMAIL='admin@example.com', BOOTSTRAP_USERNAME='admin', BOOTSTRAP_PASS='secret')
+        self.patches = [mock.patch.object(Config, name, value) for name, value in settings.items()]
+        for patch in self.patches:
+            patch.start()
+
+        class TestConfig(Config):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.directory, 'app.db')
+            SQLALCHEMY_BINDS = {}
+            SQLALCHEMY_ENGINE_OPTIONS = {}
+            SECURITY_PASSWORD_SALT = 'salt'
+            WTF_CSRF_ENABLED = False
+            CACHE_ENABLED = False
+
+        self.app = create_app(TestConfig)
+        prepare(self.app)
+        with self.app.app_context():
+            employee = user_datastore.create_user(email='employee@example.com', username='employee', password=hash_password('secret'))
+            user_datastore.add_role_to_user(employee, user_datastore.find_role('employee'))
+            db.session.commit()
+            self.statements = []
+            event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        with self.app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', self.count)
+            db.dispose(self.app)
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.directory)
+
+    def count(self, connection, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def identity_queries(self, client, path):
+        del self.statements[:]
+        response = client.get(path)
+        self.assertEqual(response.status_code, 200, path)
+        return [statement for statement in self.statements if self.IDENTITY_TABLES.search(statement)]
+
+    def login(self, email):
+        client = self.app.test_client()
+        response = client.post('/login', data={'email': email, 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        return client
+
+    def test_admin_pages_load_the_user_and_roles_with_one_query(self):
+        client = self.login('admin@example.com')
+        for path in ('/readings', '/users/add', '/readings/new'):
+            self.assertEqual(len(self.identity_queries(client, path)), 1, path)
+
+    def test_employee_pages_load_the_user_and_roles_with_one_query(self):
+        client = self.login('employee@example.com')
+        for path in ('/home', '/readings/new'):
+            self.assertEqual(len(self.identity_queries(client, path)), 1, path)
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
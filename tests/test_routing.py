@@ -0,0 +1,150 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import create_app, db
+from app.models import Role
+from app.routing import RoutingSQLAlchemy
+from config import Config
+from flask import Response, session
+from sqlalchemy import event
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+class RoutingTest(unittest.TestCase):
+    """
+    Read replica routing (see app.routing) against two sqlite files: one standing in for the 
+    primary and one for its replica. They're created empty and never replicate, so whichever 
+    file a row turns up in says where the statement that wrote or read it was sent. 
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        primary = 'sqlite:///' + os.path.join(self.directory, 'primary.db')
+        replica = 'sqlite:///' + os.path.join(self.directory, 'replica.db')
+
+        class TestConfig(Config):
+            SQLALCHEMY_DATABASE_URI = primary
+            SQLALCHEMY_BINDS = {'replica_0': replica}
+            SQLALCHEMY_ENGINE_OPTIONS = {}
+            REPLICA_STICKY_SECONDS = 10
+
+        self.app = create_app(TestConfig)
+        with self.app.app_context():
+            self.primary = db.get_engine(self.app)
+            self.replica = db.get_engine(self.app, bind='replica_0')
+            db.Model.metadata.create_all(self.primary)
+            db.Model.metadata.create_all(self.replica)
+            self.primary.execute(Role.__table__.insert().values(name='on-primary'))
+            self.replica.execute(Role.__table__.insert().values(name='on-replica'))
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.dispose(self.app)
+        shutil.rmtree(self.directory)
+
+    def names(self, engine):
+        return sorted(name for (name,) in engine.execute(Role.__table__.select().with_only_columns([Role.name])))
+
+    def test_reads_go_to_the_replica(self):
+        @db.read_only
+        def view():
+            return [role.name for role in Role.query.all()]
+        with self.app.test_request_context():
+            self.assertEqual(view(), ['on-replica'])
+
+    def test_without_read_only_everything_stays_on_the_primary(self):
+        with self.app.test_request_context():
+            self.assertEqual([role.name for role in Role.query.all()], ['on-primary'])
+
+    def test_flushed_writes_go_to_the_primary(self):
+        @db.read_only
+        def view():
+            db.session.add(Role(name='flushed'))
+            db.session.commit()
+        with self.app.test_request_context():
+            view()
+            self.assertTrue(db.session.info.get('wrote'))
+        self.assertEqual(self.names(self.primary), ['flushed', 'on-primary'])
+        self.assertEqual(self.names(self.replica), ['on-replica'])
+
+    def test_core_writes_go_to_the_primary(self):
+        @db.read_only
+        def view():
+            db.session.execute(Role.__table__.insert().values(name='core'))
+            Role.query.filter(Role.name == 'on-primary').update({'description': 'updated'}, synchronize_session=False)
+            db.session.commit()
+        with self.app.test_request_context():
+            view()
+            self.assertTrue(db.session.info.get('wrote'))
+        self.assertEqual(self.names(self.primary), ['core', 'on-primary'])
+        self.assertEqual(self.names(self.replica), ['on-replica'])
+        self.assertEqual(self.primary.execute("SELECT description FROM role WHERE name = 'on-primary'").scalar(), 'updated')
+
+    def test_empty_commits_are_not_writes(self):
+        @db.read_only
+        def view():
+            Role.query.all()
+            db.session.commit()
+            return db.stick_to_primary(Response())
+        with self.app.test_request_context():
+            view()
+            self.assertFalse(db.session.info.get('wrote'))
+            self.assertNotIn(RoutingSQLAlchemy.STICKY_KEY, session)
+
+    def test_rolled_back_writes_are_not_writes(self):
+        with self.app.test_request_context():
+            db.session.add(Role(name='rolled back'))
+            db.session.flush()
+            db.session.rollback()
+            db.session.commit()
+            self.assertFalse(db.session.info.get('wrote'))
+
+    def test_savepoints_leave_it_to_the_outer_transaction(self):
+        with self.app.test_request_context():
+            db.session.add(Role(name='before'))
+            db.session.flush()
+            nested = db.session.begin_nested()
+            db.session.add(Role(name='in savepoint'))
+            db.session.flush()
+            nested.rollback()
+            self.assertFalse(db.session.info.get('wrote'))
+            db.session.commit()
+            self.assertTrue(db.session.info.get('wrote'))
+        self.assertEqual(self.names(self.primary), ['before', 'on-primary'])
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        @db.read_only
+        def view():
+            return [role.name for role in Role.query.all()]
+        with self.app.test_request_context():
+            db.session.add(Role(name='written'))
+            db.session.commit()
+            db.stick_to_primary(Response())
+            self.assertGreater(session[RoutingSQLAlchemy.STICKY_KEY], time.time())
+            db.session.remove()
+            self.assertEqual(view(), ['on-primary', 'written'])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
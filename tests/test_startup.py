@@ -0,0 +1,97 @@
+"""
+The Health Tracker application is an easy way for organizations to record and 
+manage the daily vital readings of their employees, partners, contractors, etc. 
+in response to the COVID-19 pandemic. 
+
+Copyright (C) 2020 Sqirl, LLC
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Please refer to LICENSE in the project repository for details.
+"""
+from app import create_app, db, forms
+from app.startup import prepare
+from config import Config
+from sqlalchemy import event
+from unittest import mock
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+class StartupTest(unittest.TestCase):
+    """
+    prepare() (see app.startup) does the bootstrapping and warming up before the workers fork, so 
+    none of it is left for the first request to pay for. Run against an empty sqlite file, the 
+    statements of the first requests afterwards should show no sign of it: no tables or rows 
+    created, and no role lookups beyond the one that loads current_user. 
+    How long startup takes is measured by benchmarks/cold_start.py instead. 
+    """
+    BOOTSTRAP = re.compile(r'^\s*(?:CREATE|INSERT|UPDATE)\b|\bFROM role\b', re.IGNORECASE)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings = dict(TIMEZONE='America/Chicago', BOOTSTRAP_EMAIL='admin@example.com', BOOTSTRAP_USERNAME='admin', BOOTSTRAP_PASS='secret')
+        self.patches = [mock.patch.object(Config, name, value) for name, value in settings.items()]
+        # the role choices are cached per process, start from nothing like a new process would
+        self.patches.append(mock.patch.object(forms, '_roles', None))
+        for patch in self.patches:
+            patch.start()
+
+        class TestConfig(Config):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.directory, 'app.db')
+            SQLALCHEMY_BINDS = {}
+            SQLALCHEMY_ENGINE_OPTIONS = {}
+            SECURITY_PASSWORD_SALT = 'salt'
+            WTF_CSRF_ENABLED = False
+
+        self.app = create_app(TestConfig)
+        prepare(self.app)
+        with self.app.app_context():
+            self.statements = []
+            event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        with self.app.app_context():
+            event.remove(db.engine, 'before_cursor_execute', self.count)
+            db.dispose(self.app)
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.directory)
+
+    def count(self, connection, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def bootstrap_queries(self, response):
+        self.assertIn(response.status_code, (200, 302))
+        queries = [statement for statement in self.statements if self.BOOTSTRAP.search(statement)]
+        del self.statements[:]
+        return queries
+
+    def test_first_request_does_no_bootstrapping(self):
+        client = self.app.test_client()
+        self.assertEqual(self.bootstrap_queries(client.get('/login')), [])
+
+    def test_first_admin_pages_do_no_bootstrapping(self):
+        client = self.app.test_client()
+        self.assertEqual(client.post('/login', data={'email': 'admin', 'password': 'secret'}).status_code, 302)
+        del self.statements[:]
+        # current_user comes with its roles (see UserDatastore.find_user), and the add user 
+        # form's role choices were loaded by prepare
+        for path in ('/home', '/users/add'):
+            self.assertEqual(self.bootstrap_queries(client.get(path)), [], path)
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file